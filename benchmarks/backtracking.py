@@ -0,0 +1,306 @@
+"""
+Catastrophic backtracking stress test of the grammar patterns.
+
+For every pattern of every rule in the grammar, adversarial lines of
+increasing length are generated (long delimiter runs, unclosed
+emphasis, hyphenated pseudo host names, ...) and the time of a single
+search over the line is measured. The growth of the time with the
+line length is fitted to ``time ~ length ** exponent``.
+
+A rule fails if the exponent exceeds ``--max-exponent`` or a search
+over the longest line takes more than ``--budget`` seconds. Every rule
+is measured in a separate process so that an exponential pattern is
+reported as timed out instead of hanging the harness:
+
+    python -m benchmarks.backtracking
+    python -m benchmarks.backtracking --rules bold url --max-exponent 2
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import pickle
+import sys
+import time
+import traceback
+from queue import Empty
+
+from textmate import Registry, dispatch, regex
+from textmate.grammar import Include
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRAMMAR = os.path.join(ROOT, 'MarkdownLight.YAML-tmLanguage')
+
+LENGTHS = (64, 128, 256, 512, 1024, 2048)
+
+# Searches faster than that are dominated by call overhead and are not
+# used to fit the growth curve.
+NOISE_FLOOR = 2e-5
+
+
+def _generic_inputs(first):
+    """
+    Adversarial line builders derived from the characters a pattern can
+    start with: ``n`` is the approximate line length.
+    """
+    chars = sorted(first.chars) if first.chars else [ 'a' ]
+    inputs = {}
+    for c in chars[:4]:
+        if c == '\n':
+            continue
+        inputs['run of {!r}'.format(c)] = lambda n, c=c: c * n
+        inputs['spaced {!r}'.format(c)] = lambda n, c=c: (' ' + c + 'a') * (n // 3)
+        inputs['unclosed {!r}'.format(c)] = lambda n, c=c: c + 'a ' * (n // 2)
+    return inputs
+
+
+EMPHASIS_INPUTS = {
+    'delimiter run': lambda n: '*' * n,
+    'underscore run': lambda n: '_' * n,
+    'unclosed delimiters': lambda n: ' **a' * (n // 4),
+    'unclosed underscores': lambda n: '_a ' * (n // 3),
+    'intraword delimiters': lambda n: 'a*' * (n // 2),
+}
+
+URL_INPUTS = {
+    'long host': lambda n: 'http://' + 'a' * n + '!',
+    'hyphenated host': lambda n: '<http://' + 'a-' * (n // 2) + '_',
+    'dotted host': lambda n: 'http://' + 'a-a.' * (n // 4),
+    'long user': lambda n: 'ftp://' + 'a' * n + '@',
+}
+
+EMAIL_INPUTS = {
+    'long domain': lambda n: 'a@' + 'a' * n + '!',
+    'long local part': lambda n: 'a' * n + '@',
+    'dotted domain': lambda n: 'a@' + 'a-a.' * (n // 4),
+}
+
+# Lines whose begin matches give the captures substituted into end
+# patterns with backreferences.
+SAMPLE_BEGINS = ( '*a*', '_a_', '**a**', '__a__', '***a***', '___a___',
+    '~~a~~', '```', '   ```', '<div>' )
+
+SPECIFIC_INPUTS = {
+    'bold': EMPHASIS_INPUTS,
+    'italic': EMPHASIS_INPUTS,
+    'bold_italic': EMPHASIS_INPUTS,
+    'strikethrough': dict(EMPHASIS_INPUTS,
+        **{ 'tilde run': lambda n: '~' * n, 'unclosed tildes': lambda n: ' ~~a' * (n // 4) }),
+    'url': URL_INPUTS,
+    'email': EMAIL_INPUTS,
+}
+
+
+def patterns(grammar):
+    """
+    Yields ``(label, source)`` of all match, begin and end patterns of
+    the grammar. Rules nested in a repository rule are labelled with
+    the path to them, e.g. ``fenced_blocks/2``. End patterns with
+    backreferences are yielded once per distinct capture of the
+    SAMPLE_BEGINS lines, e.g. ``bold (end **)``.
+    """
+    seen = set()
+    ends = set()
+    stack = [ (name, grammar.repository_rule(name))
+        for name in sorted(grammar.raw.get('repository', {})) ]
+    stack.reverse()
+    while stack:
+        name, rule = stack.pop()
+        if isinstance(rule, Include) or rule.id in seen:
+            continue
+        seen.add(rule.id)
+        if rule.is_match():
+            yield name, rule.match_source
+        elif rule.is_begin_end():
+            yield name, rule.begin_source
+            if not rule.end_references:
+                yield name + ' (end)', rule.end_source
+            else:
+                for captures, source in end_samples(rule):
+                    if source not in ends:
+                        ends.add(source)
+                        yield '{} (end {})'.format(name, captures), source
+        stack.extend(reversed([ ('{}/{}'.format(name, i), pattern)
+            for i, pattern in enumerate(rule.patterns) ]))
+
+
+def end_samples(rule):
+    """
+    Returns ``(captures, source)`` of the end pattern of a rule with
+    the backreferences replaced by the captures of its begin pattern
+    in the SAMPLE_BEGINS lines.
+    """
+    begin = regex.compile(rule.begin_source)
+    samples = []
+    for line in SAMPLE_BEGINS:
+        match = begin.search(line)
+        if match is None:
+            continue
+        source = regex.substitute_backreferences(rule.end_source, match)
+        if source not in (s for _, s in samples):
+            captures = ' '.join(match.group(i) or ''
+                for i in rule.end_references if i <= begin.groups)
+            samples.append((captures, source))
+    return samples
+
+
+def inputs_for(name, source):
+    """
+    Returns a dictionary of line builders to stress the pattern with.
+    """
+    inputs = _generic_inputs(dispatch.first_chars(source))
+    inputs.update(SPECIFIC_INPUTS.get(name.split('/')[0].split()[0], {}))
+    return inputs
+
+
+def fit_exponent(lengths, seconds):
+    """
+    Returns the slope of the least squares line through the
+    ``(log length, log seconds)`` points, or None if there are fewer
+    than two points above the noise floor.
+    """
+    points = [ (math.log(n), math.log(t))
+        for n, t in zip(lengths, seconds) if t >= NOISE_FLOOR ]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if not variance:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def time_search(regex, line, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        regex.search(line)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def measure(name, source, lengths=LENGTHS, repeat=3):
+    """
+    Measures all stress inputs of a pattern. Returns a list of
+    ``{'input', 'lengths', 'seconds', 'exponent'}`` dictionaries.
+    """
+    compiled = regex.compile(source)
+    results = []
+    for input_name, build in sorted(inputs_for(name, source).items()):
+        lines = [ build(n) + '\n' for n in lengths ]
+        seconds = [ time_search(compiled, line, repeat) for line in lines ]
+        results.append({
+            'input': input_name,
+            'lengths': [ len(line) for line in lines ],
+            'seconds': seconds,
+            'exponent': fit_exponent([ len(line) for line in lines ], seconds),
+        })
+    return results
+
+
+def _measure_worker(queue, name, source, lengths, repeat):
+    try:
+        queue.put((measure(name, source, lengths, repeat), None))
+    except Exception as e:
+        error = e
+        try:
+            pickle.dumps(error)
+        except Exception:
+            error = RuntimeError(traceback.format_exc())
+        queue.put((None, error))
+
+
+def measure_isolated(name, source, lengths=LENGTHS, repeat=3, timeout=60.0):
+    """
+    Runs measure() in a child process. Returns None on timeout; errors
+    of the child (a bad pattern, ...) are raised again.
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure_worker,
+        args=(queue, name, source, lengths, repeat))
+    process.start()
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                results, error = queue.get(
+                    timeout=max(0.0, min(0.5, deadline - time.monotonic())))
+                break
+            except Empty:
+                if time.monotonic() >= deadline:
+                    return None
+                if not process.is_alive() and queue.empty():
+                    raise RuntimeError('measuring {} failed: the process '
+                        'exited with code {}'.format(name, process.exitcode))
+        if error is not None:
+            raise error
+        return results
+    finally:
+        process.terminate()
+        process.join()
+
+
+def check(name, source, max_exponent, budget, lengths=LENGTHS, repeat=3,
+        timeout=60.0):
+    """
+    Stresses one pattern and returns a report dictionary whose
+    ``failures`` list is empty if the pattern is within the budgets.
+    """
+    measurements = measure_isolated(name, source, lengths, repeat, timeout)
+    report = { 'rule': name, 'pattern': source, 'inputs': measurements,
+        'failures': [] }
+    if measurements is None:
+        report['failures'].append('timed out after {:.0f} s'.format(timeout))
+        return report
+    for m in measurements:
+        if m['exponent'] is not None and m['exponent'] > max_exponent:
+            report['failures'].append('{}: grows as n^{:.2f}'.format(
+                m['input'], m['exponent']))
+        if m['seconds'][-1] > budget:
+            report['failures'].append('{}: {:.3f} s for a {} character line'.format(
+                m['input'], m['seconds'][-1], m['lengths'][-1]))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--grammar', default=GRAMMAR)
+    parser.add_argument('--rules', nargs='+', help='only check these rules')
+    parser.add_argument('--lengths', nargs='+', type=int, default=list(LENGTHS))
+    parser.add_argument('--max-exponent', type=float, default=2.5,
+        help='maximum allowed growth exponent (default: %(default)s)')
+    parser.add_argument('--budget', type=float, default=1.0,
+        help='maximum seconds per search over the longest line '
+             '(default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=60.0,
+        help='seconds per rule before it is reported as timed out')
+    parser.add_argument('-o', '--output', help='write JSON results to a file')
+    args = parser.parse_args(argv)
+
+    grammar = Registry().load(args.grammar)
+    reports = []
+    for name, source in patterns(grammar):
+        if args.rules and name.split('/')[0].split()[0] not in args.rules:
+            continue
+        report = check(name, source, args.max_exponent, args.budget,
+            args.lengths, timeout=args.timeout)
+        reports.append(report)
+        exponents = [ m['exponent'] for m in report['inputs'] or ()
+            if m['exponent'] is not None ]
+        print('{:<36} {:>6} {}'.format(name,
+            'n^{:.2f}'.format(max(exponents)) if exponents else '-',
+            'FAIL: ' + '; '.join(report['failures']) if report['failures'] else 'ok'),
+            file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=2)
+            f.write('\n')
+    return 1 if any(report['failures'] for report in reports) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+Deterministic synthetic Markdown corpora for benchmarks.
+
+Every corpus kind stresses a different part of the grammar. The same
+kind, size and seed always produce the same text.
+
+>>> text = generate('emphasis', 10 * 1024)
+"""
+
+import random
+
+KB = 1024
+MB = 1024 * KB
+
+SIZES = (10 * KB, 100 * KB, MB, 10 * MB, 100 * MB)
+
+WORDS = (
+    'the of and to in is that it for on with as was by this be are from '
+    'at or an have not which but they one all were had can there their '
+    'grammar token scope rule pattern markdown syntax highlight theme '
+    'paragraph heading list quote block fence link image reference '
+    'emphasis strong inline raw text line document editor package view'
+).split()
+
+LANGUAGES = ('', 'python', 'c++', 'html', 'js', 'go', 'unknown')
+
+HTML_TAGS = ('div', 'p', 'span', 'table', 'tr', 'td', 'pre', 'section')
+
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def sentence(rng):
+    return words(rng, rng.randint(4, 14)).capitalize() + '.'
+
+
+def url(rng):
+    return '{}://{}.{}/{}'.format(rng.choice(('http', 'https', 'ftp')),
+        rng.choice(WORDS), rng.choice(('com', 'org', 'net', 'io')),
+        '/'.join(rng.choice(WORDS) for _ in range(rng.randint(0, 3))))
+
+
+def email(rng):
+    return '{}.{}@{}.{}'.format(rng.choice(WORDS), rng.choice(WORDS),
+        rng.choice(WORDS), rng.choice(('com', 'org')))
+
+
+def emphasized(rng):
+    text = words(rng, rng.randint(1, 3))
+    marker = rng.choice(('*', '**', '***', '_', '__', '~~'))
+    if rng.random() < 0.2:
+        return '`{}`'.format(text)
+    return '{0}{1}{0}'.format(marker, text)
+
+
+def prose(rng):
+    for _ in range(rng.randint(1, 5)):
+        yield ' '.join(sentence(rng) for _ in range(rng.randint(1, 4))) + '\n'
+    yield '\n'
+
+
+def lists(rng):
+    depth = 0
+    for _ in range(rng.randint(3, 30)):
+        depth = max(0, min(6, depth + rng.choice((-1, 0, 0, 1))))
+        bullet = rng.choice(('-', '*', '+', '{}.'.format(rng.randint(1, 99))))
+        yield '{}{} {}\n'.format('    ' * depth, bullet, sentence(rng))
+        if rng.random() < 0.2:
+            yield '{}{}\n'.format('    ' * (depth + 1), sentence(rng))
+    yield '\n'
+
+
+def quotes(rng):
+    level = 1
+    for _ in range(rng.randint(5, 50)):
+        level = max(1, min(8, level + rng.choice((-1, 0, 0, 1))))
+        yield '{} {}\n'.format(' '.join('>' * level), sentence(rng))
+    yield '\n'
+
+
+def emphasis(rng):
+    for _ in range(rng.randint(1, 5)):
+        parts = []
+        for _ in range(rng.randint(3, 12)):
+            parts.append(emphasized(rng) if rng.random() < 0.4
+                else words(rng, rng.randint(1, 4)))
+        yield ' '.join(parts) + '\n'
+    yield '\n'
+
+
+def links(rng):
+    for _ in range(rng.randint(1, 5)):
+        parts = []
+        for _ in range(rng.randint(2, 8)):
+            choice = rng.randint(0, 6)
+            if choice == 0:
+                parts.append(url(rng))
+            elif choice == 1:
+                parts.append('<{}>'.format(url(rng)))
+            elif choice == 2:
+                parts.append(email(rng))
+            elif choice == 3:
+                parts.append('<mailto:{}>'.format(email(rng)))
+            elif choice == 4:
+                parts.append('[{}]({} "{}")'.format(
+                    words(rng, 2), url(rng), words(rng, 2)))
+            elif choice == 5:
+                parts.append('![{}][{}]'.format(words(rng, 2), rng.choice(WORDS)))
+            else:
+                parts.append(words(rng, rng.randint(2, 6)))
+        yield ' '.join(parts) + '\n'
+    yield '[{}]: {}\n'.format(rng.choice(WORDS), url(rng))
+    yield '\n'
+
+
+def fences(rng):
+    yield '```{}\n'.format(rng.choice(LANGUAGES))
+    for _ in range(rng.randint(1, 40)):
+        yield '{}{} = {}("{}")\n'.format('    ' * rng.randint(0, 3),
+            rng.choice(WORDS), rng.choice(WORDS), words(rng, 2))
+    yield '```\n'
+    yield '\n'
+
+
+def html(rng):
+    stack = []
+    for _ in range(rng.randint(5, 60)):
+        if stack and rng.random() < 0.3:
+            yield '{}</{}>\n'.format('  ' * (len(stack) - 1), stack.pop())
+            continue
+        tag = rng.choice(HTML_TAGS)
+        yield '{}<{} class="{}">{}\n'.format('  ' * len(stack), tag,
+            rng.choice(WORDS), words(rng, rng.randint(0, 6)))
+        stack.append(tag)
+    while stack:
+        yield '{}</{}>\n'.format('  ' * (len(stack) - 1), stack.pop())
+    yield '\n'
+
+
+BLOCKS = {
+    'prose': prose,
+    'lists': lists,
+    'quotes': quotes,
+    'emphasis': emphasis,
+    'links': links,
+    'fences': fences,
+    'html': html,
+}
+
+KINDS = tuple(BLOCKS) + ('mixed',)
+
+
+def lines(kind, size, seed=0):
+    """
+    Yields the lines of a corpus of at least ``size`` characters.
+    """
+    if kind != 'mixed' and kind not in BLOCKS:
+        raise ValueError('Unknown corpus kind: {}'.format(kind))
+    rng = random.Random('{}:{}'.format(kind, seed))
+    blocks = list(BLOCKS.values())
+    total = 0
+    while total < size:
+        block = rng.choice(blocks) if kind == 'mixed' else BLOCKS[kind]
+        for line in block(rng):
+            total += len(line)
+            yield line
+
+
+def generate(kind, size, seed=0):
+    """
+    Returns a corpus of at least ``size`` characters.
+    """
+    return ''.join(lines(kind, size, seed))
@@ -0,0 +1,182 @@
+"""
+Tokenizer throughput benchmark.
+
+Tokenizes synthetic corpora (see ``corpus``) with MarkdownLight and
+reports bytes/s, tokens/s, peak memory and the 99th percentile of the
+time spent per line, as JSON:
+
+    python -m benchmarks.throughput --max-size 1M -o results.json
+
+Results can be compared against a previous run to gate grammar changes:
+
+    python -m benchmarks.throughput --baseline results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from textmate import Registry, Tokenizer
+
+from . import corpus
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRAMMAR = os.path.join(ROOT, 'MarkdownLight.tmLanguage')
+
+FORMAT_VERSION = 1
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of values falls.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def tokenize_timed(tokenizer, lines):
+    """
+    Tokenizes the lines and returns the number of tokens, the total
+    time and the time spent on every line.
+    """
+    clock = time.perf_counter
+    tokenize_line = tokenizer.tokenize_line
+    state = tokenizer.initial_state()
+    latencies = []
+    count = 0
+    started = clock()
+    for line in lines:
+        line_started = clock()
+        tokens, state = tokenize_line(line, state)
+        latencies.append(clock() - line_started)
+        count += len(tokens)
+    return count, clock() - started, latencies
+
+
+def peak_memory(tokenizer, lines):
+    """
+    Returns the peak number of bytes allocated while tokenizing, not
+    counting the text itself.
+    """
+    tracemalloc.start()
+    try:
+        state = tokenizer.initial_state()
+        for line in lines:
+            _, state = tokenizer.tokenize_line(line, state)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(kind, size, grammar=GRAMMAR, seed=0, memory=True):
+    """
+    Benchmarks one corpus and returns the result as a dictionary.
+    """
+    lines = list(corpus.lines(kind, size, seed))
+    size = sum(len(line.encode('utf-8')) for line in lines)
+    tokenizer = Tokenizer(Registry().load(grammar))
+    # Compile all patterns the corpus needs before measuring.
+    tokenizer.tokenize(''.join(lines[:1000]))
+    tokens, seconds, latencies = tokenize_timed(tokenizer, lines)
+    result = {
+        'corpus': kind,
+        'size': size,
+        'lines': len(lines),
+        'tokens': tokens,
+        'seconds': seconds,
+        'bytes_per_second': size / seconds if seconds else 0.0,
+        'tokens_per_second': tokens / seconds if seconds else 0.0,
+        'p99_line_seconds': percentile(latencies, 0.99),
+        'max_line_seconds': max(latencies) if latencies else 0.0,
+        'peak_memory': None,
+    }
+    if memory:
+        result['peak_memory'] = peak_memory(tokenizer, lines)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns descriptions of results whose throughput dropped by more
+    than ``tolerance`` (a fraction) against the baseline.
+    """
+    previous = { (r['corpus'], r['size']): r for r in baseline['results'] }
+    regressions = []
+    for result in results['results']:
+        old = previous.get((result['corpus'], result['size']))
+        if old is None:
+            continue
+        ratio = result['bytes_per_second'] / old['bytes_per_second']
+        if ratio < 1 - tolerance:
+            regressions.append('{} {}: {:.0f} -> {:.0f} bytes/s ({:+.1%})'.format(
+                result['corpus'], result['size'], old['bytes_per_second'],
+                result['bytes_per_second'], ratio - 1))
+    return regressions
+
+
+def parse_size(value):
+    units = { 'K': corpus.KB, 'M': corpus.MB }
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--kinds', nargs='+', choices=corpus.KINDS,
+        default=list(corpus.KINDS))
+    parser.add_argument('--sizes', nargs='+', type=parse_size,
+        help='corpus sizes, e.g. 10K 1M (default: all up to --max-size)')
+    parser.add_argument('--max-size', type=parse_size, default=corpus.MB)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--grammar', default=GRAMMAR)
+    parser.add_argument('--no-memory', action='store_true',
+        help='skip the (slow) peak memory measurement')
+    parser.add_argument('-o', '--output', help='write JSON results to a file')
+    parser.add_argument('--baseline', help='JSON results of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+        help='allowed throughput drop against the baseline')
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or [ s for s in corpus.SIZES if s <= args.max_size ]
+    results = {
+        'version': FORMAT_VERSION,
+        'grammar': os.path.basename(args.grammar),
+        'python': platform.python_version(),
+        'seed': args.seed,
+        'results': [],
+    }
+    for size in sizes:
+        for kind in args.kinds:
+            result = run(kind, size, args.grammar, args.seed, not args.no_memory)
+            results['results'].append(result)
+            print('{:>9} {:<8} {:>10.0f} B/s {:>10.0f} tokens/s  p99 {:.3f} ms'.format(
+                size, kind, result['bytes_per_second'],
+                result['tokens_per_second'], result['p99_line_seconds'] * 1000),
+                file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('Regression: ' + regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
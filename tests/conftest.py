@@ -0,0 +1,23 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+
+def install_sublime():
+    """
+    Installs the stand-in of the sublime module, unless the tests run
+    inside Sublime Text.
+    """
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    try:
+        import sublime
+    except ImportError:
+        from textmate import sublime
+        sublime.add_package('MarkdownLight', ROOT)
+        sys.modules['sublime'] = sublime
+
+
+install_sublime()
@@ -1,28 +1,432 @@
+import ast
+import functools
+import inspect
+import re
 import sublime
+import sys
+import textwrap
+import types
 import unittest
+import warnings
+from array import array
 
-class SyntaxTestCase(unittest.TestCase):
-    def setUp(self):
+def requires_syntax(*scopes):
+    """
+    Skips a test when there is no syntax for some of the base scopes,
+    e.g. when running headless without Sublime's default packages.
+    """
+    find_syntax_by_scope = getattr(sublime, 'find_syntax_by_scope', None)
+    missing = [ scope for scope in scopes
+        if find_syntax_by_scope and not find_syntax_by_scope(scope) ]
+    skip = unittest.skipIf(missing,
+        'no syntax for {}'.format(', '.join(missing)))
+
+    def decorator(test):
+        # The scopes are recorded for required_syntaxes().
+        test.required_syntaxes = scopes
+        return skip(test)
+    return decorator
+
+
+def required_syntaxes(test):
+    """
+    Returns the base scopes a test method requires, see
+    requires_syntax().
+    """
+    return getattr(test, 'required_syntaxes', ())
+
+
+class ViewPool:
+    """
+    Keeps one scratch view per syntax file open between tests,
+    so that views are not created and syntaxes are not reloaded
+    for every test.
+    """
+    def __init__(self):
+        self.views = {}
+
+    def acquire(self, syntax_file):
+        view = self.views.pop(syntax_file, None)
+        if view is None:
+            view = sublime.active_window().new_file()
+            view.set_scratch(True)
+            if syntax_file:
+                view.set_syntax_file(syntax_file)
+        else:
+            view.run_command("select_all")
+            view.run_command("left_delete")
+        view.settings().set('auto_indent', False)
+        return view
+
+    def release(self, view, syntax_file, reusable):
+        """
+        Returns the view to the pool. Views of failed tests and
+        views exceeding one per syntax are closed.
+        """
+        if reusable and syntax_file not in self.views:
+            self.views[syntax_file] = view
+        else:
+            self.close(view)
+
+    def close_all(self):
+        for view in self.views.values():
+            self.close(view)
+        self.views.clear()
+
+    @staticmethod
+    def close(view):
+        view.set_scratch(True)
+        view.window().focus_view(view)
+        view.window().run_command("close_file")
+
+
+def collect_texts(test_case_class, methods=None):
+    """
+    Returns string literals passed to self.set_text() in the source
+    of the test case class; only in the given test methods (and the
+    other methods) when ``methods`` is not None.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        try:
+            source = textwrap.dedent(inspect.getsource(test_case_class))
+        except (IOError, OSError, TypeError):
+            return []
+        tree = ast.parse(source)
+    excluded = set()
+    if methods is not None:
+        for node in ast.walk(tree):
+            if (isinstance(node, ast.FunctionDef)
+                    and node.name.startswith('test')
+                    and node.name not in methods):
+                excluded.update(id(child) for child in ast.walk(node))
+    texts = []
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call)
+                and id(node) not in excluded
+                and isinstance(node.func, ast.Attribute)
+                and node.func.attr == 'set_text'
+                and len(node.args) == 1):
+            text = _string_literal(node.args[0])
+            if text is not None and text not in texts:
+                texts.append(text)
+    return texts
+
+
+def collect_patterns(test_case_class):
+    """
+    Returns a dictionary of the string literal patterns passed to the
+    checks (self.check_*()) after each self.set_text() literal in the
+    test methods of the test case class.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        try:
+            source = textwrap.dedent(inspect.getsource(test_case_class))
+        except (IOError, OSError, TypeError):
+            return {}
+        tree = ast.parse(source)
+    patterns = {}
+    for function in ast.walk(tree):
+        if not isinstance(function, ast.FunctionDef):
+            continue
+        calls = sorted((node for node in ast.walk(function)
+                if isinstance(node, ast.Call)
+                    and isinstance(node.func, ast.Attribute)
+                    and len(node.args) >= 1),
+            key=lambda node: (node.lineno, node.col_offset))
+        text = None
+        for call in calls:
+            argument = call.args[0]
+            if call.func.attr == 'set_text':
+                text = _string_literal(argument)
+            elif call.func.attr.startswith('check_') and text is not None:
+                items = (argument.elts if isinstance(argument, ast.List)
+                    else [ argument ])
+                for item in items:
+                    pattern = _string_literal(item)
+                    if pattern is not None:
+                        text_patterns = patterns.setdefault(text, [])
+                        if pattern not in text_patterns:
+                            text_patterns.append(pattern)
+    return patterns
+
+
+def _string_literal(node):
+    value = getattr(node, 'value', getattr(node, 's', None))
+    return value if isinstance(value, str) else None
+
+
+class Batch:
+    """
+    Many independent texts tokenized at once in a single view.
+
+    Texts are separated by blank lines, which close all block level
+    rules (see 'block' in MarkdownLight), so every text is tokenized
+    as if it were alone in the view. Texts following a barrier that
+    still has scopes other than the base one are not batched;
+    verify() additionally compares the scopes and the matches of
+    patterns in every text with an isolated run.
+    """
+    BARRIER = '\n'
+
+    def __init__(self, syntax_file, texts):
+        self.syntax_file = syntax_file
         self.view = sublime.active_window().new_file()
+        self.view.set_scratch(True)
         self.view.settings().set('auto_indent', False)
+        if syntax_file:
+            self.view.set_syntax_file(syntax_file)
+        self.documents = {}
+        parts = []
+        offsets = []
+        offset = 0
+        for text in texts:
+            separator = self.BARRIER if text.endswith('\n') else '\n' + self.BARRIER
+            offsets.append((text, offset))
+            parts.append(text + separator)
+            offset += len(text) + len(separator)
+        self.view.run_command("insert", {"characters": ''.join(parts)})
+        base = self.view.scope_name(0).split()[:1]
+        clean = True
+        for text, offset in offsets:
+            if clean:
+                self.documents[text] = DocumentView(self.view, offset,
+                    offset + len(text))
+            barrier = offset + len(text) + (0 if text.endswith('\n') else 1)
+            clean = self.view.scope_name(barrier).split() == base
+
+    def document(self, text):
+        """
+        Returns the view of a batched text or None.
+        """
+        return self.documents.get(text)
+
+    def verify(self, patterns={}):
+        """
+        Tokenizes every batched text separately and drops texts with
+        scopes or matches of their patterns (a dictionary of texts to
+        lists of patterns, see collect_patterns()) different from the
+        batched ones. Returns the dropped texts.
+        """
+        view = sublime.active_window().new_file()
+        view.set_scratch(True)
+        view.settings().set('auto_indent', False)
+        if self.syntax_file:
+            view.set_syntax_file(self.syntax_file)
+        dropped = []
+        for text, document in list(self.documents.items()):
+            view.run_command("select_all")
+            view.run_command("left_delete")
+            view.run_command("insert", {"characters": text})
+            if (Scopes(view).items() != Scopes(document).items()
+                    or any(view.find_all(pattern) != document.find_all(pattern)
+                        for pattern in patterns.get(text, ()))):
+                del self.documents[text]
+                dropped.append(text)
+        ViewPool.close(view)
+        return dropped
+
+    def close(self):
+        ViewPool.close(self.view)
+
+
+class DocumentView:
+    """
+    A part of a view that looks like a separate view to the checks.
+    """
+    def __init__(self, view, begin, end):
+        self.view = view
+        self.offset = begin
+        self.length = end - begin
+        self.row = view.rowcol(begin)[0]
+
+    def size(self):
+        return self.length
+
+    def substr(self, x):
+        if isinstance(x, sublime.Region):
+            return self.view.substr(sublime.Region(
+                x.begin() + self.offset, x.end() + self.offset))
+        return self.view.substr(x + self.offset)
+
+    def rowcol(self, point):
+        row, col = self.view.rowcol(point + self.offset)
+        return (row - self.row, col)
+
+    def find_all(self, pattern, flags=0):
+        # Matches running into the separator after the text are
+        # clipped to its end, as they are at the end of a view.
+        end = self.offset + self.length
+        return [ sublime.Region(region.begin() - self.offset,
+                min(region.end(), end) - self.offset)
+            for region in self.view.find_all(pattern, flags)
+            if self.offset <= region.begin()
+                and (region.begin() < end or region.empty() and region.begin() == end) ]
+
+    def scope_name(self, point):
+        return self.view.scope_name(point + self.offset)
+
+    def extract_tokens_with_scopes(self, region):
+        extract = getattr(self.view, 'extract_tokens_with_scopes', None)
+        if not extract:
+            return [ (sublime.Region(pos, pos + 1), self.scope_name(pos))
+                for pos in range(region.begin(), region.end()) ]
+        return [
+            (sublime.Region(token.begin() - self.offset,
+                token.end() - self.offset), scope_name)
+            for token, scope_name in extract(sublime.Region(
+                region.begin() + self.offset, region.end() + self.offset))
+            ]
+
+
+class ResultMonitor:
+    """
+    Forwards everything to a test result and notes whether a failure
+    or an error was reported, which works with any TestResult (and
+    pytest's) without looking into unittest internals.
+    """
+    def __init__(self, result):
+        self.result = result
+        self.failed = False
+
+    def __getattr__(self, name):
+        return getattr(self.result, name)
+
+    def addFailure(self, test, err):
+        self.failed = True
+        self.result.addFailure(test, err)
+
+    def addError(self, test, err):
+        self.failed = True
+        self.result.addError(test, err)
+
+    def addUnexpectedSuccess(self, test):
+        self.failed = True
+        self.result.addUnexpectedSuccess(test)
+
+    def addSubTest(self, test, subtest, err):
+        if err is not None:
+            self.failed = True
+        self.result.addSubTest(test, subtest, err)
+
+
+class SyntaxTestCase(unittest.TestCase):
+    # Syntax file set up for every test.
+    syntax_file = None
+
+    # Tokenize the texts passed to set_text() by all test methods of
+    # the class at once, see Batch.
+    batch_texts = False
+
+    # Names of the test methods whose texts are batched, None for all
+    # of them; set by runners that run a part of the class.
+    batch_methods = None
+
+    # Compare the batched results with isolated runs and tokenize
+    # texts with different results separately.
+    batch_verify = False
+
+    # Collect the checks of a text and evaluate them together when the
+    # text changes or the test method returns, see verify_checks().
+    batch_checks = False
+
+    view_pool = ViewPool()
+
+    batch = None
+
+    def __init__(self, methodName='runTest'):
+        super().__init__(methodName)
+        method = getattr(self, methodName, None)
+        if callable(method):
+            # The collected checks of the last text are verified as
+            # part of the test method, see verify_checks().
+            # It stays a bound method, which unittest's loader expects.
+            @functools.wraps(method)
+            def test_method(self):
+                method()
+                self.verify_checks()
+            setattr(self, methodName, types.MethodType(test_method, self))
+
+    @classmethod
+    def setUpClass(cls):
+        cls.batch = None
+        if cls.batch_texts:
+            texts = collect_texts(cls, cls.batch_methods)
+            if texts:
+                cls.batch = Batch(cls.syntax_file, texts)
+                if cls.batch_verify:
+                    cls.batch.verify(collect_patterns(cls))
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.batch is not None:
+            cls.batch.close()
+            cls.batch = None
+        cls.view_pool.close_all()
+
+    def setUp(self):
+        self.pooled_view = self.view_pool.acquire(self.syntax_file)
+        self.view = self.pooled_view
+        self.view_syntax_file = self.syntax_file
+        self.pending_checks = []
         self.reset_scopes()
 
     def tearDown(self):
-        if self.view:
-            self.view.set_scratch(True)
-            self.view.window().focus_view(self.view)
-            self.view.window().run_command("close_file")
+        # Checks collected when the test method failed are dropped.
+        self.pending_checks = []
+
+    def run(self, result=None):
+        """
+        Runs the test and returns its view to the pool, unless a
+        failure or an error was reported for it.
+        """
+        if result is None:
+            result = self.defaultTestResult()
+            result.startTestRun()
+            try:
+                return self.run(result)
+            finally:
+                result.stopTestRun()
+        monitor = ResultMonitor(result)
+        try:
+            super().run(monitor)
+        finally:
+            self.release_view(not monitor.failed)
+        return result
+
+    def release_view(self, reusable):
+        if getattr(self, 'pooled_view', None):
+            self.view_pool.release(self.pooled_view, self.view_syntax_file,
+                reusable)
+            self.pooled_view = None
+            self.view = None
 
     def set_syntax_file(self, syntax_file):
-        assert(self.view)
-        self.view.set_syntax_file(syntax_file)
+        assert(self.pooled_view)
+        self.verify_checks()
+        if syntax_file != self.view_syntax_file:
+            self.pooled_view.set_syntax_file(syntax_file)
+            self.view_syntax_file = syntax_file
+        self.view = self.pooled_view
         self.reset_scopes()
 
     def set_text(self, string):
+        self.verify_checks()
+        self.reset_scopes()
+        if self.batch is not None and self.view_syntax_file == self.syntax_file:
+            document = self.batch.document(string)
+            if document is not None:
+                self.view = document
+                return
+        self.view = self.pooled_view
         self.view.run_command("select_all")
         self.view.run_command("left_delete")
         self.view.run_command("insert", {"characters": string})
-        self.reset_scopes()
+
+    # The scope of the checks is a scope selector, e.g. "markup.quote
+    # punctuation" or "markup.raw - markup.raw.inline", see
+    # ScopeSelector.
 
     def check_in_scope(self, patterns, scope):
         """
@@ -68,6 +472,11 @@ class SyntaxTestCase(unittest.TestCase):
     def check_patterns(self, patterns, scope, check):
         if type(patterns) is not list:
             patterns = [ patterns ]
+        if self.batch_checks:
+            line = self.caller_line()
+            self.pending_checks.extend((pattern, scope, check, line)
+                for pattern in patterns)
+            return
         for pattern in patterns:
             self.check_pattern(pattern, scope, check)
 
@@ -77,13 +486,66 @@ class SyntaxTestCase(unittest.TestCase):
         for region in regions:
             result = check(region, scope)
             self.assertTrue(result.passed(),
-                'Text "{}" at line {} found by /{}/ {}'.format(
-                    self.text(region),
-                    self.view.rowcol(region.begin())[0] + 1,
-                    pattern,
-                    result.reason()
-                    )
-                )
+                self.failure_message(region, pattern, result))
+
+    def failure_message(self, region, pattern, result):
+        return 'Text "{}" at line {} found by /{}/ {}'.format(
+            self.text(region),
+            self.view.rowcol(region.begin())[0] + 1,
+            pattern,
+            result.reason()
+            )
+
+    def verify_checks(self):
+        """
+        Evaluates the collected checks of the current text: the
+        patterns of all checks are searched in a single scan of the
+        text (see find_patterns()) and the found regions are checked in
+        the order of their positions, so that the scope lookups of
+        equal and neighbouring regions hit the cache of Scopes. All
+        failures are reported at once.
+        """
+        checks, self.pending_checks = self.pending_checks, []
+        if not checks:
+            return
+        found = find_patterns(self.view,
+            list(dict.fromkeys(pattern for pattern, _, _, _ in checks)))
+        failures = []
+        queries = []
+        for number, (pattern, scope, check, line) in enumerate(checks):
+            if not found[pattern]:
+                failures.append((number, 0, line,
+                    'Cannot find pattern /{}/'.format(pattern)))
+            for region in found[pattern]:
+                queries.append((region.begin(), region.end(), number, region))
+        queries.sort(key=lambda query: query[:3])
+        for begin, _, number, region in queries:
+            pattern, scope, check, line = checks[number]
+            result = check(region, scope)
+            if not result.passed():
+                failures.append((number, begin, line,
+                    self.failure_message(region, pattern, result)))
+        if failures:
+            failures.sort(key=lambda failure: failure[:2])
+            self.fail('{} of {} checks failed:\n{}'.format(
+                len(set(number for number, _, _, _ in failures)), len(checks),
+                '\n'.join('  line {}: {}'.format(line, message)
+                    for _, _, line, message in failures)))
+
+    def caller_line(self):
+        """
+        Returns the line of the test method that made a check, which
+        tells the checks apart in the report of verify_checks().
+        """
+        frame = sys._getframe(1)
+        outside = None
+        while frame is not None:
+            if frame.f_code.co_name == self._testMethodName:
+                return frame.f_lineno
+            if outside is None and frame.f_code.co_filename != __file__:
+                outside = frame.f_lineno
+            frame = frame.f_back
+        return outside
 
     def in_scope(self, region, scope):
         scope_region = self.scopes().find_first(scope, region);
@@ -127,7 +589,7 @@ class SyntaxTestCase(unittest.TestCase):
         return CheckPassed()
 
     def scopes(self):
-        if not self._scopes:
+        if self._scopes is None:
             self._scopes = Scopes(self.view)
         return self._scopes
 
@@ -143,55 +605,428 @@ class SyntaxTestCase(unittest.TestCase):
             )     
 
 
+# Patterns referring to their own groups cannot be combined.
+_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+
+
+def find_patterns(view, patterns):
+    """
+    Returns a dictionary of the regions view.find_all() finds for
+    each pattern, scanning the text of the view once.
+
+    The patterns are combined into a sequence of optional lookaheads,
+    each capturing the match of one pattern at the current position,
+    followed by a condition that at least one of them matched. Of the
+    matches of a pattern, the ones overlapping the previous match are
+    dropped, which is what successive searches do. Patterns that
+    refer to their own groups or match empty strings are searched
+    with view.find_all().
+    """
+    found = { pattern: [] for pattern in patterns }
+    combined = []
+    separate = []
+    parts = []
+    group = 1
+    for pattern in patterns:
+        try:
+            groups = re.compile(pattern, re.MULTILINE).groups
+        except re.error:
+            groups = None
+        if groups is None or _BACKREFERENCE.search(pattern):
+            separate.append(pattern)
+            continue
+        combined.append((pattern, group))
+        parts.append('(?:(?=({})))?'.format(pattern))
+        group += 1 + groups
+    condition = '(?!)'
+    for _, group in reversed(combined):
+        condition = '(?({})|{})'.format(group, condition)
+    try:
+        regex = re.compile(''.join(parts) + condition, re.MULTILINE)
+    except re.error:
+        # E.g. inline flags, which must start the whole expression.
+        regex = None
+        separate.extend(pattern for pattern, _ in combined)
+    if combined and regex is not None:
+        size = view.size()
+        # The character after the text (the separator of a batched
+        # document) is scanned too: find_all() of a document clips
+        # matches that extend past its end, see DocumentView.
+        text = view.substr(sublime.Region(0, size + 1))
+        # A match of a pattern starting before the end of its previous
+        # match is not found by successive searches; unmatched groups
+        # start at -1.
+        ends = [ 0 ] * len(combined)
+        for match in regex.finditer(text):
+            for index, (pattern, group) in enumerate(combined):
+                begin, end = match.span(group)
+                if begin < ends[index]:
+                    continue
+                if begin == end:
+                    separate.append(pattern)
+                    ends[index] = len(text) + 1
+                    continue
+                if begin < size:
+                    found[pattern].append(sublime.Region(begin, min(end, size)))
+                ends[index] = end
+    for pattern in separate:
+        found[pattern] = view.find_all(pattern)
+    return found
+
+
+class ScopeAtoms:
+    """
+    Interns scope names as integer atoms.
+
+    Every dotted prefix of an interned name ('punctuation',
+    'punctuation.definition', ...) is mapped to the set of atoms
+    starting with it, so that prefix queries are set lookups.
+    """
+    def __init__(self):
+        self.names = []
+        self.atoms = {}
+        self.prefixes = {}
+        self.split_cache = {}
+        self.stack_cache = {}
+        self.stacks = []
+        self.stack_ids = {}
+
+    def intern(self, name):
+        atom = self.atoms.get(name)
+        if atom is None:
+            atom = len(self.names)
+            self.names.append(name)
+            self.atoms[name] = atom
+            for prefix, atoms in self.prefixes.items():
+                if name.startswith(prefix):
+                    atoms.add(atom)
+            parts = name.split('.')
+            for i in range(1, len(parts) + 1):
+                self.matching('.'.join(parts[:i]))
+        return atom
+
+    def split(self, scope_name):
+        """
+        Returns atoms of a space separated list of scope names.
+        """
+        atoms = self.split_cache.get(scope_name)
+        if atoms is None:
+            atoms = frozenset(self.stack(scope_name))
+            self.split_cache[scope_name] = atoms
+        return atoms
+
+    def stack(self, scope_name):
+        """
+        Returns atoms of a space separated list of scope names as a
+        tuple, outermost first.
+        """
+        atoms = self.stack_cache.get(scope_name)
+        if atoms is None:
+            atoms = tuple(self.intern(name) for name in scope_name.split())
+            self.stack_cache[scope_name] = atoms
+        return atoms
+
+    def stack_id(self, atoms):
+        """
+        Interns a tuple of atoms, returns its number.
+        """
+        number = self.stack_ids.get(atoms)
+        if number is None:
+            number = self.stack_ids[atoms] = len(self.stacks)
+            self.stacks.append(atoms)
+        return number
+
+    def name(self, atom):
+        return self.names[atom]
+
+    def matching(self, prefix):
+        """
+        Returns atoms of all interned names starting with the prefix.
+        """
+        atoms = self.prefixes.get(prefix)
+        if atoms is None:
+            atoms = self.prefixes[prefix] = self._scan(prefix)
+        return atoms
+
+    def _scan(self, prefix):
+        return set(atom for atom, name in enumerate(self.names)
+            if name.startswith(prefix))
+
+
+ATOMS = ScopeAtoms()
+
+# Same syntax as textmate.selector.
+_EXCLUSION = re.compile(r'(?:^|\s)-(?=\s|$)')
+
+
+class ScopeSelector:
+    """
+    A TextMate scope selector compiled to sets of atoms:
+
+        markup.bold markup.italic               descendant
+        markup.italic, markup.bold              union
+        markup.raw - markup.raw.inline          exclusion
+
+    A scope matches if its own name matches the last element of an
+    alternative, the scopes enclosing it match the preceding elements
+    in order (not necessarily adjacent) and no exclusion matches its
+    stack. Results are memoized per interned stack (see
+    ScopeAtoms.stack_id).
+
+    The syntax is that of textmate.selector, but this is not
+    textmate.selector.Selector, for two reasons. The fixture also runs
+    inside Sublime Text, where the textmate package is not importable.
+    And an element matches the scope names it is a plain string prefix
+    of ('markup.under' matches 'markup.underline.link'), not only the
+    ones it is a component prefix of: that is what the checks have
+    always done with a bare scope, and a bare scope is still a valid
+    selector that must keep matching the same scopes.
+    """
+    def __init__(self, text, atoms=ATOMS):
+        self.text = text
+        self.atoms = atoms
+        self.alternatives = []
+        for alternative in text.split(','):
+            parts = _EXCLUSION.split(alternative)
+            path = self._compile_path(parts[0])
+            if path:
+                self.alternatives.append((path, [
+                    self._compile_path(part) for part in parts[1:]
+                    if part.strip() ]))
+        self.results = {}
+
+    def __repr__(self):
+        return '<ScopeSelector {!r}>'.format(self.text)
+
+    def _compile_path(self, text):
+        return [ self.atoms.matching(prefix) for prefix in text.split() ]
+
+    def matches(self, stack_id):
+        """
+        Returns whether the innermost scope of an interned stack
+        matches.
+        """
+        result = self.results.get(stack_id)
+        if result is None:
+            result = self.results[stack_id] = self._matches(
+                self.atoms.stacks[stack_id])
+        return result
+
+    def _matches(self, stack):
+        inner = len(stack) - 1
+        for path, exclusions in self.alternatives:
+            if (stack[inner] in path[-1]
+                    and self._match_path(path[:-1], stack, inner)
+                    and not any(self._match_path(exclusion, stack, inner + 1)
+                        for exclusion in exclusions)):
+                return True
+        return False
+
+    @staticmethod
+    def _match_path(path, stack, end):
+        """
+        Returns whether the elements of a path match atoms of
+        stack[:end] in order.
+        """
+        position = end - 1
+        for atoms in reversed(path):
+            while position >= 0 and stack[position] not in atoms:
+                position -= 1
+            if position < 0:
+                return False
+            position -= 1
+        return True
+
+
+_selectors = {}
+
+
+def compile_selector(text):
+    """
+    Returns the ScopeSelector of a selector string, compiling it once.
+    """
+    selector = _selectors.get(text)
+    if selector is None:
+        selector = _selectors[text] = ScopeSelector(text)
+    return selector
+
+
 class Scopes:
+    """
+    Scopes of a view as parallel arrays of begin and end positions
+    and scope name atoms.
+    """
     EMPTY_REGION = sublime.Region(0,0)
 
     def __init__(self, view):
-        self.scopes = self._make_scopes_list(view)
+        begins, ends, atoms, stacks = self._make_scopes_list(view)
+        # Scopes are ordered by end position and, for equal ends, from
+        # the innermost (latest begin) to the outermost one. find_first()
+        # returns the first matching scope in this order.
+        order = sorted(range(len(atoms)), key=lambda i: (
+            ends[i], -begins[i], ATOMS.name(atoms[i])
+            ))
+        self.begins = array('l', (begins[i] for i in order))
+        self.ends = array('l', (ends[i] for i in order))
+        self.atoms = array('l', (atoms[i] for i in order))
+        # Interned stacks of the scopes: the scope and the scopes
+        # enclosing it where it begins.
+        self.stacks = array('l', (stacks[i] for i in order))
+        self.index = IntervalIndex(self.begins, self.ends)
+        self.found = {}
+
+    def __len__(self):
+        return len(self.atoms)
+
+    def __iter__(self):
+        """
+        Yields (scope name, region) pairs.
+        """
+        for i in range(len(self.atoms)):
+            yield ATOMS.name(self.atoms[i]), self.region(i)
 
-    def find_first(self, scope_prefix, region):
-        scopes = self._find_by_region(region)
-        for scope in scopes:
-            if scope['name'].startswith(scope_prefix):
-                return scope['region']
+    def region(self, i):
+        return sublime.Region(self.begins[i], self.ends[i])
+
+    def items(self):
+        """
+        Returns the set of (scope name, begin, end) tuples.
+        """
+        return set((ATOMS.name(self.atoms[i]), self.begins[i], self.ends[i])
+            for i in range(len(self.atoms)))
+
+    def find_first(self, scope_selector, region):
+        """
+        Returns the region of the first scope intersecting the region
+        that matches a scope selector (see ScopeSelector), or an empty
+        region.
+        """
+        selector = compile_selector(scope_selector)
+        for i in self._find_by_region(region):
+            if selector.matches(self.stacks[i]):
+                return self.region(i)
         return self.EMPTY_REGION
 
     def number_of_scopes(self, region):
-        return len(list(self._find_by_region(region)))
+        return len(self._find_by_region(region))
 
     def _find_by_region(self, region):
-        return filter(lambda scope: (
-            scope['region'].intersects(region)
-            ), self.scopes)
+        key = (region.begin(), region.end())
+        found = self.found.get(key)
+        if found is None:
+            found = self.found[key] = self.index.find(*key)
+        return found
 
     @staticmethod
     def _make_scopes_list(view):
-        scopes = []
+        begins = array('l')
+        ends = array('l')
+        atoms = array('l')
+        stacks = array('l')
         begin = dict()
-        open_scopes = set()
-        for pos in range(0, view.size()):
-            pos_scopes = set(view.scope_name(pos).split())
+        stack_of = dict()
+        open_scopes = frozenset()
+        for pos, scope_name in Scopes._scope_runs(view):
+            pos_scopes = ATOMS.split(scope_name)
             ended_scopes = open_scopes.difference(pos_scopes)
             new_scopes = pos_scopes.difference(open_scopes)
 
-            for scope in new_scopes:
-                begin[scope] = pos
+            if new_scopes:
+                stack = ATOMS.stack(scope_name)
+                for scope in new_scopes:
+                    begin[scope] = pos
+                    stack_of[scope] = ATOMS.stack_id(
+                        stack[:stack.index(scope) + 1])
 
             for scope in ended_scopes:
-                scopes.append({
-                    'name': scope,
-                    'region': sublime.Region(begin[scope],pos)
-                })
+                begins.append(begin[scope])
+                ends.append(pos)
+                atoms.append(scope)
+                stacks.append(stack_of[scope])
 
             open_scopes = pos_scopes
 
         for scope in open_scopes:
-            scopes.append({
-                'name': scope,
-                'region': sublime.Region(begin[scope],view.size())
-            })
+            begins.append(begin[scope])
+            ends.append(view.size())
+            atoms.append(scope)
+            stacks.append(stack_of[scope])
+
+        return begins, ends, atoms, stacks
+
+    @staticmethod
+    def _scope_runs(view):
+        """
+        Returns (position, scope name) pairs for the points where
+        the scope name changes.
+        """
+        runs = []
+        last = None
+        extract = getattr(view, 'extract_tokens_with_scopes', None)
+        if extract:
+            tokens = ((region.begin(), scope_name) for region, scope_name
+                in extract(sublime.Region(0, view.size())))
+        else:
+            tokens = ((pos, view.scope_name(pos))
+                for pos in range(0, view.size()))
+        for pos, scope_name in tokens:
+            if scope_name != last:
+                runs.append((pos, scope_name))
+                last = scope_name
+        return runs
+
+
+class IntervalIndex:
+    """
+    Static interval tree over parallel arrays of begins and ends.
+
+    Intervals are stored sorted by begin as an implicit balanced
+    binary tree in which every node keeps the maximum end of its
+    subtree, so that intersection queries take O(log n + k).
+    """
+    def __init__(self, begins, ends):
+        self.order = array('l', sorted(range(len(begins)),
+            key=lambda i: (begins[i], ends[i])))
+        self.begins = array('l', (begins[i] for i in self.order))
+        self.ends = array('l', (ends[i] for i in self.order))
+        self.max_ends = array('l', self.ends)
+        self._build(0, len(self.ends))
+
+    def find(self, begin, end):
+        """
+        Returns sorted indices of the intervals intersecting [begin, end)
+        the same way sublime.Region.intersects() does.
+        """
+        found = []
+        self._find(0, len(self.ends), begin, end, found)
+        found.sort()
+        return found
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return -1
+        mid = (lo + hi) // 2
+        max_end = self.ends[mid]
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child > max_end:
+                max_end = child
+        self.max_ends[mid] = max_end
+        return max_end
 
-        return scopes
+    def _find(self, lo, hi, begin, end, found):
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.max_ends[mid] < begin:
+                return
+            self._find(lo, mid, begin, end, found)
+            b = self.begins[mid]
+            if b > end:
+                return
+            e = self.ends[mid]
+            if ((b == begin and e == end) or
+                    (b >= begin and b < end) or (begin >= b and begin < e)):
+                found.append(self.order[mid])
+            lo = mid + 1
 
 
 class CheckResult:
@@ -0,0 +1,314 @@
+"""
+Runs syntax tests in parallel with the stand-in of the sublime module.
+
+The test methods are split into one shard per worker process. Every
+worker installs the stand-in and loads the syntax files of the test
+classes once, in the initializer of the pool, then runs its shards
+with the class fixtures (setUpClass, batched texts) of a serial run;
+the batch of a shard only has the texts of its own tests (see
+SyntaxTestCase.batch_methods).
+
+Shards are balanced with the durations of the previous runs, recorded
+in ``tests/.test-durations.json``: the longest tests are assigned
+first, each to the shard with the least work so far; tests without a
+recorded duration count as the median one.
+
+The results are merged into a single unittest report in the order of
+the tests, and the exit status is that of ``python -m unittest``:
+
+    python tests/run_parallel.py
+    python tests/run_parallel.py -j 4 -v test_markdown_light.TestMarkdownLight
+"""
+
+import json
+import os
+import sys
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TESTS)
+DURATIONS = os.path.join(TESTS, '.test-durations.json')
+DEFAULT_TESTS = [ 'test_markdown_light.TestMarkdownLight' ]
+
+
+def _setup_path():
+    for path in (ROOT, TESTS):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    from conftest import install_sublime
+    install_sublime()
+
+
+def _flatten(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from _flatten(test)
+        else:
+            yield test
+
+
+def test_ids(names):
+    """
+    Returns the ids of the test methods of modules, classes or methods.
+    """
+    return [ test.id() for test in
+        _flatten(unittest.defaultTestLoader.loadTestsFromNames(names)) ]
+
+
+def syntax_files(ids):
+    """
+    Returns the syntax files of the test classes of the tests.
+    """
+    files = []
+    for test in _flatten(unittest.defaultTestLoader.loadTestsFromNames(ids)):
+        syntax_file = getattr(test, 'syntax_file', None)
+        if syntax_file and syntax_file not in files:
+            files.append(syntax_file)
+    return files
+
+
+def load_durations(path=DURATIONS):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_durations(durations, path=DURATIONS):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(durations, f, indent=1, sort_keys=True)
+
+
+def shard(ids, count, durations):
+    """
+    Splits tests into ``count`` shards of about the same total
+    duration. The tests of a shard keep their order, so that tests of
+    a class stay together.
+    """
+    known = sorted(durations[test] for test in ids if test in durations)
+    default = known[len(known) // 2] if known else 1.0
+    order = { test: index for index, test in enumerate(ids) }
+    shards = [ [] for _ in range(min(count, len(ids))) ]
+    totals = [ 0.0 ] * len(shards)
+    for test in sorted(ids, key=lambda test: -durations.get(test, default)):
+        index = totals.index(min(totals))
+        shards[index].append(test)
+        totals[index] += durations.get(test, default)
+    return [ sorted(tests, key=order.get) for tests in shards if tests ]
+
+
+class ShardResult(unittest.TestResult):
+    """
+    Records the outcome and duration of every test as plain data that
+    can be sent back from a worker: ``(id, description, short
+    description, outcome, details, seconds, subtests)``, ``subtests``
+    being ``(id, description, short description, outcome, details)``
+    of its failed subtests. The outcome of a test whose failures are
+    all in subtests is None, as unittest reports nothing else for it.
+    """
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self._started = None
+        self._subtests = []
+        self._recorded = False
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._started = time.perf_counter()
+        self._subtests = []
+        self._recorded = False
+
+    def stopTest(self, test):
+        if not self._recorded:
+            self._record(test, None)
+        super().stopTest(test)
+
+    def _record(self, test, outcome, details=None):
+        seconds = (time.perf_counter() - self._started
+            if self._started is not None else 0.0)
+        self.records.append((test.id(), str(test), test.shortDescription(),
+            outcome, details, seconds, self._subtests))
+        self._recorded = True
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._record(test, 'success')
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._record(test, 'failure', self.failures[-1][1])
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._record(test, 'error', self.errors[-1][1])
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._record(test, 'skip', reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._record(test, 'expected_failure', self.expectedFailures[-1][1])
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._record(test, 'unexpected_success')
+
+    def addSubTest(self, test, subtest, err):
+        # Like TextTestResult, only failed subtests are reported.
+        super().addSubTest(test, subtest, err)
+        if err is None:
+            return
+        if issubclass(err[0], test.failureException):
+            outcome, details = 'failure', self.failures[-1][1]
+        else:
+            outcome, details = 'error', self.errors[-1][1]
+        self._subtests.append((subtest.id(), str(subtest),
+            subtest.shortDescription(), outcome, details))
+
+
+def _initialize_worker(files):
+    _setup_path()
+    import sublime
+    for syntax_file in files:
+        sublime.registry().load(sublime.resource_path(syntax_file))
+
+
+def _run_shard(ids):
+    suite = unittest.defaultTestLoader.loadTestsFromNames(ids)
+    methods = {}
+    for test in _flatten(suite):
+        methods.setdefault(type(test), set()).add(test.id().rsplit('.', 1)[1])
+    for test_class, names in methods.items():
+        if hasattr(test_class, 'batch_methods'):
+            test_class.batch_methods = names
+    result = ShardResult()
+    suite.run(result)
+    return result.records
+
+
+class RemoteTest:
+    """
+    Stands for a test that ran in a worker in the merged report.
+    """
+    def __init__(self, test_id, description, short_description):
+        self._id = test_id
+        self._description = description
+        self._short_description = short_description
+
+    def id(self):
+        return self._id
+
+    def __str__(self):
+        return self._description
+
+    def shortDescription(self):
+        return self._short_description
+
+
+class MergedResult(unittest.TextTestResult):
+    """
+    A text result fed with the records of the workers; failures and
+    errors arrive as formatted tracebacks.
+    """
+    def _exc_info_to_string(self, err, test):
+        if isinstance(err, str):
+            return err
+        return super()._exc_info_to_string(err, test)
+
+    def add_record(self, record):
+        (test_id, description, short_description, outcome, details, _,
+            subtests) = record
+        test = RemoteTest(test_id, description, short_description)
+        self.startTest(test)
+        # Failed subtests count as failures, not as tests, like in
+        # unittest.
+        for subtest_record in subtests:
+            subtest = RemoteTest(*subtest_record[:3])
+            if subtest_record[3] == 'failure':
+                self.addFailure(subtest, subtest_record[4])
+            else:
+                self.addError(subtest, subtest_record[4])
+        if outcome == 'success':
+            self.addSuccess(test)
+        elif outcome == 'failure':
+            self.addFailure(test, details)
+        elif outcome == 'error':
+            self.addError(test, details)
+        elif outcome == 'skip':
+            self.addSkip(test, details)
+        elif outcome == 'expected_failure':
+            self.addExpectedFailure(test, details)
+        elif outcome == 'unexpected_success':
+            self.addUnexpectedSuccess(test)
+        self.stopTest(test)
+
+
+def run(names=DEFAULT_TESTS, workers=None, stream=None, verbosity=1,
+        durations_path=DURATIONS):
+    """
+    Runs the tests in a process pool and returns the merged
+    MergedResult.
+    """
+    _setup_path()
+    stream = unittest.runner._WritelnDecorator(stream or sys.stderr)
+    ids = test_ids(names)
+    durations = load_durations(durations_path) if durations_path else {}
+    workers = workers or os.cpu_count() or 1
+    shards = shard(ids, workers, durations)
+
+    start = time.perf_counter()
+    records = []
+    if shards:
+        with ProcessPoolExecutor(len(shards), initializer=_initialize_worker,
+                initargs=(syntax_files(ids),)) as pool:
+            for shard_records in pool.map(_run_shard, shards):
+                records.extend(shard_records)
+    seconds = time.perf_counter() - start
+
+    order = { test: index for index, test in enumerate(ids) }
+    records.sort(key=lambda record: order.get(record[0], len(order)))
+    result = MergedResult(stream, True, verbosity)
+    for record in records:
+        result.add_record(record)
+    result.printErrors()
+    stream.writeln(result.separator2)
+    stream.writeln('Ran {} test{} in {:.3f}s ({} workers)'.format(
+        result.testsRun, '' if result.testsRun == 1 else 's', seconds,
+        len(shards)))
+    stream.writeln()
+    summary = []
+    for label, items in (('failures', result.failures),
+            ('errors', result.errors), ('skipped', result.skipped)):
+        if items:
+            summary.append('{}={}'.format(label, len(items)))
+    stream.writeln('{}{}'.format('OK' if result.wasSuccessful() else 'FAILED',
+        ' ({})'.format(', '.join(summary)) if summary else ''))
+
+    if durations_path:
+        durations.update((record[0], record[5]) for record in records
+            if record[3] == 'success')
+        save_durations(durations, durations_path)
+    return result
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('tests', nargs='*', default=DEFAULT_TESTS,
+        help='test modules, classes or methods (default: %(default)s)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+        help='worker processes (default: the number of CPUs)')
+    parser.add_argument('-v', '--verbose', action='store_const', const=2,
+        default=1, dest='verbosity')
+    args = parser.parse_args(argv)
+    result = run(args.tests, args.workers, verbosity=args.verbosity)
+    return 0 if result.wasSuccessful() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import unittest
+
+from benchmarks import backtracking, corpus, throughput
+from textmate import Registry, regex
+
+
+class TestCorpus(unittest.TestCase):
+    def test_deterministic(self):
+        for kind in corpus.KINDS:
+            text = corpus.generate(kind, 4 * corpus.KB)
+            self.assertEqual(text, corpus.generate(kind, 4 * corpus.KB), kind)
+            self.assertNotEqual(text, corpus.generate(kind, 4 * corpus.KB, 1), kind)
+            self.assertGreaterEqual(len(text), 4 * corpus.KB)
+            self.assertTrue(text.endswith('\n'))
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            corpus.generate('tables', corpus.KB)
+
+
+class TestThroughput(unittest.TestCase):
+    def test_run(self):
+        result = throughput.run('mixed', 2 * corpus.KB)
+        self.assertGreaterEqual(result['size'], 2 * corpus.KB)
+        self.assertGreater(result['tokens'], result['lines'])
+        self.assertGreater(result['bytes_per_second'], 0)
+        self.assertGreater(result['peak_memory'], 0)
+        self.assertLessEqual(result['p99_line_seconds'], result['max_line_seconds'])
+
+    def test_compare(self):
+        def results(speed):
+            return { 'results': [ { 'corpus': 'prose', 'size': 10,
+                'bytes_per_second': speed } ] }
+        self.assertEqual(throughput.compare(results(95), results(100), 0.1), [])
+        self.assertEqual(len(throughput.compare(results(80), results(100), 0.1)), 1)
+
+    def test_parse_size(self):
+        self.assertEqual(throughput.parse_size('10K'), 10 * corpus.KB)
+        self.assertEqual(throughput.parse_size('100MB'), 100 * corpus.MB)
+        self.assertEqual(throughput.parse_size('512'), 512)
+
+
+class TestBacktracking(unittest.TestCase):
+    def test_fit_exponent(self):
+        lengths = [ 100, 200, 400, 800 ]
+        quadratic = [ 1e-6 * n * n for n in lengths ]
+        self.assertAlmostEqual(backtracking.fit_exponent(lengths, quadratic), 2.0)
+        self.assertIsNone(backtracking.fit_exponent(lengths, [ 1e-7 ] * 4))
+
+    def test_patterns_cover_nested_rules(self):
+        grammar = Registry().load(backtracking.GRAMMAR)
+        names = [ name for name, _ in backtracking.patterns(grammar) ]
+        self.assertIn('bold', names)
+        self.assertIn('heading (end)', names)
+        self.assertIn('fenced_blocks/0', names)
+        self.assertIn('bold (end **)', names)
+        self.assertIn('italic (end _)', names)
+        self.assertEqual(len(names), len(set(names)))
+
+    def test_emphasis_within_budget(self):
+        grammar = Registry().load(backtracking.GRAMMAR)
+        source = dict(backtracking.patterns(grammar))['italic']
+        report = backtracking.check('italic', source, max_exponent=2.5,
+            budget=1.0, lengths=(64, 128, 256))
+        self.assertEqual(report['failures'], [])
+
+    def test_catastrophic_pattern_times_out(self):
+        report = backtracking.check('nested', r'(a+)+b', max_exponent=2.5,
+            budget=1.0, lengths=(16, 32, 64), repeat=1, timeout=1.0)
+        self.assertEqual(report['failures'], [ 'timed out after 1 s' ])
+
+    def test_end_pattern_within_budget(self):
+        grammar = Registry().load(backtracking.GRAMMAR)
+        source = dict(backtracking.patterns(grammar))['bold (end **)']
+        self.assertEqual(source, r'(?<=\S)\*\*(?=[_\*]*($|\W))')
+        report = backtracking.check('bold (end **)', source, max_exponent=2.5,
+            budget=1.0, lengths=(64, 128, 256))
+        self.assertEqual(report['failures'], [])
+        self.assertIn('delimiter run', [ m['input'] for m in report['inputs'] ])
+
+    def test_errors_are_raised_again(self):
+        with self.assertRaises(regex.RegexError):
+            backtracking.check('broken', '(a', max_exponent=2.5, budget=1.0,
+                lengths=(16, 32), repeat=1, timeout=30.0)
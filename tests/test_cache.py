@@ -0,0 +1,126 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from textmate import Registry, Tokenizer, cache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRAMMAR = os.path.join(ROOT, 'MarkdownLight.tmLanguage')
+
+TEXT = '# A\n\n- *B* <http://c.org>\n\n```\nD\n```\n'
+
+
+def _put_concurrently(directory):
+    tokenizer = Tokenizer(Registry().load(GRAMMAR))
+    token_cache = cache.TokenCache(directory, tokenizer)
+    for _ in range(5):
+        token_cache.put(TEXT, tokenizer.tokenize(TEXT))
+        with token_cache.tokenize(TEXT) as tokens:
+            assert list(tokens) == tokenizer.tokenize(TEXT)
+
+
+class TestTokenCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tokenizer = Tokenizer(Registry().load(GRAMMAR))
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_round_trip(self):
+        token_cache = cache.TokenCache(self.directory, self.tokenizer)
+        expected = self.tokenizer.tokenize(TEXT)
+        with token_cache.tokenize(TEXT) as tokens:
+            self.assertEqual(list(tokens), expected)
+        with token_cache.tokenize(TEXT) as tokens:
+            self.assertEqual(len(tokens), len(expected))
+            self.assertEqual(tokens[-1], expected[-1])
+            self.assertEqual(tokens[3], expected[3])
+        self.assertEqual((token_cache.hits, token_cache.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        size = len(cache.encode(self.tokenizer.tokenize('A 0\n')))
+        token_cache = cache.TokenCache(self.directory, self.tokenizer,
+            max_bytes=size * 2)
+        for text in ('A 0\n', 'A 1\n'):
+            token_cache.tokenize(text).close()
+        os.utime(token_cache.path('A 0\n'), (0, 0))
+        token_cache.tokenize('A 2\n').close()
+        self.assertFalse(os.path.exists(token_cache.path('A 0\n')))
+        self.assertTrue(os.path.exists(token_cache.path('A 1\n')))
+        self.assertTrue(os.path.exists(token_cache.path('A 2\n')))
+
+    def test_entry_larger_than_the_cache(self):
+        text = '*A* **B** _c_\n' * 20
+        token_cache = cache.TokenCache(self.directory, self.tokenizer,
+            max_bytes=100)
+        with token_cache.tokenize(text) as tokens:
+            self.assertEqual(list(tokens), self.tokenizer.tokenize(text))
+        self.assertFalse(os.path.exists(token_cache.path(text)))
+
+    def test_grammar_change_invalidates_its_entries_only(self):
+        grammar_path = os.path.join(self.directory, 'Test.tmLanguage.json')
+        other_path = os.path.join(self.directory, 'Other.tmLanguage.json')
+        directory = os.path.join(self.directory, 'cache')
+
+        def write(path, scope_name, name):
+            with open(path, 'w') as f:
+                json.dump({ 'scopeName': scope_name,
+                    'patterns': [ { 'match': 'a', 'name': name } ] }, f)
+
+        def make_cache(path):
+            return cache.TokenCache(directory,
+                Tokenizer(Registry().load(path)))
+
+        write(grammar_path, 'source.test', 'keyword')
+        write(other_path, 'source.other', 'keyword')
+        old = make_cache(grammar_path)
+        old.tokenize('a\n').close()
+        other = make_cache(other_path)
+        other.tokenize('a\n').close()
+
+        write(grammar_path, 'source.test', 'constant')
+        new = make_cache(grammar_path)
+        self.assertNotEqual(new.grammar_hash, old.grammar_hash)
+        self.assertFalse(os.path.exists(old.path('a\n')))
+        self.assertTrue(os.path.exists(other.path('a\n')))
+        with new.tokenize('a\n') as tokens:
+            self.assertEqual(tokens[0][2], ('source.test', 'constant'))
+
+    def test_engine_change_invalidates_entries(self):
+        old = cache.TokenCache(self.directory, self.tokenizer)
+        old.tokenize(TEXT).close()
+        engine_hash = cache.engine_hash()
+        self.addCleanup(setattr, cache, '_engine_hash', engine_hash)
+        cache._engine_hash = 'another version'
+        new = cache.TokenCache(self.directory, self.tokenizer)
+        self.assertNotEqual(new.grammar_hash, old.grammar_hash)
+        self.assertFalse(os.path.exists(old.path(TEXT)))
+        self.assertIsNone(new.get(TEXT))
+
+    def test_stale_temporary_files_are_evicted(self):
+        token_cache = cache.TokenCache(self.directory, self.tokenizer)
+        stale = os.path.join(token_cache.grammar_directory, 'stale.tmp')
+        fresh = os.path.join(token_cache.grammar_directory, 'fresh.tmp')
+        for path in (stale, fresh):
+            with open(path, 'wb') as f:
+                f.write(b'partial')
+        os.utime(stale, (0, 0))
+        token_cache.evict()
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+
+    def test_concurrent_writers(self):
+        processes = [ multiprocessing.Process(target=_put_concurrently,
+            args=(self.directory,)) for _ in range(4) ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual([ p.exitcode for p in processes ], [ 0 ] * 4)
+        token_cache = cache.TokenCache(self.directory, self.tokenizer)
+        self.assertEqual(len(token_cache.entries()), 1)
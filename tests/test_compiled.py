@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import fixture
+import test_markdown_light
+
+from textmate import Registry, RegexError, Tokenizer, compiled, regex
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE = os.path.join(ROOT, 'MarkdownLight.YAML-tmLanguage')
+
+
+class TestCompiledGrammar(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.directory,
+            'MarkdownLight' + compiled.COMPILED_EXTENSION)
+        cls.source = Registry().load(SOURCE)
+        compiled.write(cls.source, cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_output_path(self):
+        self.assertEqual(compiled.output_path(SOURCE),
+            os.path.join(ROOT, 'MarkdownLight.compiled-tmLanguage'))
+
+    def test_same_tokens_as_source(self):
+        texts = fixture.collect_texts(test_markdown_light.TestMarkdownLight)
+        with open(os.path.join(ROOT, 'demo', 'DEMO.md'), encoding='utf-8') as f:
+            texts.append(f.read())
+        expected = Tokenizer(self.source)
+        eager = Tokenizer(Registry().load(self.path))
+        lazy = Tokenizer(Registry(lazy=True).load(self.path))
+        for text in texts:
+            tokens = expected.tokenize(text)
+            self.assertEqual(eager.tokenize(text), tokens, text)
+            self.assertEqual(lazy.tokenize(text), tokens, text)
+
+    def test_rules_are_resolved(self):
+        grammar = Registry().load(self.path)
+        self.assertEqual(grammar.scope_name, self.source.scope_name)
+        self.assertEqual(grammar.root.name, self.source.root.name)
+        for name in self.source.raw['repository']:
+            loaded = grammar._repository[name]
+            self.assertEqual(
+                [ (rule.name, rule.match_source, rule.begin_source)
+                    for rule in loaded.candidates() ],
+                [ (rule.name, rule.match_source, rule.begin_source)
+                    for rule in self.source.repository_rule(name).candidates() ],
+                name)
+        url = grammar.repository_rule('url')
+        self.assertEqual(url._first_chars.required, ('://', '.'))
+
+    def test_lazy_compilation(self):
+        grammar = Registry(lazy=True).load(self.path)
+        Tokenizer(grammar).tokenize('Some *text*\n')
+        cache = grammar.registry.regex_cache
+        # Searched separately but skipped: the text has no "://".
+        url = cache.static[grammar.repository_rule('url').match_source]
+        self.assertIsInstance(url, regex.LazyPattern)
+        self.assertIsNone(url.compiled)
+        # Only compiled as part of the fused regex of the root rule.
+        html_block = cache.static[
+            grammar.repository_rule('html_block').begin_source]
+        self.assertIsNone(html_block.compiled)
+        # Never reached.
+        self.assertNotIn(
+            grammar.repository_rule('unnumbered_list_item').begin_source,
+            cache.static)
+
+    def test_version_mismatch(self):
+        with open(self.path, 'rb') as f:
+            data = bytearray(f.read())
+        data[4] += 1
+        path = os.path.join(self.directory, 'old' + compiled.COMPILED_EXTENSION)
+        with open(path, 'wb') as f:
+            f.write(data)
+        with self.assertRaisesRegex(ValueError, 'rebuild'):
+            Registry().load(path)
+        self.assertTrue(compiled.is_stale(path, SOURCE))
+        self.assertFalse(compiled.is_stale(self.path, SOURCE))
+
+    def test_changed_source_is_loaded_instead(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, 'Test.tmLanguage.json')
+        path = compiled.output_path(source)
+        with open(source, 'w') as f:
+            f.write('{ "scopeName": "text.test", "patterns": '
+                '[ { "match": "a", "name": "old" } ] }')
+        compiled.write(Registry().load(source), path)
+        self.assertEqual(Tokenizer(Registry().load(path)).tokenize('a'),
+            [ (0, 1, ('text.test', 'old')) ])
+        with open(source, 'w') as f:
+            f.write('{ "scopeName": "text.test", "patterns": '
+                '[ { "match": "a", "name": "new" } ] }')
+        self.assertTrue(compiled.is_stale(path, source))
+        grammar = Registry().load(path)
+        self.assertEqual(grammar.path, source)
+        self.assertEqual(Tokenizer(grammar).tokenize('a'),
+            [ (0, 1, ('text.test', 'new')) ])
+        self.assertEqual(sorted(os.listdir(directory)),
+            sorted([ 'Test.tmLanguage.json', os.path.basename(path) ]))
+
+    def test_invalid_pattern(self):
+        grammar = Registry().load(SOURCE)
+        broken = dict(grammar.raw, repository=dict(grammar.raw['repository'],
+            broken={ 'match': '(a' }))
+        with self.assertRaises(RegexError):
+            compiled.build(type(grammar)(broken))
+
+
+class TestLazyPattern(unittest.TestCase):
+    def test_compiled_on_first_use(self):
+        pattern = regex.LazyPattern(r'(a)(\x{62})')
+        self.assertEqual((pattern.pattern, pattern.groups), (r'(a)(\u0062)', 2))
+        self.assertIsNone(pattern.compiled)
+        self.assertEqual(pattern.search('xab').span(), (1, 3))
+        self.assertIsNotNone(pattern.compiled)
+
+    def test_error_on_first_use(self):
+        pattern = regex.LazyPattern(r'(?<=a+)b')
+        with self.assertRaises(RegexError):
+            pattern.search('ab')
@@ -0,0 +1,98 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from textmate import Theme, export
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MARKDOWN = 'text.html.markdown'
+
+
+class TestExport(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.exporter = export.Exporter()
+        cls.stylesheet = cls.exporter.stylesheet
+
+    def test_classes(self):
+        theme = self.stylesheet.theme
+        self.assertEqual(self.stylesheet.classes(theme.default_style), '')
+        heading = theme.style((MARKDOWN, 'markup.heading.1.markdown'))
+        classes = self.stylesheet.classes(heading)
+        self.assertEqual(classes.split()[1:], [ 'tm-bold' ])
+        self.assertIn('.{} {{ color: {}; }}'.format(classes.split()[0],
+            heading.foreground), self.stylesheet.css())
+
+    def test_spans_are_coalesced(self):
+        tokens = [ (0, 1, (MARKDOWN,)), (1, 2, (MARKDOWN, 'meta.x')),
+            (2, 4, (MARKDOWN, 'markup.bold.markdown')),
+            (4, 5, (MARKDOWN, 'markup.bold.markdown', 'meta.y')) ]
+        bold = self.stylesheet.classes(self.stylesheet.theme.style(tokens[2][2]))
+        self.assertEqual(self.stylesheet.spans(tokens),
+            [ (0, 2, ''), (2, 5, bold) ])
+
+    def test_render(self):
+        out = io.StringIO()
+        self.exporter.render(out, '# <A> & B\n\nC\n', 'a.md', '../style.css')
+        html = out.getvalue()
+        self.assertIn('<link rel="stylesheet" href="../style.css">', html)
+        self.assertIn('&lt;A&gt; &amp; B', html)
+        self.assertIn('B\n</span>\nC\n</pre>', html)
+        self.assertNotIn('style=', html)
+
+    def test_export_tree(self):
+        source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        os.makedirs(os.path.join(source, 'sub'))
+        shutil.copy(os.path.join(ROOT, 'demo', 'DEMO.md'), source)
+        shutil.copy(os.path.join(ROOT, 'README.md'),
+            os.path.join(source, 'sub', 'readme.markdown'))
+        with open(os.path.join(source, 'sub', 'notes.txt'), 'w') as f:
+            f.write('not exported\n')
+        self.assertEqual(export.find_files(source),
+            [ 'DEMO.md', os.path.join('sub', 'readme.markdown') ])
+
+        outputs = []
+        for workers in (0, 2):
+            output = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, output)
+            stats = export.export_tree(source, output, workers=workers)
+            self.assertEqual(stats['files'], 2)
+            self.assertEqual(stats['bytes'],
+                os.path.getsize(os.path.join(ROOT, 'demo', 'DEMO.md'))
+                + os.path.getsize(os.path.join(ROOT, 'README.md')))
+            pages = []
+            for name in ('style.css', 'DEMO.md.html',
+                    os.path.join('sub', 'readme.markdown.html')):
+                with open(os.path.join(output, name), encoding='utf-8') as f:
+                    pages.append(f.read())
+            outputs.append(pages)
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertIn('href="../style.css"', outputs[0][2])
+
+    def test_dark_theme(self):
+        stylesheet = export.Stylesheet(
+            Theme.load(os.path.join(ROOT, 'MarkdownDark.tmTheme')), 'dark')
+        self.assertTrue(stylesheet.css().startswith('pre.dark {'))
+
+    def test_default_font_style_is_reset(self):
+        theme = Theme({ 'settings': [
+            { 'settings': { 'foreground': '#000000', 'fontStyle': 'bold' } },
+            { 'scope': 'plain', 'settings': { 'fontStyle': '' } },
+            { 'scope': 'emphasis', 'settings': { 'fontStyle': 'italic' } },
+            { 'scope': 'strong', 'settings': { 'fontStyle': 'bold italic' } },
+        ] })
+        stylesheet = export.Stylesheet(theme)
+        self.assertEqual(stylesheet.classes(theme.style(('plain',))),
+            'tm-no-bold')
+        self.assertEqual(stylesheet.classes(theme.style(('emphasis',))),
+            'tm-no-bold tm-italic')
+        self.assertEqual(stylesheet.classes(theme.style(('strong',))),
+            'tm-italic')
+        self.assertEqual(stylesheet.classes(theme.style(('other',))), '')
+        css = stylesheet.css()
+        self.assertIn('.tm-no-bold { font-weight: normal; }', css)
+        self.assertNotIn('tm-no-italic', css)
@@ -0,0 +1,300 @@
+import fixture
+import unittest
+import sublime
+import test_markdown_light
+
+TEXT = '''
+# A *B*
+
+- C **D**
+- E `F`
+
+> G [H](I)
+
+```
+J
+```
+'''
+
+
+class PerCharacterView:
+    """
+    Hides extract_tokens_with_scopes() to force per character
+    scope extraction.
+    """
+    def __init__(self, view):
+        self.view = view
+
+    def size(self):
+        return self.view.size()
+
+    def scope_name(self, pos):
+        return self.view.scope_name(pos)
+
+
+def as_set(scopes):
+    return set((name, region.begin(), region.end())
+        for name, region in scopes)
+
+
+class TestScopes(fixture.SyntaxTestCase):
+    syntax_file = "Packages/MarkdownLight/MarkdownLight.tmLanguage"
+
+    def setUp(self):
+        super().setUp()
+        self.set_text(TEXT)
+
+    def test_scope_runs_match_per_character_scopes(self):
+        self.assertEqual(
+            as_set(fixture.Scopes(self.view)),
+            as_set(fixture.Scopes(PerCharacterView(self.view))))
+
+    def test_base_scope_covers_text(self):
+        region = self.scopes().find_first('text.html.markdown',
+            sublime.Region(0, 1))
+        self.assertEqual(region, sublime.Region(0, self.view.size()))
+
+
+class TestIntervalIndex(unittest.TestCase):
+    def test_matches_region_intersects(self):
+        intervals = [ (b, b + size) for b in range(0, 20, 3)
+            for size in (0, 1, 4, 9) ]
+        index = fixture.IntervalIndex(
+            [ b for b, _ in intervals ], [ e for _, e in intervals ])
+        for begin in range(0, 25):
+            for end in range(begin, 30, 2):
+                query = sublime.Region(begin, end)
+                expected = [ i for i, (b, e) in enumerate(intervals)
+                    if sublime.Region(b, e).intersects(query) ]
+                self.assertEqual(index.find(begin, end), expected)
+
+
+class TestScopeAtoms(unittest.TestCase):
+    def test_prefix_lookup(self):
+        atoms = fixture.ScopeAtoms()
+        bold = atoms.intern('punctuation.definition.bold.markdown')
+        italic = atoms.intern('punctuation.definition.italic.markdown')
+        link = atoms.intern('markup.underline.link.markdown')
+        self.assertEqual(atoms.matching('punctuation.definition'),
+            { bold, italic })
+        self.assertEqual(atoms.matching('markup'), { link })
+        self.assertEqual(atoms.matching('markup.under'), { link })
+        self.assertEqual(atoms.matching('meta'), set())
+        meta = atoms.intern('meta.link.inline.markdown')
+        self.assertEqual(atoms.matching('meta'), { meta })
+
+    def test_split_reuses_atoms(self):
+        atoms = fixture.ScopeAtoms()
+        self.assertEqual(atoms.split('text.html.markdown markup.bold.markdown '),
+            { atoms.intern('text.html.markdown'),
+              atoms.intern('markup.bold.markdown') })
+        self.assertEqual(len(atoms.names), 2)
+
+
+class TestScopeSelector(unittest.TestCase):
+    def matches(self, text, scope_name):
+        atoms = fixture.ScopeAtoms()
+        stack_id = atoms.stack_id(atoms.stack(scope_name))
+        return fixture.ScopeSelector(text, atoms).matches(stack_id)
+
+    def test_descendant(self):
+        selector = 'markup.bold markup.italic'
+        self.assertTrue(self.matches(selector,
+            'text.html.markdown markup.bold.markdown meta.x markup.italic.markdown'))
+        self.assertFalse(self.matches(selector,
+            'text.html.markdown markup.italic.markdown markup.bold.markdown'))
+        # The innermost scope must match the last element.
+        self.assertFalse(self.matches(selector,
+            'markup.bold.markdown markup.italic.markdown meta.x'))
+
+    def test_union_and_exclusion(self):
+        selector = 'markup.raw - markup.raw.inline, meta.dummy.line-break'
+        self.assertTrue(self.matches(selector, 'text markup.raw.block.markdown'))
+        self.assertFalse(self.matches(selector, 'text markup.raw.inline.markdown'))
+        self.assertTrue(self.matches(selector, 'text meta.dummy.line-break'))
+        self.assertFalse(self.matches('markup - meta.paragraph',
+            'meta.paragraph.list markup.bold'))
+
+    def test_compiled_once(self):
+        selector = fixture.compile_selector('markup.quote punctuation')
+        self.assertIs(fixture.compile_selector('markup.quote punctuation'),
+            selector)
+
+
+class TestViewPool(fixture.SyntaxTestCase):
+    syntax_file = "Packages/MarkdownLight/MarkdownLight.tmLanguage"
+
+    def test_view_is_reused_and_cleared(self):
+        self.set_text('A')
+        view = self.view
+        self.tearDown()
+        self.release_view(True)
+        self.setUp()
+        self.assertIs(self.view, view)
+        self.assertEqual(self.view.size(), 0)
+
+    def test_view_of_failed_test_is_closed(self):
+        view = self.pooled_view
+        self.view_pool.release(view, self.view_syntax_file, False)
+        self.pooled_view = self.view_pool.acquire(self.syntax_file)
+        self.assertIsNot(self.pooled_view, view)
+        self.assertNotIn(view, view.window().views())
+
+    def test_release_depends_on_result(self):
+        views = []
+
+        class Case(fixture.SyntaxTestCase):
+            syntax_file = self.syntax_file
+            view_pool = fixture.ViewPool()
+
+            def test_pass(self):
+                views.append(self.view)
+
+            def test_fail(self):
+                views.append(self.view)
+                self.fail()
+
+            def test_subtest_fail(self):
+                views.append(self.view)
+                with self.subTest(0):
+                    self.fail()
+
+        for name, reused in (('test_pass', True), ('test_fail', False),
+                ('test_subtest_fail', False)):
+            result = unittest.TestResult()
+            Case(name).run(result)
+            self.assertEqual(result.wasSuccessful(), reused, name)
+            self.assertEqual(Case.view_pool.views.get(self.syntax_file) is views[-1],
+                reused, name)
+            Case.view_pool.close_all()
+
+
+class TestBatch(unittest.TestCase):
+    syntax_file = "Packages/MarkdownLight/MarkdownLight.tmLanguage"
+
+    def make_batch(self, texts):
+        batch = fixture.Batch(self.syntax_file, texts)
+        self.addCleanup(batch.close)
+        return batch
+
+    def test_documents_match_isolated_runs(self):
+        texts = fixture.collect_texts(test_markdown_light.TestMarkdownLight)
+        self.assertGreater(len(texts), 50)
+        patterns = fixture.collect_patterns(test_markdown_light.TestMarkdownLight)
+        self.assertIn(r'\*\*B\*\*',
+            patterns['\nA **B** __C__ D\n**E**\n'])
+        batch = self.make_batch(texts)
+        self.assertEqual(len(batch.documents), len(texts))
+        self.assertEqual(batch.verify(patterns), [])
+
+    def test_document_offsets(self):
+        batch = self.make_batch([ 'A *B*', '\n> C\n' ])
+        document = batch.document('\n> C\n')
+        self.assertEqual(document.size(), 5)
+        self.assertEqual(document.substr(sublime.Region(1, 4)), '> C')
+        self.assertEqual(document.rowcol(3), (1, 2))
+        self.assertEqual(document.find_all('C'), [ sublime.Region(3, 4) ])
+        self.assertEqual(document.find_all('B'), [])
+        scopes = fixture.Scopes(document)
+        self.assertEqual(scopes.find_first('markup.quote', sublime.Region(3, 4)),
+            sublime.Region(1, 5))
+        self.assertEqual(scopes.find_first('markup.quote punctuation',
+            sublime.Region(1, 4)), sublime.Region(1, 2))
+        self.assertTrue(scopes.find_first('markup.quote - text',
+            sublime.Region(1, 4)).empty())
+
+    def test_open_block_is_not_batched(self):
+        batch = self.make_batch([ '```\nA\n', 'B\n' ])
+        self.assertIsNotNone(batch.document('```\nA\n'))
+        self.assertIsNone(batch.document('B\n'))
+
+    def test_matches_are_clipped_to_the_document(self):
+        batch = self.make_batch([ 'A\n', 'B' ])
+        self.assertEqual(batch.document('A\n').find_all(r'\n+'),
+            [ sublime.Region(1, 2) ])
+        self.assertEqual(batch.document('B').find_all(r'B\n*'),
+            [ sublime.Region(0, 1) ])
+        self.assertEqual(batch.document('B').find_all(r'\n'), [])
+        self.assertEqual(batch.document('A\n').find_all('^'),
+            [ sublime.Region(0, 0), sublime.Region(2, 2) ])
+        self.assertEqual(batch.verify({ 'A\n': [ r'\n+', '^' ],
+            'B': [ r'B\n*' ] }), [])
+
+    def test_verify_compares_matches(self):
+        batch = self.make_batch([ 'A\n', 'B\n' ])
+        self.assertEqual(batch.verify({ 'B\n': [ r'(?<=\n)B' ] }), [ 'B\n' ])
+
+    def test_verify_drops_texts_depending_on_state(self):
+        batch = self.make_batch([ '- A\n', '    B\n' ])
+        self.assertEqual(batch.verify(), [ '    B\n' ])
+        self.assertIsNone(batch.document('    B\n'))
+
+
+class TestBatchedChecks(fixture.SyntaxTestCase):
+    syntax_file = "Packages/MarkdownLight/MarkdownLight.tmLanguage"
+    batch_checks = True
+
+    PATTERNS = [ r'\*+', r'\*\*?', r'(\w)\1', r'(?<=\n)\w', r'^', 'x*',
+        r'B\n', r'\n+', r'(?i)c', 'Z' ]
+
+    def test_find_patterns_matches_find_all(self):
+        self.set_text('A *B* **CC**\n\nD\n')
+        found = fixture.find_patterns(self.view, self.PATTERNS)
+        for pattern in self.PATTERNS:
+            self.assertEqual(found[pattern], self.view.find_all(pattern),
+                pattern)
+        batch = fixture.Batch(self.syntax_file, [ 'A\nB', 'C\n' ])
+        self.addCleanup(batch.close)
+        for text in ('A\nB', 'C\n'):
+            document = batch.document(text)
+            found = fixture.find_patterns(document, self.PATTERNS)
+            for pattern in self.PATTERNS:
+                self.assertEqual(found[pattern], document.find_all(pattern),
+                    pattern)
+
+    def test_failures_are_reported_together(self):
+        self.set_text('A *B* **C**\n')
+        self.check_eq_scope([ r'\*B\*', r'\*\*C\*\*' ], 'markup.bold')
+        self.check_eq_scope('Z', 'markup.bold')
+        self.check_in_scope('A', 'text')
+        self.assertEqual(len(self.pending_checks), 4)
+        with self.assertRaises(AssertionError) as context:
+            self.verify_checks()
+        lines = str(context.exception).splitlines()
+        self.assertEqual(lines[0], '2 of 4 checks failed:')
+        self.assertIn('Text "*B*" at line 1 found by /\\*B\\*/ should have '
+            'scope "markup.bold"', lines[1])
+        self.assertIn('Cannot find pattern /Z/', lines[2])
+        self.assertEqual(self.pending_checks, [])
+
+    def test_pending_checks_fail_the_test(self):
+        class Case(fixture.SyntaxTestCase):
+            syntax_file = self.syntax_file
+            batch_checks = True
+            view_pool = fixture.ViewPool()
+
+            def test_wrong_check(self):
+                self.set_text('A *B*\n')
+                self.check_eq_scope(r'\*B\*', 'markup.bold')
+
+            def test_failed_check(self):
+                self.set_text('A *B*\n')
+                self.check_eq_scope(r'\*B\*', 'markup.bold')
+                self.fail('first')
+
+        result = unittest.TestResult()
+        Case('test_wrong_check').run(result)
+        Case('test_failed_check').run(result)
+        Case.view_pool.close_all()
+        self.assertEqual(len(result.failures), 2)
+        self.assertIn('1 of 1 checks failed', result.failures[0][1])
+        # Checks of a test that already failed are not reported.
+        self.assertIn('AssertionError: first', result.failures[1][1])
+        self.assertNotIn('checks failed', result.failures[1][1])
+
+    def test_loaded_by_name(self):
+        suite = unittest.defaultTestLoader.loadTestsFromName(
+            'test_fixture.TestViewPool.test_view_is_reused_and_cleared')
+        result = unittest.TestResult()
+        suite.run(result)
+        self.assertEqual((result.testsRun, result.wasSuccessful()), (1, True))
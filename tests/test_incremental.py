@@ -0,0 +1,78 @@
+import os
+import random
+import unittest
+
+from textmate import Registry, Tokenizer
+from textmate.incremental import Document
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRAMMAR = os.path.join(ROOT, 'MarkdownLight.tmLanguage')
+
+PARAGRAPHS = [
+    'A *B* C\n',
+    '# D\n',
+    '- E\n- **F**\n',
+    '> G\n> H\n',
+    '```\nI\n```\n',
+    '<div>\nJ\n</div>\n',
+    '[K](L) http://M.com\n',
+    '    N\n',
+]
+
+
+class TestDocument(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tokenizer = Tokenizer(Registry().load(GRAMMAR))
+
+    def document(self, text):
+        return Document(self.tokenizer, text)
+
+    def assertTokenizedLikeWhole(self, document):
+        self.assertEqual(document.tokens(),
+            self.tokenizer.tokenize(document.text))
+
+    def test_initial_text(self):
+        text = '\n'.join(PARAGRAPHS)
+        document = self.document(text)
+        self.assertEqual(document.text, text)
+        self.assertTokenizedLikeWhole(document)
+
+    def test_edit_inside_paragraph_rescans_only_edited_line(self):
+        document = self.document('\n'.join(PARAGRAPHS * 20))
+        begin = document.text.index('B')
+        self.assertEqual(document.replace(begin, begin + 1, '_X_'), 1)
+        self.assertTokenizedLikeWhole(document)
+
+    def test_opening_fence_rescans_until_state_converges(self):
+        text = 'A\n\nB\n\nC\n\n```\nD\n```\n\nE\n\nF\n'
+        document = self.document(text)
+        rescanned = document.replace(text.index('B'), text.index('B'), '```\n')
+        self.assertGreater(rescanned, 2)
+        self.assertLess(rescanned, document.line_count())
+        self.assertTokenizedLikeWhole(document)
+
+    def test_fence_backreference_is_part_of_state(self):
+        document = self.document('```\nA\n```\n\nB\n')
+        document.replace(0, 0, ' ')
+        self.assertTokenizedLikeWhole(document)
+
+    def test_multiline_insert_and_delete(self):
+        document = self.document('A\nB\nC\n')
+        document.replace(2, 2, '> X\n> Y\n\n')
+        self.assertEqual(document.text, 'A\n> X\n> Y\n\nB\nC\n')
+        self.assertTokenizedLikeWhole(document)
+        document.replace(0, len(document.text) - 2, '')
+        self.assertEqual(document.text, 'C\n')
+        self.assertTokenizedLikeWhole(document)
+
+    def test_random_edits(self):
+        rng = random.Random(1)
+        document = self.document('\n'.join(PARAGRAPHS))
+        for _ in range(200):
+            size = len(document.text)
+            begin = rng.randint(0, size)
+            end = min(size, begin + rng.randint(0, 10))
+            document.replace(begin, end, rng.choice(PARAGRAPHS + [
+                '', '\n', '*', '`', '```\n', '</div>', ' ' ]))
+            self.assertTokenizedLikeWhole(document)
@@ -1,9 +1,9 @@
 import fixture
 
 class TestMarkdownLight(fixture.SyntaxTestCase):
-    def setUp(self):
-        super().setUp()
-        self.set_syntax_file("Packages/MarkdownLight/MarkdownLight.tmLanguage")
+    syntax_file = "Packages/MarkdownLight/MarkdownLight.tmLanguage"
+    batch_texts = True
+    batch_checks = True
 
     def check_default(self, patterns):
         self.check_in_single_scope(patterns, 'text')
@@ -280,6 +280,7 @@ L
         self.check_eq_scope('`+', 'punctuation.definition')
         self.check_default([ r'\nK\n', r'L\n\n' ])
 
+    @fixture.requires_syntax('source.c++', 'source.python')
     def test_syntax_highlighting_inside_fenced_blocks(self):
         self.set_text('''
 ``` c++
@@ -474,7 +475,7 @@ D
 D
 ''')
         self.check_eq_scope(r'0\. A\n1\. B\n\d+\. C\n', 'meta.paragraph.list')
-        self.check_eq_scope([ r'0\.', r'1\.', '12345\.' ], 'punctuation.definition')
+        self.check_eq_scope([ r'0\.', r'1\.', r'12345\.' ], 'punctuation.definition')
         self.check_default(r'D')
 
     def test_nested_lists(self):
@@ -845,6 +846,7 @@ Z
         self.check_eq_scope(r'~+|_+|\*+', 'punctuation.definition')
         self.check_default('Z')
 
+    @fixture.requires_syntax('text.html.basic')
     def test_html_tags(self):
         self.set_text('''
 A<br>
@@ -865,6 +867,7 @@ A<br>
 ''')
         self.check_no_scope(list('ABCDEF'), 'markup')
 
+    @fixture.requires_syntax('text.html.basic')
     def test_inline_markup_combined_with_html(self):
         self.set_text('<a>_A_</a>')
         self.check_eq_scope('_A_', 'markup.italic')
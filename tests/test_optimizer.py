@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import fixture
+import test_markdown_light
+
+from textmate import Grammar, load_grammar_file, optimizer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE = os.path.join(ROOT, 'MarkdownLight.YAML-tmLanguage')
+
+GRAMMAR = {
+    'scopeName': 'text.test',
+    'patterns': [ { 'include': '#block' } ],
+    'repository': {
+        'block': {
+            'begin': '^(?=\\S)',
+            'end': '^$',
+            'patterns': [ { 'include': '#inline' } ],
+        },
+        'inline': {
+            'patterns': [
+                { 'include': '#bold' },
+                { 'name': 'star', 'match': '\\*' },
+                { 'include': '#bold' },
+                { 'include': '#emphasis' },
+            ],
+        },
+        'emphasis': { 'include': '#bold_star' },
+        'bold': { 'name': 'bold', 'match': '\\*\\*' },
+        'bold_star': { 'name': 'bold.star', 'match': '\\*\\*\\*' },
+        'unused': { 'name': 'unused', 'match': 'x' },
+    },
+}
+
+
+class TestOptimizer(unittest.TestCase):
+    def test_include_graph(self):
+        graph = optimizer.include_graph(GRAMMAR)
+        self.assertEqual(graph['$self'], [ 'block' ])
+        self.assertEqual(graph['inline'], [ 'bold', 'emphasis' ])
+        self.assertEqual(optimizer.reachable(graph),
+            { '$self', 'block', 'inline', 'bold', 'emphasis', 'bold_star' })
+
+    def test_inline_pure_pattern_lists(self):
+        raw, inlined = optimizer.inline(GRAMMAR)
+        self.assertEqual(inlined, [ '#emphasis', '#inline' ])
+        self.assertEqual(raw['repository']['block']['patterns'], [
+            { 'include': '#bold' },
+            { 'name': 'star', 'match': '\\*' },
+            { 'include': '#bold_star' },
+        ])
+        self.assertEqual(optimizer.pure_includes(GRAMMAR), 2)
+
+    def test_unreachable_and_shadowed_rules(self):
+        raw, report = optimizer.optimize(GRAMMAR)
+        self.assertEqual(report['unreachable'], [ 'unused' ])
+        self.assertEqual(report['removed'],
+            [ 'bold_star', 'emphasis', 'inline', 'unused' ])
+        self.assertEqual(report['pure_includes'], (2, 0))
+        # "**" matches wherever "***" matches.
+        self.assertEqual([ (owner, label, by, reason)
+            for owner, _, label, by, reason in report['shadowed'] ], [
+            ('block', 'bold_star', 'bold', 'prefix') ])
+        self.assertEqual(raw['repository']['block']['patterns'], [
+            { 'include': '#bold' },
+            { 'name': 'star', 'match': '\\*' },
+        ])
+        raw, report = optimizer.optimize(GRAMMAR, keep=[ 'unused' ])
+        self.assertIn('unused', raw['repository'])
+
+    def test_empty_begin_does_not_shadow(self):
+        raw = {
+            'patterns': [
+                { 'begin': '(?=a)', 'end': 'a' },
+                { 'begin': '(?=a)', 'end': 'b' },
+                { 'match': '(a)' },
+                { 'match': '(a)' },
+            ],
+        }
+        _, shadowed = optimizer.remove_shadowed(raw)
+        self.assertEqual([ (index, reason) for _, index, _, _, reason in shadowed ],
+            [ (3, 'duplicate') ])
+
+    def test_markdown_light_is_equivalent(self):
+        raw = load_grammar_file(SOURCE)
+        optimized, report = optimizer.optimize(raw)
+        self.assertIn('#inline', report['inlined'])
+        self.assertIn('#fenced_blocks', report['inlined'])
+        self.assertEqual(report['pure_includes'][1], 0)
+        texts = fixture.collect_texts(test_markdown_light.TestMarkdownLight)
+        with open(os.path.join(ROOT, 'demo', 'DEMO.md'), encoding='utf-8') as f:
+            texts.append(f.read())
+        self.assertEqual(
+            optimizer.verify(Grammar(raw), Grammar(optimized), texts), [])
+
+    def test_write_grammar_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        raw, _ = optimizer.optimize(GRAMMAR)
+        for name in ('a.tmLanguage', 'a.tmLanguage.json', 'a.YAML-tmLanguage'):
+            path = os.path.join(directory, name)
+            optimizer.write_grammar_file(raw, path)
+            self.assertEqual(load_grammar_file(path), raw, name)
+
+    def test_yaml_has_no_aliases(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        raw, _ = optimizer.optimize(load_grammar_file(SOURCE))
+        path = os.path.join(directory, 'a.YAML-tmLanguage')
+        optimizer.write_grammar_file(raw, path)
+        with open(path, encoding='utf-8') as f:
+            data = f.read()
+        self.assertNotIn('&id', data)
+        self.assertNotIn('*id', data)
+        self.assertEqual(load_grammar_file(path), raw)
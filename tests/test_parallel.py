@@ -0,0 +1,43 @@
+import os
+import unittest
+
+from benchmarks import corpus
+from textmate import Registry, Tokenizer, parallel
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRAMMAR = os.path.join(ROOT, 'MarkdownLight.tmLanguage')
+
+
+class TestParallel(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.serial = Tokenizer(Registry().load(GRAMMAR))
+        cls.parallel = parallel.ParallelTokenizer(GRAMMAR, workers=2,
+            min_chunk=2 * corpus.KB)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.parallel.close()
+
+    def test_split_points(self):
+        lines = [ 'A\n', '\n', '```\n', '\n', '```\n', '\n', 'B\n' ]
+        self.assertEqual(parallel.split_points(lines, 0), [ 2, 6 ])
+
+    def test_same_tokens_as_serial(self):
+        text = corpus.generate('mixed', 32 * corpus.KB)
+        self.assertEqual(self.parallel.tokenize(text), self.serial.tokenize(text))
+        self.assertGreater(self.parallel.stats['chunks'], 4)
+
+    def test_fallback_when_chunk_does_not_start_in_root_state(self):
+        text = ('- A\n' + 'B\n' * 1000 + '\n    C\n' + 'D\n' * 1000
+            + '\n' + 'E\n' * 1000)
+        stats = dict(self.parallel.stats)
+        self.assertEqual(self.parallel.tokenize(text), self.serial.tokenize(text))
+        self.assertEqual(self.parallel.stats['fallback'] - stats['fallback'], 1)
+
+    def test_encode(self):
+        tokens = [ (0, 2, ('a',)), (2, 3, ('a', 'b')), (3, 5, ('a',)) ]
+        flat, stacks = parallel.encode(tokens)
+        self.assertEqual(len(stacks), 2)
+        self.assertEqual(parallel.decode(flat, stacks, 10),
+            [ (b + 10, e + 10, s) for b, e, s in tokens ])
@@ -0,0 +1,87 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import run_parallel
+
+
+class SampleCase(unittest.TestCase):
+    # Only run by TestRunParallel in the workers.
+    __test__ = False
+
+    def test_pass(self):
+        pass
+
+    def test_fail(self):
+        self.fail('expected failure')
+
+    def test_error(self):
+        raise ValueError('expected error')
+
+    def test_skip(self):
+        self.skipTest('expected skip')
+
+    def test_subtests(self):
+        for number in range(3):
+            with self.subTest(number=number):
+                if number == 1:
+                    self.fail('expected subtest failure')
+                if number == 2:
+                    raise ValueError('expected subtest error')
+
+
+class TestRunParallel(unittest.TestCase):
+    def test_shard_balances_durations(self):
+        durations = { 'a': 5.0, 'b': 3.0, 'c': 2.0, 'd': 2.0, 'e': 1.0 }
+        shards = run_parallel.shard(list('abcdef'), 2, durations)
+        self.assertEqual(sorted(sum(shards, [])), list('abcdef'))
+        totals = [ sum(durations.get(test, 2.0) for test in tests)
+            for tests in shards ]
+        self.assertLessEqual(abs(totals[0] - totals[1]), 1.0)
+        for tests in shards:
+            self.assertEqual(tests, sorted(tests))
+        self.assertEqual(run_parallel.shard([ 'a' ], 4, {}), [ [ 'a' ] ])
+
+    def test_merged_report(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        durations = os.path.join(directory, 'durations.json')
+        stream = io.StringIO()
+        result = run_parallel.run([ 'test_run_parallel.SampleCase',
+            'test_fixture.TestScopeSelector' ], workers=2, stream=stream,
+            durations_path=durations)
+        # As many tests as python -m unittest counts.
+        self.assertEqual(result.testsRun, 8)
+        self.assertEqual([ test.id() for test, _ in result.failures ],
+            [ 'test_run_parallel.SampleCase.test_fail',
+              'test_run_parallel.SampleCase.test_subtests (number=1)' ])
+        self.assertIn('expected failure', result.failures[0][1])
+        self.assertIn('expected subtest failure', result.failures[1][1])
+        self.assertEqual([ test.id() for test, _ in result.errors ],
+            [ 'test_run_parallel.SampleCase.test_error',
+              'test_run_parallel.SampleCase.test_subtests (number=2)' ])
+        self.assertIn('ValueError: expected error', result.errors[0][1])
+        self.assertIn('ValueError: expected subtest error', result.errors[1][1])
+        self.assertEqual(result.skipped[0][1], 'expected skip')
+        self.assertIn('FAILED (failures=2, errors=2, skipped=1)',
+            stream.getvalue())
+        recorded = run_parallel.load_durations(durations)
+        self.assertNotIn('test_run_parallel.SampleCase.test_subtests', recorded)
+        self.assertIn('test_run_parallel.SampleCase.test_pass', recorded)
+        self.assertNotIn('test_run_parallel.SampleCase.test_fail', recorded)
+
+    def test_shard_batches_its_own_texts(self):
+        import fixture
+        import test_markdown_light
+        test_class = test_markdown_light.TestMarkdownLight
+        all_texts = fixture.collect_texts(test_class)
+        texts = fixture.collect_texts(test_class, { 'test_bold' })
+        self.assertEqual(texts, [ '\nA **B** __C__ D\n**E**\n' ])
+        self.assertTrue(set(texts) < set(all_texts))
+        self.addCleanup(setattr, test_class, 'batch_methods', None)
+        records = run_parallel._run_shard(
+            [ 'test_markdown_light.TestMarkdownLight.test_bold' ])
+        self.assertEqual([ record[3] for record in records ], [ 'success' ])
+        self.assertEqual(test_class.batch_methods, { 'test_bold' })
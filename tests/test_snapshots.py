@@ -0,0 +1,92 @@
+"""
+Golden scope snapshots of the texts of test_markdown_light and of
+demo/DEMO.md, see textmate.snapshot. After an intended change of the
+grammar, update them with:
+
+    python tests/test_snapshots.py --update
+"""
+
+import os
+import sys
+import unittest
+
+import conftest
+import fixture
+import test_markdown_light
+
+from textmate import Registry, Tokenizer
+from textmate.snapshot import Snapshot, digest, snapshot_runs, update
+
+ROOT = conftest.ROOT
+GRAMMAR = os.path.join(ROOT, 'MarkdownLight.tmLanguage')
+SNAPSHOT = os.path.join(ROOT, 'tests', 'snapshots', 'MarkdownLight.scopes')
+
+
+def documents():
+    """
+    Returns ``(name, text)`` pairs of the documents of the snapshot.
+    Test texts are named after their digest, so that editing a test
+    does not rename the other texts. Texts of tests requiring other
+    syntaxes are left out: their scopes depend on the grammars found
+    in TEXTMATE_PACKAGES_PATH.
+    """
+    test_class = test_markdown_light.TestMarkdownLight
+    methods = [ name for name in dir(test_class) if name.startswith('test')
+        and not fixture.required_syntaxes(getattr(test_class, name)) ]
+    result = [ ('text-' + digest(text), text) for text in
+        fixture.collect_texts(test_class, methods) ]
+    with open(os.path.join(ROOT, 'demo', 'DEMO.md'), encoding='utf-8') as f:
+        result.append(('DEMO.md', f.read()))
+    return result
+
+
+class TestSnapshots(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tokenizer = Tokenizer(Registry().load(GRAMMAR))
+        cls.snapshot = Snapshot.read(SNAPSHOT)
+
+    def test_scopes_match_snapshot(self):
+        docs = documents()
+        self.assertGreater(len(docs), 50)
+        messages = []
+        for name, text in docs:
+            messages.extend(self.snapshot.compare(name, text,
+                snapshot_runs(self.tokenizer, text)))
+        stale = set(self.snapshot.documents) - set(name for name, _ in docs)
+        if stale:
+            messages.append('{} documents no longer exist'.format(len(stale)))
+        if messages:
+            self.fail('Scopes differ from {}, run "python {} --update" if '
+                'intended:\n{}'.format(os.path.relpath(SNAPSHOT, ROOT),
+                os.path.relpath(__file__, ROOT), '\n'.join(messages)))
+
+    def test_texts_requiring_other_syntaxes_are_left_out(self):
+        texts = [ text for _, text in documents() ]
+        self.assertFalse([ text for text in texts if '<br>' in text
+            or '``` c++' in text ])
+
+    def test_compare_reports_divergent_lines(self):
+        text = 'A *B*\n\n# C\n'
+        lines = snapshot_runs(self.tokenizer, text)
+        snapshot = Snapshot.loads(Snapshot().dumps())
+        snapshot.add('a', text, lines)
+        snapshot = Snapshot.loads(snapshot.dumps())
+        self.assertEqual(snapshot.documents['a'][1], lines)
+        self.assertEqual(snapshot.compare('a', text, lines), [])
+        changed = list(lines)
+        changed[2] = ((1, ('text.html.markdown',)),) + changed[2][1:]
+        self.assertEqual(snapshot.compare('a', text, changed), [
+            'a: line 3 column 1 "# C": expected "text.html.markdown '
+            'markup.heading.markdown punctuation.definition.heading.markdown" '
+            'got "text.html.markdown"' ])
+        self.assertEqual(snapshot.compare('a', 'A *B*\n', lines[:1]),
+            [ 'the text of a changed since the snapshot' ])
+
+
+if __name__ == '__main__':
+    if '--update' in sys.argv:
+        update(SNAPSHOT, Tokenizer(Registry().load(GRAMMAR)), documents())
+        print('Wrote {}'.format(os.path.relpath(SNAPSHOT, ROOT)))
+    else:
+        unittest.main()
@@ -0,0 +1,77 @@
+import fixture
+import io
+import itertools
+import os
+import test_markdown_light
+import tracemalloc
+
+from textmate import Registry, ScopeStacks, Tokenizer, tokenize_stream
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRAMMAR = os.path.join(ROOT, 'MarkdownLight.tmLanguage')
+
+
+class TestStream(fixture.SyntaxTestCase):
+    syntax_file = "Packages/MarkdownLight/MarkdownLight.tmLanguage"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tokenizer = Tokenizer(Registry().load(GRAMMAR))
+
+    def stream_scopes(self, text):
+        """
+        Returns the scope name of every character as seen by the stream.
+        """
+        stacks = ScopeStacks()
+        names = []
+        line_numbers = []
+        for line_no, tokens in tokenize_stream(self.tokenizer,
+                io.StringIO(text), stacks):
+            line_numbers.append(line_no)
+            for begin, end, stack_id in tokens:
+                names.extend([ stacks.name(stack_id) ] * (end - begin))
+        self.assertEqual(line_numbers, list(range(len(text.splitlines()))))
+        return names
+
+    def test_scopes_match_view(self):
+        with open(os.path.join(ROOT, 'demo', 'DEMO.md'), encoding='utf-8') as f:
+            demo = f.read()
+        texts = fixture.collect_texts(test_markdown_light.TestMarkdownLight)
+        for text in texts + [ demo, 'A *B*' ]:
+            self.set_text(text)
+            expected = [ self.view.scope_name(point)
+                for point in range(self.view.size()) ]
+            self.assertEqual(self.stream_scopes(text), expected, text)
+
+    def test_default_stacks_are_reachable(self):
+        stream = tokenize_stream(self.tokenizer, io.StringIO('# A *B*\nC\n'))
+        names = [ [ stream.stacks.name(stack_id) for _, _, stack_id in tokens ]
+            for _, tokens in stream ]
+        self.assertIn('text.html.markdown markup.heading.markdown '
+            'entity.name.section.markdown markup.italic.markdown ', names[0])
+        self.assertEqual(names[1], [ 'text.html.markdown ' ])
+        self.assertIsNotNone(stream.state)
+
+    def test_memory_is_flat(self):
+        with open(os.path.join(ROOT, 'demo', 'DEMO.md'), encoding='utf-8') as f:
+            demo = f.read().splitlines(True) + [ '\n' ]
+
+        def peak(repeat):
+            lines = itertools.chain.from_iterable(itertools.repeat(demo, repeat))
+            tracemalloc.start()
+            try:
+                for _ in tokenize_stream(self.tokenizer, lines, stacks):
+                    pass
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        stacks = ScopeStacks()
+        # Fill the caches of compiled patterns, the table of scope
+        # stacks and the free lists of the interpreter first; freed
+        # objects kept in the free lists count as traced memory.
+        peak(200)
+        small = peak(1)
+        large = peak(50)
+        self.assertLess(large, small * 1.5)
@@ -0,0 +1,90 @@
+import os
+import unittest
+
+from textmate import Registry, Theme, Tokenizer, selector
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRAMMAR = os.path.join(ROOT, 'MarkdownLight.tmLanguage')
+
+MARKDOWN = 'text.html.markdown'
+
+
+class TestSelector(unittest.TestCase):
+    def test_prefix_components(self):
+        bold = selector.compile('markup.bold')
+        self.assertTrue(bold.matches((MARKDOWN, 'markup.bold.markdown')))
+        self.assertTrue(bold.matches(('markup.bold',)))
+        self.assertFalse(bold.matches((MARKDOWN, 'markup.boldface')))
+        self.assertFalse(bold.matches((MARKDOWN, 'markup')))
+
+    def test_descendant(self):
+        path = selector.compile('markup.heading markup.italic')
+        self.assertTrue(path.matches(
+            (MARKDOWN, 'markup.heading.1', 'meta.x', 'markup.italic')))
+        self.assertFalse(path.matches(
+            (MARKDOWN, 'markup.italic', 'markup.heading.1')))
+
+    def test_alternatives_and_exclusions(self):
+        raw = selector.compile('markup.raw - markup.raw.inline, meta.dummy.line-break')
+        self.assertTrue(raw.matches(('markup.raw.block',)))
+        self.assertFalse(raw.matches(('markup.raw.inline',)))
+        self.assertTrue(raw.matches(('meta.dummy.line-break',)))
+        self.assertIs(selector.compile('markup.raw - markup.raw.inline, '
+            'meta.dummy.line-break'), raw)
+
+    def test_specificity(self):
+        stack = (MARKDOWN, 'markup.heading.1.markdown', 'markup.italic.markdown')
+        scores = { text: selector.compile(text).score(stack) for text in (
+            'markup', 'markup.heading', 'markup.italic',
+            'markup.heading markup.italic', 'text markup.italic') }
+        # The depth of the match counts more than its length.
+        self.assertEqual(sorted(scores, key=scores.get), [
+            'markup.heading', 'markup', 'markup.italic',
+            'text markup.italic', 'markup.heading markup.italic' ])
+
+
+class TestTheme(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.theme = Theme.load(os.path.join(ROOT, 'MarkdownLight.tmTheme'))
+
+    def test_properties_resolve_independently(self):
+        style = self.theme.style(
+            (MARKDOWN, 'markup.heading.1.markdown', 'markup.italic.markdown'))
+        self.assertEqual((style.foreground, style.font_style),
+            ('#CC342B', 'bold italic'))
+        self.assertEqual(style.background, self.theme.default_style.background)
+        self.assertEqual(self.theme.style((MARKDOWN,)), self.theme.default_style)
+
+    def test_later_settings_win_ties(self):
+        theme = Theme({ 'settings': [
+            { 'settings': { 'foreground': '#000000' } },
+            { 'scope': 'markup', 'settings': { 'foreground': '#111111' } },
+            { 'scope': 'markup', 'settings': { 'fontStyle': 'italic bold' } },
+            { 'scope': 'markup', 'settings': { 'foreground': '#222222' } },
+        ] })
+        self.assertEqual(theme.style(('markup.x',)).foreground, '#222222')
+        self.assertEqual(theme.style(('markup.x',)).font_style, 'bold italic')
+
+    def test_yaml_source_is_equivalent(self):
+        source = Theme.load(os.path.join(ROOT, 'MarkdownLight.YAML-tmTheme'))
+        stack = (MARKDOWN, 'markup.underline.link.markdown')
+        self.assertEqual(source.style(stack), self.theme.style(stack))
+
+    def test_style_runs_are_memoized(self):
+        with open(os.path.join(ROOT, 'demo', 'DEMO.md'), encoding='utf-8') as f:
+            text = f.read()
+        tokens = Tokenizer(Registry().load(GRAMMAR)).tokenize(text * 3)
+        theme = Theme(self.theme.raw)
+        runs = theme.style_runs(tokens)
+        stats = theme.stats()
+        self.assertEqual(stats['hits'] + stats['misses'], len(tokens))
+        self.assertEqual(stats['misses'], stats['stacks'])
+        self.assertGreater(stats['hit_rate'], 0.6)
+        self.assertLess(len(runs), len(tokens))
+        self.assertEqual((runs[0][0], runs[-1][1]), (0, len(text) * 3))
+        for previous, run in zip(runs, runs[1:]):
+            self.assertEqual(previous[1], run[0])
+            self.assertNotEqual(previous[2], run[2])
+        for begin, end, scopes in tokens:
+            self.assertEqual(theme.style(scopes), theme.resolve(scopes))
@@ -0,0 +1,272 @@
+import fixture
+import os
+import test_markdown_light
+import unittest
+
+from textmate import Registry, Tokenizer, dispatch, fused, profiling, regex
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRAMMAR = os.path.join(ROOT, 'MarkdownLight.tmLanguage')
+
+
+def scopes_of(tokens, text, fragment):
+    begin = text.index(fragment)
+    return [ token[2] for token in tokens
+        if token[0] < begin + len(fragment) and token[1] > begin ]
+
+
+class TestRegex(unittest.TestCase):
+    def test_code_points(self):
+        self.assertEqual(regex.translate(r'[\x{00a1}-\x{ffff}]'),
+            r'[\u00a1-\uffff]')
+
+    def test_variable_width_lookbehind(self):
+        pattern = regex.compile(r'(?<=^|_|\W)(\*)')
+        self.assertEqual(pattern.search('*A').start(), 0)
+        self.assertEqual(pattern.search('A *B').start(), 2)
+        self.assertIsNone(pattern.search('A*B'))
+
+    def test_backreferences_in_end_pattern(self):
+        begin = regex.compile(r'(\*\*|__)').search('__A__')
+        self.assertEqual(
+            regex.substitute_backreferences(r'(?<=\S)\1(?=\W)', begin),
+            r'(?<=\S)__(?=\W)')
+        self.assertEqual(
+            regex.substitute_backreferences(r'\\1', begin), r'\\1')
+
+
+class TestRegexCache(unittest.TestCase):
+    END = r'(?<=\S)\1(?=[_\*]*($|\W))'
+
+    def begin(self, text):
+        return regex.compile(r'(\*\*|__)').search(text)
+
+    def test_static_patterns_are_compiled_once(self):
+        cache = regex.RegexCache()
+        self.assertIs(cache.compile('a+'), cache.compile('a+'))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_end_pattern_per_captured_text(self):
+        cache = regex.RegexCache()
+        groups = regex.backreferences(self.END)
+        self.assertEqual(groups, [1])
+        stars = cache.end_pattern(self.END, groups, self.begin('**A**'))
+        self.assertIs(cache.end_pattern(self.END, groups, self.begin('x **B**')),
+            stars)
+        underscores = cache.end_pattern(self.END, groups, self.begin('__C__'))
+        self.assertIsNot(underscores, stars)
+        self.assertEqual(underscores.search('C__ ').start(), 1)
+        self.assertEqual(cache.stats()['dynamic'], 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_lru_eviction(self):
+        cache = regex.RegexCache(maxsize=1)
+        groups = [1]
+        cache.end_pattern(self.END, groups, self.begin('**'))
+        cache.end_pattern(self.END, groups, self.begin('__'))
+        self.assertEqual(cache.evictions, 1)
+        cache.end_pattern(self.END, groups, self.begin('**'))
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+
+    def test_tokenizer_reuses_end_patterns(self):
+        registry = Registry()
+        tokenizer = Tokenizer(registry.load(GRAMMAR))
+        tokenizer.tokenize('A *B* **C** _D_ __E__ ~~F~~\n' * 50)
+        stats = registry.regex_cache.stats()
+        self.assertLessEqual(stats['dynamic'], 5)
+        self.assertGreater(stats['hits'], 200)
+
+
+class TestTokenizer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tokenizer = Tokenizer(Registry().load(GRAMMAR))
+
+    def test_tokens_cover_text(self):
+        text = '# A\n\n- *B*\n- C\n\n```\nD\n```\n'
+        tokens = self.tokenizer.tokenize(text)
+        self.assertEqual(tokens[0][0], 0)
+        self.assertEqual(tokens[-1][1], len(text))
+        for previous, token in zip(tokens, tokens[1:]):
+            self.assertEqual(previous[1], token[0])
+
+    def test_base_scope(self):
+        for token in self.tokenizer.tokenize('A\n\n> B\n'):
+            self.assertEqual(token[2][0], 'text.html.markdown')
+
+    def test_begin_captures(self):
+        text = 'A **B** C\n'
+        tokens = self.tokenizer.tokenize(text)
+        self.assertEqual(scopes_of(tokens, text, '**')[0][1:], (
+            'markup.bold.markdown', 'punctuation.definition.bold.markdown'))
+        self.assertEqual(scopes_of(tokens, text, 'B')[0][1:],
+            ('markup.bold.markdown',))
+
+    def test_state_is_carried_between_lines(self):
+        lines = [ '```\n', '*A*\n', '```\n' ]
+        results = list(self.tokenizer.tokenize_lines(lines))
+        for tokens, _ in results:
+            self.assertIn('markup.raw.block.fenced.markdown', tokens[0][2])
+        self.assertNotEqual(results[0][1], self.tokenizer.initial_state())
+
+    def test_unknown_grammar_is_ignored(self):
+        text = '```python\nx = 1\n```\n'
+        tokens = self.tokenizer.tokenize(text)
+        self.assertEqual(tokens[-1][1], len(text))
+
+    def test_last_line_without_newline(self):
+        tokens = self.tokenizer.tokenize('A *B*')
+        self.assertEqual(tokens[-1][1], 5)
+
+    def test_only_newlines_end_lines(self):
+        from textmate.incremental import Document
+        for text in ('A\x0c# B\n', 'A\r# B\n', 'A\u2028# B\n'):
+            tokens = self.tokenizer.tokenize(text)
+            self.assertEqual(tokens, Document(self.tokenizer, text).tokens())
+            self.assertFalse(any('markup.heading.markdown' in scopes
+                for _, _, scopes in tokens), repr(text))
+
+
+class TestDispatch(unittest.TestCase):
+    def test_first_chars(self):
+        self.assertEqual(dispatch.first_chars(r'\\[-`*_]').chars, { '\\' })
+        self.assertEqual(dispatch.first_chars(r'(?<=^|_|\W)(\*\*|__)').chars,
+            { '*', '_' })
+        self.assertEqual(dispatch.first_chars(r'(?i)<a').chars, { '<' })
+        self.assertEqual(dispatch.first_chars(r'(?i)(?:a|b\d)').chars,
+            { 'a', 'A', 'b', 'B' })
+        optional = dispatch.first_chars(r'(\w)?b')
+        self.assertEqual((optional.chars, optional.categories),
+            ({ 'b' }, { r'\w' }))
+
+    def test_unknown_first_chars(self):
+        for pattern in (r'.', r'[^a]', r'a*', r'$', r'\s*(#*)$'):
+            self.assertIsNone(dispatch.first_chars(pattern).chars, pattern)
+
+    def test_line_start(self):
+        first = dispatch.first_chars(r'^(#{1,6})|x')
+        self.assertEqual(first.chars, { 'x' })
+        self.assertTrue(first.line_start)
+
+    def test_required_strings(self):
+        self.assertEqual(dispatch.first_chars(r'(?:https?|ftp)://\S+').required,
+            ('://', 'tp'))
+        self.assertEqual(dispatch.first_chars(r'<(x@b)>|y@c').required,
+            ('@',))
+        self.assertEqual(dispatch.first_chars(r'(?i)www\.x').required, ('.',))
+        for pattern in (r'a?', r'a|b', r'(?:xy)*', r'(?=a)'):
+            self.assertIsNone(dispatch.first_chars(pattern).required, pattern)
+
+    def test_next_candidate(self):
+        candidates = dispatch.Dispatch([ dispatch.first_chars(r'\*'),
+            dispatch.first_chars(r'`+'), dispatch.first_chars(r'\d') ])
+        self.assertEqual(candidates.next_candidate('abc `d`\n', 1), 4)
+        self.assertEqual(candidates.next_candidate('abc 1\n', 1), 4)
+        self.assertEqual(candidates.next_candidate('abc\n', 1), -1)
+        anywhere = dispatch.Dispatch([ dispatch.first_chars(r'\*'),
+            dispatch.first_chars(r'.') ])
+        self.assertEqual(anywhere.next_candidate('abc\n', 1), 1)
+
+    def test_tokens_do_not_depend_on_dispatch(self):
+        class NoDispatch(Tokenizer):
+            def _dispatch_for(self, stack):
+                return dispatch.Dispatch([ dispatch.first_chars('.') ])
+
+        with open(os.path.join(ROOT, 'demo', 'DEMO.md'), encoding='utf-8') as f:
+            text = f.read()
+        grammar = Registry().load(GRAMMAR)
+        self.assertEqual(Tokenizer(grammar).tokenize(text),
+            NoDispatch(grammar).tokenize(text))
+
+
+class TestFusedScanner(unittest.TestCase):
+    def scanner(self, *sources):
+        return fused.FusedScanner([ (source, regex.compile(source), False,
+            dispatch.first_chars(source)) for source in sources ])
+
+    def test_earliest_match_then_order(self):
+        scanner = self.scanner(r'\*\*', r'\*', r'`')
+        _, rule, m, _ = scanner.search('a `b` **c**\n', 0)
+        self.assertEqual((rule, m.span()), (r'`', (2, 3)))
+        _, rule, m, _ = scanner.search('a **c**\n', 1)
+        self.assertEqual((rule, m.span()), (r'\*\*', (2, 4)))
+
+    def test_groups_are_renumbered(self):
+        scanner = self.scanner(r'(\*)(\*)', r'(?x) (`+) (.+?) \1 # raw')
+        self.assertEqual(scanner.separate, [])
+        _, rule, m, _ = scanner.search('a ``b`` c\n', 0)
+        self.assertEqual(m.span(), (2, 7))
+        self.assertEqual(m.group(1), '``')
+        self.assertEqual(m.span(2), (4, 5))
+
+    def test_broad_patterns_are_searched_separately(self):
+        scanner = self.scanner(r'\*', r'[a-z]+@', r'.')
+        self.assertEqual([ rule for _, rule, _, _, _ in scanner.separate ],
+            [ r'[a-z]+@', r'.' ])
+        _, rule, m, _ = scanner.search('ab*\n', 0)
+        self.assertEqual((rule, m.span()), (r'.', (0, 1)))
+
+    def test_cross_check_on_test_texts(self):
+        texts = fixture.collect_texts(test_markdown_light.TestMarkdownLight)
+        with open(os.path.join(ROOT, 'demo', 'DEMO.md'), encoding='utf-8') as f:
+            texts.append(f.read())
+        tokenizer = Tokenizer(Registry().load(GRAMMAR), cross_check=True)
+        for text in texts:
+            tokenizer.tokenize(text)
+
+
+class TestProfiling(unittest.TestCase):
+    def test_rule_statistics(self):
+        grammar = Registry().load(GRAMMAR)
+        tokenizer = profiling.ProfilingTokenizer(grammar)
+        text = 'A **B** <http://c.org> `d`\n\n- E\n'
+        self.assertEqual(tokenizer.tokenize(text), Tokenizer(grammar).tokenize(text))
+        rules = tokenizer.profiler.rules
+        self.assertGreaterEqual(rules['bold'].matches, 1)
+        self.assertGreaterEqual(rules['url'].attempts, rules['url'].matches)
+        self.assertIn('bold (end)', rules)
+        self.assertEqual(rules['url'].worst_line, 'A **B** <http://c.org> `d`\n')
+
+    def test_lazy_patterns_compiled_before_timing(self):
+        events = []
+        clock = profiling._clock
+        compile = regex.LazyPattern.compile
+
+        def timed():
+            events.append('clock')
+            return clock()
+
+        def compiled(pattern):
+            if pattern.compiled is None:
+                events.append('compile')
+            return compile(pattern)
+
+        profiling._clock = timed
+        regex.LazyPattern.compile = compiled
+        try:
+            grammar = Registry(lazy=True).load(GRAMMAR)
+            profiling.ProfilingTokenizer(grammar).tokenize('A **B** `c`\n')
+        finally:
+            profiling._clock = clock
+            regex.LazyPattern.compile = compile
+        self.assertIn('compile', events)
+        timing = False
+        for event in events:
+            if event == 'clock':
+                timing = not timing
+            else:
+                self.assertFalse(timing, 'a pattern was compiled while timed')
+
+    def test_report_sorted_by_cost(self):
+        profiler = profiling.Profiler()
+        profiler.record('cheap', 'a\n', 0.001, True)
+        profiler.record('costly', 'b\n', 0.002, False)
+        profiler.record('costly', 'c\n', 0.003, False)
+        self.assertEqual([ label for label, _ in profiler.sorted() ],
+            [ 'costly', 'cheap' ])
+        stats = profiler.rules['costly']
+        self.assertEqual((stats.attempts, stats.matches, stats.worst_line),
+            (2, 0, 'c\n'))
+        report = profiler.report().splitlines()
+        self.assertEqual(len(report), 3)
+        self.assertTrue(report[1].startswith('costly'))
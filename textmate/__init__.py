@@ -0,0 +1,16 @@
+"""
+Headless TextMate grammar engine.
+
+Runs MarkdownLight.tmLanguage (or any other TextMate grammar) outside of
+Sublime Text, e.g. to run the syntax tests on a plain Python install.
+
+    >>> from textmate import Registry, Tokenizer
+    >>> grammar = Registry().load('MarkdownLight.tmLanguage')
+    >>> Tokenizer(grammar).tokenize('*A*\\n')
+"""
+
+from .grammar import Grammar, Registry, Rule, load_grammar_file
+from .regex import RegexError
+from .tokenizer import StackFrame, Tokenizer
+from .stream import ScopeStacks, TokenStream, tokenize_stream
+from .theme import Style, Theme
@@ -0,0 +1,385 @@
+"""
+Persistent on-disk cache of token streams.
+
+Entries are keyed by a hash of the text and a hash of the grammar
+files (the grammar itself and all grammars it includes by scope name)
+and stored in a compact binary format that is memory-mapped on read:
+
+    header     magic, format version, token and scope stack counts,
+               size of the scope table
+    scopes     scope stacks as UTF-8, one per line, space separated
+    tokens     (begin, end, stack id) as little endian unsigned 32-bit
+               integers
+
+Every grammar version gets its own directory, keyed by the grammar
+files and the source of the tokenizer (this package), so that entries
+written by another version of either are never served. When a grammar
+file or the tokenizer changes, the directories of older versions of the
+same grammar (same scope name and path) are removed, entries of other
+grammars are kept.
+
+Files are written to a temporary name and renamed into place, and
+readers tolerate entries disappearing, so several processes can share
+a cache directory without locking. The least recently used entries are
+removed once the cache exceeds ``max_bytes``, together with temporary
+files left behind by processes killed while writing.
+
+    >>> cache = TokenCache('.token-cache', tokenizer)
+    >>> with cache.tokenize(text) as tokens:
+    ...     for begin, end, scopes in tokens:
+    ...         pass
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from array import array
+
+FORMAT_VERSION = 1
+MAGIC = b'TMTC'
+
+_HEADER = struct.Struct('<4sIIII')
+
+EXTENSION = '.tokens'
+
+TEMPORARY_EXTENSION = '.tmp'
+
+# Temporary files older than that are left over by killed writers.
+STALE_TEMPORARY_SECONDS = 3600
+
+_engine_hash = None
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def engine_hash():
+    """
+    Returns a hash of the source of this package and of the Python
+    version, which determine the tokens produced for a grammar.
+    """
+    global _engine_hash
+    if _engine_hash is None:
+        digest = hashlib.sha256(sys.version.encode('utf-8'))
+        package = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(package)):
+            if name.endswith('.py'):
+                digest.update(name.encode('utf-8') + b'\0')
+                with open(os.path.join(package, name), 'rb') as f:
+                    digest.update(f.read())
+        _engine_hash = digest.hexdigest()
+    return _engine_hash
+
+
+def grammar_hash(grammar):
+    """
+    Returns a hash of the grammar file and the files of all grammars it
+    includes by scope name, directly or indirectly.
+    """
+    digest = hashlib.sha256()
+    seen = set()
+    pending = [ grammar ]
+    while pending:
+        current = pending.pop()
+        if current.scope_name in seen:
+            continue
+        seen.add(current.scope_name)
+        digest.update((current.scope_name or '').encode('utf-8') + b'\0')
+        if current.path is not None:
+            with open(current.path, 'rb') as f:
+                digest.update(f.read())
+        else:
+            digest.update(json.dumps(current.raw, sort_keys=True).encode('utf-8'))
+        for scope_name in sorted(_included_scopes(current.raw)):
+            included = current.registry.grammar_for_scope(scope_name)
+            if included is None:
+                digest.update(b'missing:' + scope_name.encode('utf-8'))
+            else:
+                pending.append(included)
+    return digest.hexdigest()
+
+
+def _included_scopes(raw):
+    scopes = set()
+    stack = [ raw ]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            include = value.get('include')
+            if isinstance(include, str) and include[:1] not in ('#', '$'):
+                scopes.add(include.partition('#')[0])
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return scopes
+
+
+def encode(tokens):
+    """
+    Returns the binary representation of ``(begin, end, scopes)`` tokens.
+    """
+    ids = {}
+    stacks = []
+    flat = array('I')
+    for begin, end, scopes in tokens:
+        stack_id = ids.get(scopes)
+        if stack_id is None:
+            stack_id = ids[scopes] = len(stacks)
+            stacks.append(scopes)
+        flat.extend((begin, end, stack_id))
+    if sys.byteorder != 'little':
+        flat.byteswap()
+    table = '\n'.join(' '.join(scopes) for scopes in stacks).encode('utf-8')
+    table += b'\0' * (-len(table) % 4)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(flat) // 3, len(stacks),
+        len(table))
+    return header + table + flat.tobytes()
+
+
+class TokenFile:
+    """
+    Memory-mapped tokens of a cache entry.
+
+    Behaves like a read-only sequence of ``(begin, end, scopes)``
+    tokens; only the scope table is decoded when the file is opened.
+    """
+    def __init__(self, path):
+        self._mmap = None
+        self._view = None
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._load(self._mmap, path)
+
+    @classmethod
+    def from_bytes(cls, data, name='<bytes>'):
+        """
+        Returns the tokens of the binary representation of an entry
+        held in memory (see encode()).
+        """
+        tokens = cls.__new__(cls)
+        tokens._mmap = None
+        tokens._view = None
+        tokens._load(data, name)
+        return tokens
+
+    def _load(self, data, name):
+        try:
+            magic, version, count, stack_count, table_size = (
+                _HEADER.unpack_from(data))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError('Not a token file: {}'.format(name))
+            table_start = _HEADER.size
+            tokens_start = table_start + table_size
+            table = data[table_start:tokens_start].rstrip(b'\0')
+            self.stacks = [ tuple(line.split(' ')) if line else ()
+                for line in table.decode('utf-8').split('\n') ][:stack_count]
+            if sys.byteorder == 'little':
+                self._view = memoryview(data)[tokens_start:].cast('I')
+            else:
+                self._view = array('I', data[tokens_start:])
+                self._view.byteswap()
+            if len(self._view) != count * 3:
+                raise ValueError('Truncated token file: {}'.format(name))
+        except Exception:
+            self.close()
+            raise
+        self._count = count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        view = self._view
+        i = index * 3
+        return view[i], view[i + 1], self.stacks[view[i + 2]]
+
+    def __iter__(self):
+        view = self._view
+        stacks = self.stacks
+        for i in range(0, self._count * 3, 3):
+            yield view[i], view[i + 1], stacks[view[i + 2]]
+
+    def close(self):
+        if isinstance(self._view, memoryview):
+            self._view.release()
+        self._view = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+class TokenCache:
+    """
+    Caches the tokens of texts produced by a tokenizer in a directory.
+    """
+    def __init__(self, directory, tokenizer, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.tokenizer = tokenizer
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        grammar = tokenizer.grammar
+        self.grammar_hash = hashlib.sha256((grammar_hash(grammar)
+            + engine_hash()).encode('ascii')).hexdigest()
+        self.grammar_directory = os.path.join(directory, self.grammar_hash[:32])
+        self._size = None
+        self._identity = {
+            'scope_name': grammar.scope_name,
+            'path': os.path.abspath(grammar.path) if grammar.path else None,
+            'hash': self.grammar_hash,
+        }
+        self._prepare()
+
+    def path(self, text):
+        return os.path.join(self.grammar_directory, text_hash(text) + EXTENSION)
+
+    def get(self, text):
+        """
+        Returns the cached TokenFile of the text or None.
+        """
+        path = self.path(text)
+        try:
+            tokens = TokenFile(path)
+        except (OSError, ValueError, struct.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            # The modification time is the last access time for LRU.
+            os.utime(path)
+        except OSError:
+            pass
+        return tokens
+
+    def put(self, text, tokens):
+        """
+        Stores the tokens of the text and returns the path of the entry.
+        """
+        return self._store(text, encode(tokens))
+
+    def _store(self, text, data):
+        path = self.path(text)
+        os.makedirs(self.grammar_directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=self.grammar_directory,
+            suffix=TEMPORARY_EXTENSION)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            _remove(temporary)
+            raise
+        if self._size is None:
+            self.evict()
+        else:
+            # Entries written by other processes are only seen when the
+            # estimate exceeds the limit and the directory is scanned.
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self.evict()
+        return path
+
+    def tokenize(self, text):
+        """
+        Returns the TokenFile of the text, tokenizing and storing it if
+        it is not cached yet.
+        """
+        tokens = self.get(text)
+        if tokens is None:
+            # The entry may be evicted as soon as it is stored, by put()
+            # itself or another process, so the result is read from
+            # memory.
+            data = encode(self.tokenizer.tokenize(text))
+            self._store(text, data)
+            tokens = TokenFile.from_bytes(data, self.path(text))
+        return tokens
+
+    def entries(self):
+        """
+        Returns ``(mtime, size, path)`` of all entries, oldest first.
+        """
+        return self._files(EXTENSION)
+
+    def _files(self, extension):
+        result = []
+        for directory, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(extension):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                result.append((stat.st_mtime, stat.st_size, path))
+        result.sort()
+        return result
+
+    def evict(self):
+        """
+        Removes stale temporary files and the least recently used
+        entries until the cache fits into ``max_bytes``.
+        """
+        stale = time.time() - STALE_TEMPORARY_SECONDS
+        for mtime, _, path in self._files(TEMPORARY_EXTENSION):
+            if mtime < stale:
+                _remove(path)
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+        self._size = total
+
+    def _prepare(self):
+        """
+        Records the grammar of the entries in its directory and removes
+        the directories of other versions of the same grammar.
+        """
+        os.makedirs(self.grammar_directory, exist_ok=True)
+        identity_path = os.path.join(self.grammar_directory, 'grammar.json')
+        if not os.path.exists(identity_path):
+            fd, temporary = tempfile.mkstemp(dir=self.grammar_directory,
+                suffix=TEMPORARY_EXTENSION)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._identity, f)
+            os.replace(temporary, identity_path)
+        for name in os.listdir(self.directory):
+            directory = os.path.join(self.directory, name)
+            if directory == self.grammar_directory:
+                continue
+            try:
+                with open(os.path.join(directory, 'grammar.json'),
+                        encoding='utf-8') as f:
+                    identity = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if (identity.get('scope_name') == self._identity['scope_name']
+                    and identity.get('path') == self._identity['path']):
+                shutil.rmtree(directory, ignore_errors=True)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
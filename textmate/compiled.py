@@ -0,0 +1,360 @@
+"""
+Precompiled grammars.
+
+Loading a grammar from its YAML source means parsing YAML; tokenizing
+the first line means resolving includes, translating and analysing
+every pattern of the rules involved. A compiled grammar stores the
+outcome of all of that in a single file that is loaded with one read:
+
+    header     magic, format version, marshal version and the SHA-256
+               of the grammar source
+    table      marshal data: the raw grammar, its rules (numbered in
+               the order they are reached from the root), the flattened
+               ``patterns`` of every rule as rule numbers or references
+               to other grammars, the repository, the translated source
+               and group count of every pattern and its first character
+               analysis, and the path of the source relative to the
+               compiled grammar
+
+All patterns are compiled once when the table is built, so a grammar
+with an invalid pattern cannot be compiled. Compiled regexes cannot be
+stored with Python's re; loaded with ``Registry(lazy=True)`` a pattern
+is only compiled when it is first searched, so rules never reached by
+a text are never compiled.
+
+    python -m textmate.compiled MarkdownLight.YAML-tmLanguage
+    python -m textmate.compiled MarkdownLight.YAML-tmLanguage --timing
+
+The first command writes ``MarkdownLight.compiled-tmLanguage``, which
+``Registry.load()`` accepts like any other grammar file; when the
+source has changed since, the source is loaded instead. The second one
+also reports the cold start time (loading the grammar and tokenizing a
+text in a fresh process) of the source and of the compiled grammar.
+"""
+
+import marshal
+import os
+import struct
+import sys
+import tempfile
+
+from . import regex
+from .dispatch import FirstChars
+from .grammar import (COMPILED_EXTENSION, Grammar, Include, Rule, Registry,
+    load_grammar_file)
+
+FORMAT_VERSION = 2
+MAGIC = b'TMGC'
+
+_HEADER = struct.Struct('<4sII32s')
+
+# Keys of a raw rule that are stored in the table; ``patterns`` are
+# stored resolved.
+_RULE_KEYS = ('name', 'contentName', 'match', 'begin', 'end',
+    'applyEndPatternLast', 'captures', 'beginCaptures', 'endCaptures')
+
+
+class _NoCaptures:
+    """
+    Stands in for a begin match that captured nothing, to validate end
+    patterns with backreferences.
+    """
+    class re:
+        groups = 0
+
+    @staticmethod
+    def group(index):
+        return None
+
+
+# Modules only needed to build grammars or measure them are imported
+# where they are used: importing them would take longer than loading a
+# compiled grammar.
+
+
+def source_hash(path):
+    import hashlib
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def build(grammar):
+    """
+    Returns the table of a loaded grammar. Raises RegexError if a
+    pattern does not compile.
+    """
+    rules = []
+    numbers = {}
+    table_rules = []
+
+    def number(rule):
+        if rule.id not in numbers:
+            numbers[rule.id] = len(rules)
+            rules.append(rule)
+        return numbers[rule.id]
+
+    def flatten(patterns, result, visited):
+        for pattern in patterns:
+            if isinstance(pattern, Include):
+                reference = pattern.reference
+                if reference[:1] not in ('#', '$'):
+                    # Resolved when the grammar is used: the included
+                    # grammar may change independently.
+                    if reference not in result:
+                        result.append(reference)
+                    continue
+                pattern = pattern.resolve()
+                if pattern is None:
+                    continue
+            if pattern.is_match() or pattern.is_begin_end():
+                if number(pattern) not in result:
+                    result.append(number(pattern))
+            elif pattern.id not in visited:
+                visited.add(pattern.id)
+                flatten(pattern.patterns, result, visited)
+        return result
+
+    root = flatten(grammar.root.patterns, [], set())
+    repository = {}
+    for name in sorted(grammar.raw.get('repository', {})):
+        repository[name] = number(grammar.repository_rule(name))
+    sources = {}
+    i = 0
+    while i < len(rules):
+        rule = rules[i]
+        raw = { key: rule.raw[key] for key in _RULE_KEYS if key in rule.raw }
+        pattern = rule.match_source if rule.is_match() else rule.begin_source
+        first = end_first = None
+        if pattern is not None:
+            _add_source(sources, pattern)
+            first = _pack_first_chars(rule.first_chars)
+        if rule.is_begin_end() and rule.end_source is not None:
+            if rule.end_references:
+                regex.compile(regex.substitute_backreferences(
+                    rule.end_source, _NoCaptures))
+            else:
+                _add_source(sources, rule.end_source)
+                end_first = _pack_first_chars(rule.end_first_chars)
+        table_rules.append({
+            'raw': raw,
+            'repository_name': rule.repository_name,
+            'patterns': flatten(rule.patterns, [], set()),
+            'first_chars': first,
+            'end_first_chars': end_first,
+        })
+        i += 1
+    return {
+        'raw': grammar.raw,
+        'rules': table_rules,
+        'root': root,
+        'repository': repository,
+        'sources': sources,
+    }
+
+
+def _add_source(sources, pattern):
+    if pattern not in sources:
+        compiled = regex.compile(pattern)
+        sources[pattern] = (compiled.pattern, compiled.groups)
+
+
+def _pack_first_chars(first):
+    return (''.join(sorted(first.chars)) if first.chars is not None else None,
+        tuple(sorted(first.categories)) if first.categories is not None else None,
+        first.line_start, first.required)
+
+
+def _unpack_first_chars(packed):
+    chars, categories, line_start, required = packed
+    if chars is None:
+        return FirstChars(None, line_start=line_start, required=required)
+    return FirstChars(frozenset(chars), frozenset(categories), line_start,
+        required)
+
+
+def write(grammar, path):
+    """
+    Compiles a loaded grammar into a file.
+    """
+    table = build(grammar)
+    table['source'] = _relative_source(grammar.path, path)
+    data = marshal.dumps(table)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, marshal.version,
+        source_hash(grammar.path) if grammar.path else bytes(32))
+    # Written to a unique temporary name and renamed into place, so
+    # that several processes can write the same grammar.
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+        suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header + data)
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+
+
+def _relative_source(source, path):
+    if not source:
+        return None
+    try:
+        return os.path.relpath(os.path.abspath(source),
+            os.path.dirname(os.path.abspath(path)))
+    except ValueError:
+        # E.g. another drive on Windows.
+        return os.path.abspath(source)
+
+
+def read_header(data):
+    """
+    Returns the SHA-256 of the grammar source stored in a compiled
+    grammar. Raises ValueError if the file was written by another
+    version of this module or of Python.
+    """
+    try:
+        magic, version, marshal_version, digest = _HEADER.unpack_from(data)
+    except struct.error:
+        magic = None
+    if magic != MAGIC:
+        raise ValueError('Not a compiled grammar')
+    if version != FORMAT_VERSION or marshal_version != marshal.version:
+        raise ValueError('Compiled grammar of another version, rebuild it')
+    return digest
+
+
+def load(path, registry=None):
+    """
+    Loads a compiled grammar. Use ``Registry.load()`` to load it once
+    per registry. If the source of the grammar exists and changed
+    since it was compiled, the source is loaded instead.
+    """
+    if registry is None:
+        registry = Registry()
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        digest = read_header(data)
+    except ValueError as e:
+        raise ValueError('{}: {}'.format(path, e)) from None
+    table = marshal.loads(memoryview(data)[_HEADER.size:])
+    if table['source'] is not None:
+        source = os.path.join(os.path.dirname(os.path.abspath(path)),
+            table['source'])
+        if os.path.exists(source) and source_hash(source) != digest:
+            return Grammar(load_grammar_file(source), registry, source)
+
+    registry.regex_cache.sources.update(table['sources'])
+    grammar = Grammar(table['raw'], registry, path)
+    rules = [ Rule(grammar, entry['raw'], entry['repository_name'])
+        for entry in table['rules'] ]
+
+    def resolve(patterns):
+        return [ rules[p] if isinstance(p, int) else Include(grammar, p)
+            for p in patterns ]
+
+    for rule, entry in zip(rules, table['rules']):
+        rule._patterns = resolve(entry['patterns'])
+        if entry['first_chars'] is not None:
+            rule._first_chars = _unpack_first_chars(entry['first_chars'])
+        if entry['end_first_chars'] is not None:
+            rule._end_first_chars = _unpack_first_chars(
+                entry['end_first_chars'])
+    grammar.root._patterns = resolve(table['root'])
+    for name, index in table['repository'].items():
+        grammar._repository[name] = rules[index]
+    return grammar
+
+
+def is_stale(path, source):
+    """
+    Checks whether a compiled grammar is missing, unreadable or out of
+    date with its source.
+    """
+    try:
+        with open(path, 'rb') as f:
+            digest = read_header(f.read(_HEADER.size))
+    except (OSError, ValueError):
+        return True
+    return digest != source_hash(source)
+
+
+def output_path(source):
+    base = os.path.basename(source)
+    for extension in Registry.EXTENSIONS:
+        if base.endswith(extension):
+            base = base[:-len(extension)]
+            break
+    return os.path.join(os.path.dirname(source), base + COMPILED_EXTENSION)
+
+
+_COLD_START = '''
+import json, sys, time
+started = time.perf_counter()
+from textmate import Registry, Tokenizer
+imported = time.perf_counter()
+grammar = Registry(lazy=sys.argv[3] == 'lazy').load(sys.argv[1])
+loaded = time.perf_counter()
+with open(sys.argv[2], encoding='utf-8') as f:
+    Tokenizer(grammar).tokenize(f.read())
+done = time.perf_counter()
+print(json.dumps({ 'import': imported - started, 'load': loaded - imported,
+    'tokenize': done - loaded }))
+'''
+
+
+def cold_start(path, text_path, lazy=False, repeat=5):
+    """
+    Loads the grammar and tokenizes the text in fresh processes and
+    returns the median seconds spent importing, loading and tokenizing.
+    """
+    import json
+    import statistics
+    import subprocess
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [ root, os.environ.get('PYTHONPATH') ])))
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([ sys.executable, '-c', _COLD_START, path,
+            text_path, 'lazy' if lazy else 'eager' ], env=env, check=True,
+            stdout=subprocess.PIPE).stdout
+        runs.append(json.loads(output))
+    return { key: statistics.median(run[key] for run in runs)
+        for key in runs[0] }
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('source', help='grammar source file')
+    parser.add_argument('-o', '--output',
+        help='compiled grammar (default: next to the source)')
+    parser.add_argument('--timing', action='store_true',
+        help='report the cold start time before and after')
+    parser.add_argument('--text', default=os.path.join('demo', 'DEMO.md'),
+        help='text tokenized by --timing (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    output = args.output or output_path(args.source)
+    write(Registry().load(args.source), output)
+    print('Wrote {} ({} bytes)'.format(output, os.path.getsize(output)),
+        file=sys.stderr)
+
+    if args.timing:
+        for label, path, lazy in (
+                ('source', args.source, False),
+                ('compiled', output, False),
+                ('compiled, lazy', output, True)):
+            seconds = cold_start(path, args.text, lazy, args.repeat)
+            print('{:<16} load {:7.1f} ms  first tokenize {:7.1f} ms  total {:7.1f} ms'.format(
+                label, seconds['load'] * 1000, seconds['tokenize'] * 1000,
+                (seconds['load'] + seconds['tokenize']) * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
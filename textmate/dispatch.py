@@ -0,0 +1,274 @@
+"""
+First character analysis of grammar patterns.
+
+For every pattern the set of characters a match can start with is
+derived from the parsed regular expression. The tokenizer uses the
+union of these sets over all patterns that are tried inside a rule to
+jump straight to the next position where any of them can match, so
+plain text between markup costs a single search over a character
+class.
+
+The analysis also finds literal strings that every match contains
+(``://`` for bare URLs, ``@`` for e-mail addresses): a pattern need not
+be searched, nor even compiled, in a text that lacks one of them.
+"""
+
+import re
+
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
+from .regex import translate
+
+# Character ranges larger than that are treated as "any character".
+MAX_RANGE = 256
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: r'\d',
+    sre_constants.CATEGORY_NOT_DIGIT: r'\D',
+    sre_constants.CATEGORY_SPACE: r'\s',
+    sre_constants.CATEGORY_NOT_SPACE: r'\S',
+    sre_constants.CATEGORY_WORD: r'\w',
+    sre_constants.CATEGORY_NOT_WORD: r'\W',
+}
+
+_REPEATS = tuple(getattr(sre_constants, name) for name in (
+    'MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+    if hasattr(sre_constants, name))
+
+
+class FirstChars:
+    """
+    Characters a pattern match can start with.
+
+    ``chars`` is a frozenset of characters and ``categories`` a frozenset
+    of character categories (``\\d``, ``\\w``, ...); both are None if a
+    match can start with any character or be empty. ``line_start`` tells
+    that some matches can only start at the beginning of a line; such
+    matches are not reflected in ``chars``. ``required`` is a tuple of
+    strings that every match contains, or None.
+    """
+    __slots__ = ('chars', 'categories', 'line_start', 'required')
+
+    def __init__(self, chars, categories=frozenset(), line_start=False,
+            required=None):
+        self.chars = chars
+        self.categories = categories if chars is not None else None
+        self.line_start = line_start
+        self.required = required
+
+    def __repr__(self):
+        if self.chars is None:
+            chars = 'any'
+        else:
+            chars = ''.join(sorted(self.chars) + sorted(self.categories))
+        return '<FirstChars {!r}{}{}>'.format(chars,
+            ' or line start' if self.line_start else '',
+            ' requiring {!r}'.format(self.required) if self.required else '')
+
+
+def first_chars(pattern):
+    """
+    Returns FirstChars of an Oniguruma pattern.
+    """
+    try:
+        parsed = sre_parse.parse(translate(pattern))
+    except Exception:
+        return FirstChars(None)
+    analysis = _Analysis()
+    flags = parsed.state.flags
+    result = analysis.sequence(list(parsed), flags)
+    strings = analysis.required(list(parsed), flags)
+    # Strings contained in longer required strings add nothing.
+    required = tuple(sorted((s for s in strings
+        if not any(s != t and s in t for t in strings)),
+        key=lambda s: (-len(s), s))) or None
+    if result.nullable or result.chars is None:
+        return FirstChars(None, line_start=result.line_start,
+            required=required)
+    return FirstChars(frozenset(result.chars), frozenset(result.categories),
+        result.line_start, required)
+
+
+class Dispatch:
+    """
+    Finds positions where any of a list of patterns can start a match.
+    """
+    __slots__ = ('chars', 'categories', 'regex')
+
+    def __init__(self, first_chars_list):
+        chars = set()
+        categories = set()
+        for first in first_chars_list:
+            if first.chars is None:
+                chars = categories = None
+                break
+            chars.update(first.chars)
+            categories.update(first.categories)
+        self.chars = chars
+        self.categories = categories
+        self.regex = None
+        if chars is not None:
+            items = [ _escape_in_class(c) for c in sorted(chars) ]
+            items.extend(sorted(categories))
+            self.regex = re.compile(
+                '[{}]'.format(''.join(items)) if items else '(?!)')
+
+    def next_candidate(self, text, pos):
+        """
+        Returns the first position at or after ``pos`` where a match can
+        start, or -1. Matches anchored to the line start are not taken
+        into account, so ``pos`` must not be 0.
+        """
+        if self.regex is None:
+            return pos
+        m = self.regex.search(text, pos)
+        return m.start() if m is not None else -1
+
+
+def _folds(char, flags):
+    """
+    Checks whether the character matches other characters than itself.
+    """
+    return (bool(flags & sre_constants.SRE_FLAG_IGNORECASE)
+        and char.lower() != char.upper())
+
+
+def _substrings(strings):
+    return { s[i:j] for s in strings
+        for i in range(len(s)) for j in range(i + 1, len(s) + 1) }
+
+
+def _escape_in_class(c):
+    if c in '\\]^-[':
+        return '\\' + c
+    if c == '\n':
+        return '\\n'
+    return c
+
+
+class _Result:
+    __slots__ = ('chars', 'categories', 'nullable', 'line_start')
+
+    def __init__(self, chars, nullable, line_start=False, categories=()):
+        self.chars = chars
+        self.categories = set(categories)
+        self.nullable = nullable
+        self.line_start = line_start
+
+
+_ANY = _Result(None, False)
+
+
+class _Analysis:
+    def sequence(self, items, flags):
+        chars = set()
+        categories = set()
+        line_start = False
+        for op, av in items:
+            item = self.item(op, av, flags)
+            line_start = line_start or item.line_start
+            if item.chars is None:
+                return _Result(None, True, line_start)
+            chars.update(item.chars)
+            categories.update(item.categories)
+            if not item.nullable:
+                return _Result(chars, False, line_start, categories)
+        return _Result(chars, True, line_start, categories)
+
+    def item(self, op, av, flags):
+        c = sre_constants
+        if op is c.LITERAL:
+            return _Result(self.literal(chr(av), flags), False)
+        if op is c.IN:
+            return self.char_class(av, flags)
+        if op in (c.NOT_LITERAL, c.ANY):
+            return _ANY
+        if op is c.AT:
+            if av in (c.AT_BEGINNING, c.AT_BEGINNING_STRING):
+                # Nothing after ^ can match anywhere but at line start.
+                return _Result(set(), False, True)
+            return _Result(set(), True)
+        if op in (c.ASSERT, c.ASSERT_NOT):
+            return _Result(set(), True)
+        if op is c.BRANCH:
+            result = _Result(set(), False)
+            for branch in av[1]:
+                alternative = self.sequence(branch, flags)
+                result.line_start = result.line_start or alternative.line_start
+                if alternative.chars is None:
+                    return _Result(None, True, result.line_start)
+                result.chars.update(alternative.chars)
+                result.categories.update(alternative.categories)
+                result.nullable = result.nullable or alternative.nullable
+            return result
+        if op is c.SUBPATTERN:
+            add_flags, del_flags, items = av[1], av[2], av[3]
+            return self.sequence(items, (flags | add_flags) & ~del_flags)
+        if op in _REPEATS:
+            low, items = av[0], av[2]
+            result = self.sequence(items, flags)
+            if low == 0:
+                result.nullable = True
+            return result
+        if getattr(c, 'ATOMIC_GROUP', None) is op:
+            return self.sequence(av, flags)
+        return _Result(None, True)
+
+    def required(self, items, flags):
+        """
+        Returns a set of strings that every match of the sequence
+        contains.
+        """
+        c = sre_constants
+        result = set()
+        run = ''
+        for op, av in items:
+            if op is c.LITERAL and not _folds(chr(av), flags):
+                run += chr(av)
+                continue
+            if run:
+                result.add(run)
+                run = ''
+            if op is c.SUBPATTERN:
+                result |= self.required(av[3], (flags | av[1]) & ~av[2])
+            elif op in _REPEATS and av[0] > 0:
+                result |= self.required(av[2], flags)
+            elif getattr(c, 'ATOMIC_GROUP', None) is op:
+                result |= self.required(av, flags)
+            elif op is c.BRANCH:
+                branches = [ self.required(branch, flags) for branch in av[1] ]
+                result |= { s for s in _substrings(branches[0])
+                    if all(any(s in t for t in b) for b in branches[1:]) }
+        if run:
+            result.add(run)
+        return result
+
+    @staticmethod
+    def literal(char, flags):
+        if flags & sre_constants.SRE_FLAG_IGNORECASE:
+            return { char, char.lower(), char.upper() }
+        return { char }
+
+    def char_class(self, items, flags):
+        c = sre_constants
+        result = _Result(set(), False)
+        for op, av in items:
+            if op is c.LITERAL:
+                result.chars.update(self.literal(chr(av), flags))
+            elif op is c.RANGE:
+                low, high = av
+                if high - low > MAX_RANGE:
+                    return _ANY
+                for code in range(low, high + 1):
+                    result.chars.update(self.literal(chr(code), flags))
+            elif op is c.CATEGORY and av in _CATEGORIES:
+                result.categories.add(_CATEGORIES[av])
+            else:
+                # Negated classes.
+                return _ANY
+        return result
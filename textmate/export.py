@@ -0,0 +1,305 @@
+"""
+Batch export of highlighted source to HTML.
+
+Renders Markdown files as HTML source views: the text of the file,
+colored with the scopes of a grammar and the styles of a theme.
+
+The style of every span is expressed with CSS classes derived from the
+colors and font styles the theme defines, so the stylesheet is written
+once for a whole tree instead of inline styles on every span. Adjacent
+tokens with the same classes are merged into a single span and text in
+the default style is not wrapped at all.
+
+The files of a directory tree are exported in a process pool, each
+worker loading the grammar and the theme once; every file is written
+through a buffered stream as it is rendered.
+
+    python -m textmate.export docs/ out/
+    python -m textmate.export docs/ out/ --theme MarkdownDark.tmTheme
+
+writes ``out/style.css`` and an ``.html`` file for every Markdown file
+of ``docs/`` at the same relative path, then reports files/s and
+bytes/s.
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from html import escape
+
+from .grammar import Registry
+from .theme import Theme
+from .tokenizer import Tokenizer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRAMMAR = os.path.join(ROOT, 'MarkdownLight.tmLanguage')
+THEME = os.path.join(ROOT, 'MarkdownLight.tmTheme')
+
+EXTENSIONS = ('.md', '.markdown', '.mdown', '.mkd', '.mkdn')
+STYLESHEET = 'style.css'
+BUFFER_SIZE = 64 * 1024
+
+# Font styles with the declarations that set and reset them.
+_FONT_STYLES = (
+    ('bold', 'font-weight: bold', 'font-weight: normal'),
+    ('italic', 'font-style: italic', 'font-style: normal'),
+    ('underline', 'text-decoration: underline', 'text-decoration: none'),
+)
+
+
+class Stylesheet:
+    """
+    CSS classes of the styles of a theme.
+
+    Every foreground and background color the theme defines gets a
+    class numbered in the order of its first appearance, every font
+    style one named after it (``tm-fg0``, ``tm-bg2``, ``tm-bold``), so
+    the classes of a style do not depend on the files exported.
+    Properties equal to the default style get no class; a font style
+    of the default that a style does not have is reset with a
+    ``no-`` class (``tm-no-bold``).
+    """
+    def __init__(self, theme, prefix='tm'):
+        self.theme = theme
+        self.prefix = prefix
+        self.foregrounds = {}
+        self.backgrounds = {}
+        for settings in [ theme.defaults ] + [ rule.settings
+                for rule in theme.rules ]:
+            for key, colors in (('foreground', self.foregrounds),
+                    ('background', self.backgrounds)):
+                color = settings.get(key)
+                if color and color not in colors:
+                    colors[color] = len(colors)
+        self._classes = {}
+
+    def classes(self, style):
+        """
+        Returns the space separated classes of a Style, '' for the
+        default style.
+        """
+        result = self._classes.get(style)
+        if result is None:
+            default = self.theme.default_style
+            names = []
+            if style.foreground and style.foreground != default.foreground:
+                names.append('{}-fg{}'.format(self.prefix,
+                    self.foregrounds[style.foreground]))
+            if style.background and style.background != default.background:
+                names.append('{}-bg{}'.format(self.prefix,
+                    self.backgrounds[style.background]))
+            if style.font_style != default.font_style:
+                font_style = style.font_style.split()
+                default_font_style = default.font_style.split()
+                for name, _, _ in _FONT_STYLES:
+                    if name in font_style and name not in default_font_style:
+                        names.append('{}-{}'.format(self.prefix, name))
+                    elif name in default_font_style and name not in font_style:
+                        names.append('{}-no-{}'.format(self.prefix, name))
+            result = self._classes[style] = ' '.join(names)
+        return result
+
+    def css(self):
+        default = self.theme.default_style
+        declarations = [ 'white-space: pre-wrap' ]
+        if default.foreground:
+            declarations.append('color: ' + default.foreground)
+        if default.background:
+            declarations.append('background-color: ' + default.background)
+        for name, declaration, _ in _FONT_STYLES:
+            if name in default.font_style.split():
+                declarations.append(declaration)
+        lines = [ 'pre.{} {{ {}; }}'.format(self.prefix,
+            '; '.join(declarations)) ]
+        for colors, kind, property in (
+                (self.foregrounds, 'fg', 'color'),
+                (self.backgrounds, 'bg', 'background-color')):
+            for color, number in colors.items():
+                lines.append('.{}-{}{} {{ {}: {}; }}'.format(self.prefix,
+                    kind, number, property, color))
+        for name, declaration, reset in _FONT_STYLES:
+            lines.append('.{}-{} {{ {}; }}'.format(self.prefix, name,
+                declaration))
+            if name in default.font_style.split():
+                lines.append('.{}-no-{} {{ {}; }}'.format(self.prefix, name,
+                    reset))
+        return '\n'.join(lines) + '\n'
+
+    def spans(self, tokens):
+        """
+        Returns ``(begin, end, classes)`` spans of ``(begin, end,
+        scopes)`` tokens, adjacent spans with the same classes being
+        merged.
+        """
+        spans = []
+        classes_of = self.classes
+        for begin, end, style in self.theme.style_runs(tokens):
+            classes = classes_of(style)
+            if spans and spans[-1][2] == classes and spans[-1][1] == begin:
+                spans[-1] = (spans[-1][0], end, classes)
+            else:
+                spans.append((begin, end, classes))
+        return spans
+
+
+def write_html(out, text, spans, prefix='tm'):
+    """
+    Writes the ``<pre>`` element of a text and its spans to a stream.
+    Text not covered by a span is written unstyled.
+    """
+    write = out.write
+    write('<pre class="{}">'.format(prefix))
+    position = 0
+    for begin, end, classes in spans:
+        if begin > position:
+            write(escape(text[position:begin], False))
+        if classes:
+            write('<span class="{}">{}</span>'.format(classes,
+                escape(text[begin:end], False)))
+        else:
+            write(escape(text[begin:end], False))
+        position = end
+    if position < len(text):
+        write(escape(text[position:], False))
+    write('</pre>\n')
+
+
+class Exporter:
+    """
+    Renders text files to HTML pages with a grammar and a theme.
+    """
+    def __init__(self, grammar=GRAMMAR, theme=THEME, search_paths=(),
+            prefix='tm'):
+        self.tokenizer = Tokenizer(Registry(search_paths).load(grammar))
+        self.stylesheet = Stylesheet(Theme.load(theme), prefix)
+
+    def render(self, out, text, title='', css=STYLESHEET):
+        """
+        Writes a page with the highlighted text to a stream. ``css`` is
+        the URL of the stylesheet.
+        """
+        spans = self.stylesheet.spans(self.tokenizer.tokenize(text))
+        out.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+            '<title>{}</title>\n<link rel="stylesheet" href="{}">\n'
+            '</head>\n<body>\n'.format(escape(title), escape(css)))
+        write_html(out, text, spans, self.stylesheet.prefix)
+        out.write('</body>\n</html>\n')
+
+    def export_file(self, source, target, css=STYLESHEET):
+        """
+        Renders a file and returns the number of bytes read.
+        """
+        with open(source, 'rb') as f:
+            data = f.read()
+        text = data.decode('utf-8', 'replace').replace('\r\n', '\n')
+        directory = os.path.dirname(target)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(target, 'w', encoding='utf-8', newline='\n',
+                buffering=BUFFER_SIZE) as out:
+            self.render(out, text, os.path.basename(source), css)
+        return len(data)
+
+
+def find_files(directory, extensions=EXTENSIONS):
+    """
+    Returns the paths, relative to ``directory``, of the files with one
+    of the extensions in a directory tree, in a stable order.
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(extensions):
+                paths.append(os.path.relpath(os.path.join(dirpath, name),
+                    directory))
+    return paths
+
+
+def _jobs(source_dir, output_dir, paths):
+    for path in paths:
+        target = os.path.join(output_dir, path + '.html')
+        css = os.path.relpath(os.path.join(output_dir, STYLESHEET),
+            os.path.dirname(target)).replace(os.sep, '/')
+        yield os.path.join(source_dir, path), target, css
+
+
+_worker_exporter = None
+
+
+def _initialize_worker(grammar, theme, search_paths, prefix):
+    global _worker_exporter
+    _worker_exporter = Exporter(grammar, theme, search_paths, prefix)
+
+
+def _export_job(job):
+    return _worker_exporter.export_file(*job)
+
+
+def export_tree(source_dir, output_dir, grammar=GRAMMAR, theme=THEME,
+        search_paths=(), workers=None, extensions=EXTENSIONS, prefix='tm'):
+    """
+    Exports every file of a directory tree with one of the extensions
+    to ``output_dir`` and writes the stylesheet there.
+
+    ``workers`` is the size of the process pool (default: the number of
+    CPUs); with 0 the files are exported in this process. Returns the
+    number of files, of bytes read and the elapsed seconds.
+    """
+    start = time.perf_counter()
+    paths = find_files(source_dir, extensions)
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = _jobs(source_dir, output_dir, paths)
+    if workers == 0:
+        exporter = Exporter(grammar, theme, search_paths, prefix)
+        sizes = [ exporter.export_file(*job) for job in jobs ]
+        stylesheet = exporter.stylesheet
+    else:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(workers, initializer=_initialize_worker,
+                initargs=(grammar, theme, list(search_paths), prefix)) as pool:
+            sizes = list(pool.map(_export_job, jobs,
+                chunksize=max(1, len(paths) // (workers * 8))))
+        stylesheet = Stylesheet(Theme.load(theme), prefix)
+    with open(os.path.join(output_dir, STYLESHEET), 'w', encoding='utf-8',
+            newline='\n') as out:
+        out.write(stylesheet.css())
+    return {
+        'files': len(paths),
+        'bytes': sum(sizes),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('source', help='directory of Markdown files')
+    parser.add_argument('output', help='output directory')
+    parser.add_argument('--grammar', default=GRAMMAR,
+        help='grammar file (default: MarkdownLight.tmLanguage)')
+    parser.add_argument('--theme', default=THEME,
+        help='theme file (default: MarkdownLight.tmTheme)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+        help='worker processes, 0 to export in this process '
+            '(default: the number of CPUs)')
+    parser.add_argument('--prefix', default='tm',
+        help='prefix of the CSS classes (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    # Grammars included by scope name are looked up like the tests do.
+    search_paths = [ path for path in os.environ.get(
+        'TEXTMATE_PACKAGES_PATH', '').split(os.pathsep) if path ]
+    stats = export_tree(args.source, args.output, args.grammar, args.theme,
+        search_paths, args.workers, prefix=args.prefix)
+    seconds = stats['seconds'] or 1e-9
+    print('{} files, {:.1f} KB in {:.2f} s: {:.1f} files/s, {:.2f} MB/s'.format(
+        stats['files'], stats['bytes'] / 1024, stats['seconds'],
+        stats['files'] / seconds, stats['bytes'] / seconds / (1024 * 1024)),
+        file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
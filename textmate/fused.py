@@ -0,0 +1,181 @@
+"""
+Fused scanning of sibling patterns.
+
+Finding the next token means finding the earliest match among the end
+pattern of the innermost rule and all its candidate patterns, ties
+being resolved by order. An alternation ``(p0)|(p1)|...`` has the same
+semantics in Python's re: the leftmost position where any alternative
+matches wins and at that position the first matching alternative is
+taken. So all patterns of a rule are combined into one regex and
+finding the next token is one search instead of one per pattern.
+
+Capture groups of every pattern are renumbered in the combined regex;
+``FusedMatch`` maps them back so that the result can be used exactly
+like a match of the original pattern. Patterns that cannot be combined
+(named groups, backreferences beyond group 99, ...) are searched
+separately.
+"""
+
+import re
+
+from . import regex as _regex
+from .dispatch import Dispatch
+
+_GLOBAL_FLAGS = re.compile(r'\(\?([aiLmsux]+)\)')
+
+
+class FusedMatch:
+    """
+    A match of one alternative of a fused regex, with the group numbers
+    of the original pattern.
+    """
+    __slots__ = ('match', 're', 'offset')
+
+    def __init__(self, match, regex, offset):
+        self.match = match
+        self.re = regex
+        self.offset = offset
+
+    def __repr__(self):
+        return '<FusedMatch span={} match={!r}>'.format(
+            self.span(), self.group())
+
+    def span(self, group=0):
+        return self.match.span(self.offset + group)
+
+    def start(self, group=0):
+        return self.match.start(self.offset + group)
+
+    def end(self, group=0):
+        return self.match.end(self.offset + group)
+
+    def group(self, group=0):
+        return self.match.group(self.offset + group)
+
+
+class FusedScanner:
+    """
+    Searches a list of ``(rule, regex, is_end, first_chars)`` patterns,
+    given in priority order, with a single regex.
+
+    The combined regex is only tried at positions where one of its
+    alternatives can start (see ``dispatch``): letting re try every
+    alternative at every position is slower than searching the
+    patterns one by one. Patterns that can start with a letter or with
+    any character would make nearly every position a candidate, so
+    they are searched separately like the patterns that cannot be
+    combined. Those are skipped without searching them when the text
+    lacks a string that every match contains (``first_chars.required``),
+    so with lazily compiled patterns they may never be compiled at all.
+    """
+    def __init__(self, patterns):
+        self.regex = self._combine(patterns, validate=False)
+        if self.regex is None and self.members:
+            # Some pattern does not work in the combination (e.g. a
+            # look-behind turned variable width by a renumbered group):
+            # add them one by one and search the failing ones separately.
+            self.regex = self._combine(patterns, validate=True)
+
+    def _combine(self, patterns, validate):
+        """
+        Fills ``members`` and ``separate`` and returns the combined
+        regex. Without ``validate`` returns None if the combination
+        does not compile.
+        """
+        self.members = {}
+        self.separate = []
+        sources = []
+        fused_first_chars = []
+        groups = 0
+        for priority, (rule, regex, is_end, first) in enumerate(patterns):
+            source = None
+            if not _is_broad(first):
+                source = _fuse(regex.pattern, groups + 1)
+            if source is not None and validate:
+                try:
+                    re.compile('|'.join(sources + [ source ]))
+                except re.error:
+                    source = None
+            if source is None:
+                self.separate.append((priority, rule, regex, is_end,
+                    first.required or ()))
+                continue
+            sources.append(source)
+            fused_first_chars.append(first)
+            self.members[groups + 1] = (priority, rule, regex, is_end)
+            groups += 1 + regex.groups
+        self.candidates = Dispatch(fused_first_chars).regex
+        if not sources:
+            return None
+        try:
+            return re.compile('|'.join(sources))
+        except re.error:
+            if validate:
+                raise
+            return None
+
+    def search(self, text, pos):
+        """
+        Returns ``(priority, rule, match, is_end)`` of the earliest match
+        or None.
+        """
+        best = None
+        if self.regex is not None:
+            m = self._match_at_candidates(text, pos)
+            if m is not None:
+                priority, rule, regex, is_end = self.members[m.lastindex]
+                best = (priority, rule, FusedMatch(m, regex, m.lastindex),
+                    is_end)
+        for priority, rule, regex, is_end, required in self.separate:
+            if required and any(text.find(s, pos) < 0 for s in required):
+                continue
+            m = regex.search(text, pos)
+            if m is None:
+                continue
+            if (best is None or m.start() < best[2].start()
+                    or m.start() == best[2].start() and priority < best[0]):
+                best = (priority, rule, m, is_end)
+        return best
+
+    def _match_at_candidates(self, text, pos):
+        match = self.regex.match
+        if pos == 0:
+            # Patterns anchored at the line start are not candidates.
+            m = match(text, 0)
+            if m is not None:
+                return m
+            pos = 1
+        for candidate in self.candidates.finditer(text, pos):
+            m = match(text, candidate.start())
+            if m is not None:
+                return m
+        return None
+
+
+def _is_broad(first):
+    return (first.chars is None or bool(first.categories)
+        or any(c.isalpha() for c in first.chars))
+
+
+def _fuse(source, offset):
+    """
+    Returns the pattern wrapped into a capture group that becomes group
+    ``offset`` of the fused regex, or None if it cannot be fused.
+    """
+    if '(?P' in source:
+        return None
+    flags = ''
+    m = _GLOBAL_FLAGS.match(source)
+    while m is not None:
+        flags += m.group(1)
+        source = source[m.end():]
+        m = _GLOBAL_FLAGS.match(source)
+    references = _regex.backreferences(source)
+    if references and references[-1] + offset > 99:
+        return None
+    source = _regex.renumber_backreferences(source, offset)
+    if flags:
+        # A trailing comment of a verbose pattern must not swallow the
+        # closing parenthesis.
+        source = '(?{}:{}{})'.format(flags, source, '\n' if 'x' in flags else '')
+    return '({})'.format(source)
@@ -0,0 +1,340 @@
+"""
+Loading of TextMate grammars (.tmLanguage plists and their YAML sources)
+and resolution of their rules.
+"""
+
+import json
+import os
+import plistlib
+
+from . import dispatch, regex
+
+COMPILED_EXTENSION = '.compiled-tmLanguage'
+
+
+def load_grammar_file(path):
+    """
+    Reads a grammar definition and returns it as a dictionary.
+
+    Supports plist (.tmLanguage), YAML (.YAML-tmLanguage, requires PyYAML)
+    and JSON (.tmLanguage.json) files.
+    """
+    lower = path.lower()
+    if lower.endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    if lower.endswith('.yaml-tmlanguage') or lower.endswith('.yaml'):
+        try:
+            import yaml
+        except ImportError as e:
+            raise ImportError('PyYAML is required to load {}'.format(path)) from e
+        with open(path, encoding='utf-8') as f:
+            return yaml.safe_load(f)
+    with open(path, 'rb') as f:
+        return plistlib.load(f)
+
+
+def split_scopes(name):
+    """
+    Splits a space separated list of scope names into a tuple.
+    """
+    return tuple(name.split()) if name else ()
+
+
+class Captures:
+    """
+    Scope names assigned to capture groups, indexed by group number.
+    """
+    def __init__(self, captures):
+        self.scopes = {}
+        for key, value in (captures or {}).items():
+            name = value.get('name') if value else None
+            if name:
+                self.scopes[int(key)] = split_scopes(name)
+        self.groups = sorted(self.scopes)
+
+    def __bool__(self):
+        return bool(self.scopes)
+
+
+class Rule:
+    """
+    A compiled grammar rule.
+
+    A rule is either a match rule (``match``), a begin/end rule
+    (``begin``/``end``) or a pure pattern list that only includes other
+    rules. ``patterns`` of the latter two are resolved lazily into a flat
+    list of match and begin/end rules, see ``Rule.candidates()``.
+    """
+    def __init__(self, grammar, raw, repository_name=None):
+        self.id = grammar.registry.next_rule_id()
+        self.grammar = grammar
+        self.raw = raw
+        self.repository_name = repository_name
+        self.name = split_scopes(raw.get('name'))
+        self.content_name = split_scopes(raw.get('contentName'))
+        self.match_source = raw.get('match')
+        self.begin_source = raw.get('begin')
+        self.end_source = raw.get('end')
+        self.apply_end_pattern_last = bool(raw.get('applyEndPatternLast'))
+        captures = raw.get('captures')
+        self.captures = Captures(captures)
+        self.begin_captures = Captures(raw.get('beginCaptures', captures))
+        self.end_captures = Captures(raw.get('endCaptures', captures))
+        self.end_references = (regex.backreferences(self.end_source)
+            if self.end_source else [])
+        self._match = None
+        self._begin = None
+        self._first_chars = None
+        self._end_first_chars = None
+        self._raw_patterns = raw.get('patterns', [])
+        self._patterns = None
+        self._candidates = None
+
+    def __repr__(self):
+        return '<Rule #{} {}>'.format(
+            self.id, self.repository_name or ' '.join(self.name) or '?')
+
+    def is_match(self):
+        return self.match_source is not None
+
+    def is_begin_end(self):
+        return self.begin_source is not None
+
+    @property
+    def match(self):
+        if self._match is None:
+            self._match = self.grammar.registry.regex_cache.compile(
+                self.match_source)
+        return self._match
+
+    @property
+    def begin(self):
+        if self._begin is None:
+            self._begin = self.grammar.registry.regex_cache.compile(
+                self.begin_source)
+        return self._begin
+
+    @property
+    def first_chars(self):
+        """
+        Characters a ``match`` or ``begin`` match can start with, see
+        ``dispatch.first_chars()``.
+        """
+        if self._first_chars is None:
+            self._first_chars = dispatch.first_chars(
+                self.match_source if self.is_match() else self.begin_source)
+        return self._first_chars
+
+    @property
+    def end_first_chars(self):
+        """
+        Characters an ``end`` match can start with, for end patterns
+        without backreferences.
+        """
+        if self._end_first_chars is None:
+            self._end_first_chars = dispatch.first_chars(self.end_source)
+        return self._end_first_chars
+
+    def end_for(self, begin_match):
+        """
+        Returns the end regex for a begin match, substituting
+        backreferences to begin captures where needed.
+        """
+        return self.grammar.registry.regex_cache.end_pattern(
+            self.end_source, self.end_references, begin_match)
+
+    @property
+    def patterns(self):
+        if self._patterns is None:
+            self._patterns = [
+                self.grammar.compile_pattern(raw) for raw in self._raw_patterns]
+        return self._patterns
+
+    def candidates(self):
+        """
+        Returns the flat list of match and begin/end rules reachable from
+        ``patterns`` through includes, in priority order.
+        """
+        if self._candidates is None:
+            result = []
+            _collect_candidates(self.patterns, result, set())
+            self._candidates = result
+        return self._candidates
+
+
+class Include:
+    """
+    An unresolved ``include`` reference.
+    """
+    def __init__(self, grammar, reference):
+        self.grammar = grammar
+        self.reference = reference
+
+    def __repr__(self):
+        return '<Include {}>'.format(self.reference)
+
+    def resolve(self):
+        """
+        Returns the referenced rule or None if it cannot be found.
+        """
+        return self.grammar.resolve_include(self.reference)
+
+
+def _collect_candidates(patterns, result, visited):
+    for pattern in patterns:
+        if isinstance(pattern, Include):
+            pattern = pattern.resolve()
+            if pattern is None:
+                continue
+        if pattern.is_match() or pattern.is_begin_end():
+            if pattern not in result:
+                result.append(pattern)
+        elif pattern.id not in visited:
+            visited.add(pattern.id)
+            _collect_candidates(pattern.patterns, result, visited)
+
+
+class Grammar:
+    """
+    A loaded TextMate grammar.
+    """
+    def __init__(self, raw, registry=None, path=None):
+        self.registry = registry if registry is not None else Registry()
+        self.path = path
+        self.raw = raw
+        self.scope_name = raw.get('scopeName')
+        self.name = raw.get('name')
+        self._repository = {}
+        self.root = Rule(self, {'patterns': raw.get('patterns', [])})
+        self.root.name = split_scopes(self.scope_name)
+
+    def __repr__(self):
+        return '<Grammar {}>'.format(self.scope_name)
+
+    def compile_pattern(self, raw):
+        if 'include' in raw:
+            return Include(self, raw['include'])
+        return Rule(self, raw)
+
+    def repository_rule(self, name):
+        """
+        Returns the compiled repository rule or None.
+        """
+        rule = self._repository.get(name)
+        if rule is None:
+            raw = self.raw.get('repository', {}).get(name)
+            if raw is None:
+                return None
+            if 'include' in raw and len(raw) == 1:
+                rule = Rule(self, {'patterns': [raw]}, name)
+            else:
+                rule = Rule(self, raw, name)
+            self._repository[name] = rule
+        return rule
+
+    def resolve_include(self, reference):
+        if reference in ('$self', '$base'):
+            return self.root
+        if reference.startswith('#'):
+            return self.repository_rule(reference[1:])
+        scope_name, _, rule_name = reference.partition('#')
+        grammar = self.registry.grammar_for_scope(scope_name)
+        if grammar is None:
+            return None
+        if rule_name:
+            return grammar.repository_rule(rule_name)
+        return grammar.root
+
+
+class Registry:
+    """
+    Loads grammars on demand and resolves references between them by
+    scope name.
+
+    ``search_paths`` are directories scanned recursively for grammar
+    files when a grammar is referenced by scope name (e.g. the
+    ``include: text.html.basic`` in fenced blocks).
+
+    ``lazy`` defers compiling every pattern until it is first searched,
+    see ``regex.LazyPattern``. Besides grammar sources, ``load()``
+    accepts grammars precompiled by ``textmate.compiled``.
+    """
+    EXTENSIONS = ('.tmLanguage', '.tmLanguage.json', '.YAML-tmLanguage')
+
+    def __init__(self, search_paths=(), regex_cache=None, lazy=False):
+        self.search_paths = list(search_paths)
+        self.regex_cache = (regex_cache if regex_cache is not None
+            else regex.RegexCache(lazy=lazy))
+        self._by_path = {}
+        self._by_scope = {}
+        self._scope_index = None
+        self._rule_ids = 0
+
+    def next_rule_id(self):
+        self._rule_ids += 1
+        return self._rule_ids
+
+    def add_search_path(self, path):
+        if path not in self.search_paths:
+            self.search_paths.append(path)
+            self._scope_index = None
+
+    def load(self, path):
+        """
+        Returns the grammar stored in the file, loading it once.
+        """
+        path = os.path.abspath(path)
+        grammar = self._by_path.get(path)
+        if grammar is None:
+            if path.endswith(COMPILED_EXTENSION):
+                from . import compiled
+                grammar = compiled.load(path, self)
+            else:
+                grammar = Grammar(load_grammar_file(path), self, path)
+            self._by_path[path] = grammar
+            if grammar.scope_name:
+                self._by_scope.setdefault(grammar.scope_name, grammar)
+        return grammar
+
+    def add(self, grammar):
+        if grammar.scope_name:
+            self._by_scope[grammar.scope_name] = grammar
+
+    def grammar_for_scope(self, scope_name):
+        """
+        Returns a grammar by its scope name or None if no such grammar
+        can be found in the search paths.
+        """
+        grammar = self._by_scope.get(scope_name)
+        if grammar is None:
+            path = self._index().get(scope_name)
+            if path is None:
+                return None
+            grammar = self.load(path)
+            self._by_scope[scope_name] = grammar
+        return grammar
+
+    def has_scope(self, scope_name):
+        return (scope_name in self._by_scope
+            or scope_name in self._index())
+
+    def _index(self):
+        if self._scope_index is None:
+            self._scope_index = {}
+            for search_path in self.search_paths:
+                for path in _grammar_files(search_path):
+                    try:
+                        scope_name = load_grammar_file(path).get('scopeName')
+                    except Exception:
+                        continue
+                    if scope_name:
+                        self._scope_index.setdefault(scope_name, path)
+        return self._scope_index
+
+
+def _grammar_files(root):
+    for directory, _, files in os.walk(root):
+        for name in sorted(files):
+            if name.endswith(Registry.EXTENSIONS):
+                yield os.path.join(directory, name)
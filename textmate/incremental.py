@@ -0,0 +1,120 @@
+"""
+Incremental tokenization of an editable document.
+
+The rule stack at the end of every line is kept together with the
+tokens of the line. After an edit, lines are re-tokenized starting from
+the first edited line until the rule stack at the end of a line that
+follows the edit is equal to the stored one; from there on the old
+tokens are still valid.
+"""
+
+import bisect
+
+
+class Document:
+    """
+    A text with tokens and rule stacks cached per line.
+
+    >>> document = Document(tokenizer, 'A\\n\\n```\\nB\\n')
+    >>> document.replace(0, 1, '*A*')
+    1
+    """
+    def __init__(self, tokenizer, text=''):
+        self.tokenizer = tokenizer
+        self.lines = ['']
+        self.line_tokens = [[]]
+        self.states = [tokenizer.initial_state()]
+        self.rescanned = 0
+        self._starts = None
+        self.replace(0, 0, text)
+
+    def __len__(self):
+        return sum(len(line) for line in self.lines)
+
+    @property
+    def text(self):
+        return ''.join(self.lines)
+
+    def line_count(self):
+        return len(self.lines)
+
+    def line_start(self, row):
+        return self._line_starts()[row]
+
+    def rowcol(self, point):
+        starts = self._line_starts()
+        row = bisect.bisect_right(starts, point) - 1
+        return row, point - starts[row]
+
+    def tokens(self):
+        """
+        Returns ``(begin, end, scopes)`` tokens of the whole text with
+        absolute positions.
+        """
+        result = []
+        for start, tokens in zip(self._line_starts(), self.line_tokens):
+            result.extend((start + begin, start + end, scopes)
+                for begin, end, scopes in tokens)
+        return result
+
+    def state(self, row):
+        """
+        Returns the rule stack at the end of the line.
+        """
+        return self.states[row]
+
+    def replace(self, begin, end, text):
+        """
+        Replaces the text between ``begin`` and ``end`` and re-tokenizes
+        the affected lines.
+
+        Returns the number of lines re-tokenized.
+        """
+        first, first_col = self.rowcol(begin)
+        last, last_col = self.rowcol(end)
+        is_final = last == len(self.lines) - 1
+        edited = (self.lines[first][:first_col] + text
+            + self.lines[last][last_col:])
+        parts = edited.split('\n')
+        new_lines = [ part + '\n' for part in parts[:-1] ]
+        if is_final:
+            new_lines.append(parts[-1])
+
+        old_states = self.states[last:]
+        self.lines[first:last + 1] = new_lines
+        self.line_tokens[first:last + 1] = [None] * len(new_lines)
+        self.states[first:last + 1] = [None] * len(new_lines)
+        self._starts = None
+
+        self.rescanned = self._retokenize(first, first + len(new_lines) - 1,
+            old_states)
+        return self.rescanned
+
+    def _retokenize(self, first, edit_end, old_states):
+        """
+        Tokenizes lines from ``first`` on. Lines from ``edit_end`` (the
+        last edited line) on ended with ``old_states`` before the edit;
+        tokenization stops as soon as one of them ends with the same
+        rule stack as before.
+        """
+        state = (self.states[first - 1] if first > 0
+            else self.tokenizer.initial_state())
+        row = first
+        while row < len(self.lines):
+            tokens, state = self.tokenizer.tokenize_line(self.lines[row], state)
+            self.line_tokens[row] = tokens
+            converged = (row >= edit_end
+                and state == old_states[row - edit_end])
+            self.states[row] = state
+            row += 1
+            if converged:
+                break
+        return row - first
+
+    def _line_starts(self):
+        if self._starts is None:
+            starts = [0]
+            for line in self.lines[:-1]:
+                starts.append(starts[-1] + len(line))
+            self._starts = starts
+        return self._starts
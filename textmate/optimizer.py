@@ -0,0 +1,427 @@
+"""
+Static optimization of TextMate grammars.
+
+Rules refer to each other through ``include``, and pure pattern lists
+(rules without ``match`` or ``begin``, like ``inline`` and
+``fenced_blocks`` in MarkdownLight) only exist to be included. The
+optimizer works on the raw grammar:
+
+- builds the include graph of the repository;
+- inlines pure pattern lists (and ``$self``) into the rules that
+  include them, so every ``patterns`` list directly names the match
+  and begin/end rules tried inside the rule, in priority order;
+- removes repository rules that are unreachable from the root;
+- removes rules that can never win because an earlier sibling matches
+  wherever they match: a rule with the same pattern, or one whose
+  pattern is a prefix of theirs (``a`` before ``ab``).
+
+Each step keeps the scope output unchanged; ``verify()`` checks it on a
+set of texts:
+
+    python -m textmate.optimizer MarkdownLight.YAML-tmLanguage \\
+        -o MarkdownLight.optimized.tmLanguage --verify demo/DEMO.md
+
+Repository rules only used by other grammars (``text.html.markdown#x``)
+must be listed with ``--keep``, otherwise they are removed as
+unreachable.
+"""
+
+import copy
+import json
+import plistlib
+import sys
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from . import regex
+from .grammar import Grammar, load_grammar_file
+from .tokenizer import Tokenizer
+
+ROOT = '$self'
+
+# Keys of a rule that only includes other rules.
+_PURE_KEYS = { 'patterns', 'include', 'comment' }
+
+
+def is_pure(raw):
+    """
+    Checks whether a raw rule is a pure pattern list (or a single
+    include) that can be replaced by its patterns.
+    """
+    return isinstance(raw, dict) and set(raw) <= _PURE_KEYS
+
+
+def include_graph(raw):
+    """
+    Returns ``{ rule: [ references ] }`` for the root (``$self``) and all
+    repository rules, references being repository names, ``$self``,
+    ``$base`` or scope names of other grammars, in order of appearance.
+    """
+    graph = { ROOT: _references(raw.get('patterns', [])) }
+    for name, rule in raw.get('repository', {}).items():
+        graph[name] = _references([ rule ])
+    return graph
+
+
+def _references(patterns):
+    result = []
+    stack = list(reversed(patterns))
+    while stack:
+        pattern = stack.pop()
+        include = pattern.get('include')
+        if include is not None:
+            reference = include[1:] if include.startswith('#') else include
+            if reference not in result:
+                result.append(reference)
+        stack.extend(reversed(pattern.get('patterns', [])))
+    return result
+
+
+def reachable(graph, roots=(ROOT,)):
+    """
+    Returns the set of rules reachable from the roots in the graph.
+    """
+    seen = set()
+    stack = list(roots)
+    while stack:
+        name = stack.pop()
+        if name in seen or name not in graph:
+            continue
+        seen.add(name)
+        stack.extend(graph[name])
+    return seen
+
+
+def pure_includes(raw):
+    """
+    Returns the number of includes of pure pattern lists, each costing
+    an indirection when the patterns of a rule are resolved.
+    """
+    repository = raw.get('repository', {})
+    count = 0
+    stack = [ raw ] + list(repository.values())
+    while stack:
+        rule = stack.pop()
+        for pattern in rule.get('patterns', []):
+            include = pattern.get('include')
+            if include is None:
+                stack.append(pattern)
+            elif include == ROOT or (include.startswith('#')
+                    and is_pure(repository.get(include[1:]))):
+                count += 1
+    return count
+
+
+class _Inliner:
+    def __init__(self, raw):
+        self.raw = raw
+        self.repository = raw.get('repository', {})
+        self.inlined = set()
+
+    def target(self, include):
+        """
+        Returns the patterns a pure include stands for, or None.
+        """
+        if include == ROOT:
+            return self.raw.get('patterns', [])
+        if include.startswith('#'):
+            rule = self.repository.get(include[1:])
+            if is_pure(rule):
+                if 'include' in rule:
+                    return [ { 'include': rule['include'] } ]
+                return rule.get('patterns', [])
+        return None
+
+    def expand(self, patterns, result, expanded):
+        """
+        Appends the patterns to ``result`` with pure includes replaced
+        by what they include. Like ``Rule.candidates()`` every pure list
+        is expanded once and every include kept once.
+        """
+        for pattern in patterns:
+            include = pattern.get('include')
+            if include is None and is_pure(pattern):
+                self.expand(pattern.get('patterns', []), result, expanded)
+                continue
+            if include is not None:
+                target = self.target(include)
+                if target is not None:
+                    if include not in expanded:
+                        expanded.add(include)
+                        self.inlined.add(include)
+                        self.expand(target, result, expanded)
+                    continue
+                if pattern in result:
+                    continue
+            result.append(pattern)
+        return result
+
+    def rule(self, raw):
+        if 'patterns' in raw and not is_pure(raw):
+            raw['patterns'] = self.expand(raw['patterns'], [], set())
+            for pattern in raw['patterns']:
+                if 'include' not in pattern:
+                    self.rule(pattern)
+
+
+def inline(raw):
+    """
+    Inlines pure pattern lists into the rules that include them. Returns
+    the new raw grammar and the inlined references.
+    """
+    raw = copy.deepcopy(raw)
+    inliner = _Inliner(raw)
+    inlined_patterns = inliner.expand(raw.get('patterns', []), [], { ROOT })
+    for rule in raw.get('repository', {}).values():
+        inliner.rule(rule)
+    # The root may include itself through $self: expand it last so that
+    # the rules above still see its original patterns.
+    raw['patterns'] = inlined_patterns
+    for pattern in raw['patterns']:
+        if 'include' not in pattern:
+            inliner.rule(pattern)
+    return raw, sorted(inliner.inlined)
+
+
+def remove_unreachable(raw, keep=()):
+    """
+    Removes repository rules that cannot be reached from the root or
+    from ``keep``. Returns the new raw grammar and the removed names.
+    """
+    raw = copy.deepcopy(raw)
+    graph = include_graph(raw)
+    used = reachable(graph, [ ROOT ] + list(keep))
+    repository = raw.get('repository', {})
+    removed = sorted(name for name in repository if name not in used)
+    for name in removed:
+        del repository[name]
+    return raw, removed
+
+
+def _freeze(items):
+    """
+    Converts a parsed pattern into nested tuples that compare equal for
+    equal patterns.
+    """
+    result = []
+    for op, av in items:
+        result.append((op, _freeze_value(av)))
+    return tuple(result)
+
+
+def _freeze_value(value):
+    if isinstance(value, sre_parse.SubPattern):
+        return _freeze(value.data)
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze_value(v) for v in value)
+    return value
+
+
+class _Pattern:
+    """
+    The parsed match or begin pattern of a raw rule.
+    """
+    def __init__(self, source, is_begin):
+        self.source = source
+        self.is_begin = is_begin
+        parsed = sre_parse.parse(regex.translate(source))
+        self.flags = parsed.state.flags
+        self.items = _freeze(parsed.data)
+        self.can_be_empty = parsed.getwidth()[0] == 0
+        self.has_branch = any(op is sre_parse.BRANCH for op, _ in parsed.data)
+
+    def shadows(self, other):
+        """
+        Returns how this pattern, tried first, keeps ``other`` from ever
+        winning: 'duplicate', 'prefix' or None.
+        """
+        if self.flags != other.flags:
+            return None
+        if self.is_begin and self.can_be_empty:
+            # An empty begin match is not taken again at the same
+            # position (see Tokenizer), letting the next pattern win.
+            return None
+        if self.source == other.source or self.items == other.items:
+            return 'duplicate'
+        if (not self.has_branch and len(self.items) < len(other.items)
+                and other.items[:len(self.items)] == self.items):
+            return 'prefix'
+        return None
+
+
+def remove_shadowed(raw):
+    """
+    Removes rules that can never win from every ``patterns`` list.
+    Returns the new raw grammar and ``(owner, index, rule, shadowed by,
+    reason)`` tuples, indices referring to the lists before removal.
+    """
+    raw = copy.deepcopy(raw)
+    repository = raw.get('repository', {})
+    removed = []
+
+    def resolve(pattern):
+        include = pattern.get('include')
+        if include is None:
+            return _label(pattern), pattern
+        if include.startswith('#'):
+            rule = repository.get(include[1:])
+            return include[1:], rule
+        return include, None
+
+    def prune(owner, patterns):
+        parsed = []
+        result = []
+        for index, pattern in enumerate(patterns):
+            label, rule = resolve(pattern)
+            current = None
+            if rule is not None and ('match' in rule or 'begin' in rule):
+                try:
+                    current = _Pattern(rule.get('match', rule.get('begin')),
+                        'begin' in rule)
+                except Exception:
+                    current = None
+            if current is not None:
+                for earlier_label, earlier in parsed:
+                    reason = earlier.shadows(current)
+                    if reason is not None:
+                        removed.append((owner, index, label, earlier_label, reason))
+                        break
+                else:
+                    parsed.append((label, current))
+                    result.append(pattern)
+                    continue
+                continue
+            result.append(pattern)
+        return result
+
+    def visit(owner, rule):
+        if 'patterns' in rule:
+            rule['patterns'] = prune(owner, rule['patterns'])
+            for index, pattern in enumerate(rule['patterns']):
+                if 'include' not in pattern:
+                    visit('{}/{}'.format(owner, index), pattern)
+
+    visit(ROOT, raw)
+    for name, rule in repository.items():
+        visit(name, rule)
+    return raw, removed
+
+
+def _label(raw):
+    return raw.get('name') or raw.get('match') or raw.get('begin') or '?'
+
+
+def optimize(raw, keep=()):
+    """
+    Returns the optimized raw grammar and a report dictionary.
+    """
+    unreachable = sorted(set(raw.get('repository', {}))
+        - reachable(include_graph(raw), [ ROOT ] + list(keep)))
+    result, inlined = inline(raw)
+    result, removed = remove_unreachable(result, keep)
+    result, shadowed = remove_shadowed(result)
+    # Rules only used where they were shadowed are unreachable now.
+    result, orphaned = remove_unreachable(result, keep)
+    report = {
+        'rules': len(raw.get('repository', {})),
+        'unreachable': unreachable,
+        'inlined': inlined,
+        'shadowed': shadowed,
+        'removed': sorted(removed + orphaned),
+        'pure_includes': (pure_includes(raw), pure_includes(result)),
+    }
+    return result, report
+
+
+def verify(expected, actual, texts):
+    """
+    Tokenizes the texts with two grammars and returns ``(index, token,
+    expected token)`` for every text whose tokens differ.
+    """
+    expected_tokenizer = Tokenizer(expected)
+    actual_tokenizer = Tokenizer(actual)
+    differences = []
+    for index, text in enumerate(texts):
+        tokens = actual_tokenizer.tokenize(text)
+        expected_tokens = expected_tokenizer.tokenize(text)
+        if tokens != expected_tokens:
+            for token, expected_token in zip(tokens + [ None ],
+                    expected_tokens + [ None ]):
+                if token != expected_token:
+                    differences.append((index, token, expected_token))
+                    break
+    return differences
+
+
+def write_grammar_file(raw, path):
+    """
+    Writes a grammar in the format given by the extension of the path
+    (see ``load_grammar_file()``).
+    """
+    lower = path.lower()
+    if lower.endswith('.json'):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(raw, f, indent=2)
+            f.write('\n')
+    elif lower.endswith('.yaml-tmlanguage') or lower.endswith('.yaml'):
+        import yaml
+
+        class Dumper(yaml.SafeDumper):
+            # Inlined rules are shared between their users; every copy
+            # is written in full rather than as an anchor and aliases.
+            def ignore_aliases(self, data):
+                return True
+
+        with open(path, 'w', encoding='utf-8') as f:
+            yaml.dump(raw, f, Dumper=Dumper, sort_keys=False,
+                allow_unicode=True)
+    else:
+        with open(path, 'wb') as f:
+            plistlib.dump(raw, f)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('source', help='grammar file')
+    parser.add_argument('-o', '--output', help='optimized grammar file')
+    parser.add_argument('--keep', nargs='+', default=[],
+        help='repository rules to keep even if unreachable')
+    parser.add_argument('--verify', nargs='+', default=[],
+        help='text files that must be tokenized identically')
+    args = parser.parse_args(argv)
+
+    raw = load_grammar_file(args.source)
+    optimized, report = optimize(raw, args.keep)
+    print('{} repository rules, includes of pure pattern lists {} -> {}'.format(
+        report['rules'], *report['pure_includes']), file=sys.stderr)
+    for key in ('unreachable', 'inlined', 'removed'):
+        print('{}: {}'.format(key, ', '.join(report[key]) or '-'),
+            file=sys.stderr)
+    for owner, index, label, by, reason in report['shadowed']:
+        print('shadowed: {}[{}] {} by {} ({})'.format(owner, index, label,
+            by, reason), file=sys.stderr)
+
+    if args.verify:
+        texts = []
+        for path in args.verify:
+            with open(path, encoding='utf-8') as f:
+                texts.append(f.read())
+        differences = verify(Grammar(raw), Grammar(optimized), texts)
+        for index, token, expected in differences:
+            print('{}: {} instead of {}'.format(args.verify[index], token,
+                expected), file=sys.stderr)
+        if differences:
+            return 1
+        print('verified on {} texts'.format(len(texts)), file=sys.stderr)
+
+    if args.output:
+        write_grammar_file(optimized, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
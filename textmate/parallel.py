@@ -0,0 +1,199 @@
+"""
+Parallel tokenization of large documents.
+
+A blank line outside of a fenced block usually closes every open block
+of MarkdownLight, so the line after it starts in the root state again.
+The document is split into chunks after such lines and the chunks are
+tokenized in a process pool, each worker loading the grammar once.
+
+Whether a chunk really starts in the root state is only known once the
+previous chunk is tokenized: every worker reports the last line of
+its chunk after which the state was the root state. A chunk whose
+predecessor did not end in it (a blank line inside a list item, an
+HTML block, ...) is re-tokenized serially from the actual state, up to
+the next chunk that starts in the root state again. The result is always identical to Tokenizer.tokenize().
+
+    >>> with ParallelTokenizer('MarkdownLight.tmLanguage') as tokenizer:
+    ...     tokens = tokenizer.tokenize(text)
+"""
+
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from .grammar import Registry
+from .tokenizer import Tokenizer, split_lines
+
+MIN_CHUNK = 256 * 1024
+
+_FENCE = re.compile(r'\s*```')
+
+
+def split_points(lines, min_chunk=MIN_CHUNK):
+    """
+    Returns the indices of the lines that start a new chunk: lines that
+    follow a blank line outside of a fenced block, at least
+    ``min_chunk`` characters after the previous split point.
+    """
+    points = []
+    in_fence = False
+    size = 0
+    for index, line in enumerate(lines):
+        if _FENCE.match(line):
+            in_fence = not in_fence
+        size += len(line)
+        if (size >= min_chunk and not in_fence and not line.strip()
+                and index + 1 < len(lines)):
+            points.append(index + 1)
+            size = 0
+    return points
+
+
+def encode(tokens):
+    """
+    Packs ``(begin, end, scopes)`` tokens into a flat array and a table
+    of distinct scope stacks, which is much cheaper to send between
+    processes.
+    """
+    ids = {}
+    stacks = []
+    flat = array('l')
+    for begin, end, scopes in tokens:
+        stack_id = ids.get(scopes)
+        if stack_id is None:
+            stack_id = ids[scopes] = len(stacks)
+            stacks.append(scopes)
+        flat.extend((begin, end, stack_id))
+    return flat, stacks
+
+
+def decode(flat, stacks, offset=0):
+    return [ (flat[i] + offset, flat[i + 1] + offset, stacks[flat[i + 2]])
+        for i in range(0, len(flat), 3) ]
+
+
+_worker_tokenizer = None
+
+
+def _load(path, search_paths):
+    registry = Registry(search_paths)
+    return Tokenizer(registry.load(path))
+
+
+def _initialize_worker(path, search_paths):
+    global _worker_tokenizer
+    _worker_tokenizer = _load(path, search_paths)
+
+
+def _tokenize_chunk(lines):
+    """
+    Tokenizes a chunk starting in the root state. Returns the encoded
+    tokens and the number of lines after which the state was the root
+    state for the last time (``len(lines)`` if the chunk ends in it).
+    """
+    tokenizer = _worker_tokenizer
+    state = initial = tokenizer.initial_state()
+    tokens = []
+    offset = 0
+    root_lines = 0
+    for index, line in enumerate(lines):
+        line_tokens, state = tokenizer.tokenize_line(line, state, offset)
+        tokens.extend(line_tokens)
+        offset += len(line)
+        if state == initial:
+            root_lines = index + 1
+    flat, stacks = encode(tokens)
+    return flat, stacks, root_lines
+
+
+class ParallelTokenizer:
+    """
+    Tokenizes documents with a grammar file in a pool of processes.
+
+    ``stats`` counts the chunks tokenized in parallel and the chunks
+    that had to be re-tokenized serially.
+    """
+    def __init__(self, path, search_paths=(), workers=None,
+            min_chunk=MIN_CHUNK):
+        self.path = path
+        self.search_paths = list(search_paths)
+        self.workers = workers
+        self.min_chunk = min_chunk
+        self.stats = { 'chunks': 0, 'fallback': 0 }
+        self._tokenizer = None
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    @property
+    def tokenizer(self):
+        """
+        The Tokenizer used for small documents and serial fallback.
+        """
+        if self._tokenizer is None:
+            self._tokenizer = _load(self.path, self.search_paths)
+        return self._tokenizer
+
+    def pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers,
+                initializer=_initialize_worker,
+                initargs=(self.path, self.search_paths))
+        return self._pool
+
+    def tokenize(self, text):
+        """
+        Returns the same ``(begin, end, scopes)`` tokens as
+        ``Tokenizer.tokenize(text)``.
+        """
+        lines = split_lines(text)
+        points = split_points(lines, self.min_chunk)
+        if not points:
+            return self.tokenizer.tokenize(text)
+        bounds = list(zip([ 0 ] + points, points + [ len(lines) ]))
+        futures = [ self.pool().submit(_tokenize_chunk, lines[begin:end])
+            for begin, end in bounds ]
+        self.stats['chunks'] += len(bounds)
+
+        tokens = []
+        offset = 0
+        # The actual state at the start of the current chunk or None if
+        # it is the root state.
+        state = None
+        for (begin, end), future in zip(bounds, futures):
+            if state is None:
+                flat, stacks, root_lines = future.result()
+                tokens.extend(decode(flat, stacks, offset))
+                offset += sum(len(line) for line in lines[begin:end])
+                if begin + root_lines < end:
+                    state = self._end_state(lines[begin + root_lines:end])
+                continue
+            future.cancel()
+            self.stats['fallback'] += 1
+            for line in lines[begin:end]:
+                line_tokens, state = self.tokenizer.tokenize_line(
+                    line, state, offset)
+                tokens.extend(line_tokens)
+                offset += len(line)
+            if state == self.tokenizer.initial_state():
+                state = None
+        return tokens
+
+    def _end_state(self, lines):
+        """
+        Returns the state at the end of lines that start in the root
+        state.
+        """
+        state = self.tokenizer.initial_state()
+        for line in lines:
+            _, state = self.tokenizer.tokenize_line(line, state)
+        return state
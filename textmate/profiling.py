@@ -0,0 +1,168 @@
+"""
+Per-rule profiling of the tokenizer.
+
+ProfilingTokenizer searches every pattern separately (the fused scanner
+cannot tell which rule took the time) and records, per grammar rule,
+how often its pattern was searched, how often it matched, the total
+and the maximum search time and the line that took the longest:
+
+    >>> tokenizer = ProfilingTokenizer(registry.load('MarkdownLight.tmLanguage'))
+    >>> tokenizer.tokenize(text)
+    >>> print(tokenizer.profiler.report())
+
+The plain Tokenizer is not affected, so there is no overhead unless
+profiling is used. From the command line:
+
+    python -m textmate.profiling demo/DEMO.md
+"""
+
+import sys
+import time
+
+from .regex import LazyPattern
+from .tokenizer import Tokenizer
+
+_clock = time.perf_counter
+
+
+class RuleStats:
+    """
+    Search statistics of one rule.
+    """
+    __slots__ = ('attempts', 'matches', 'total', 'max', 'worst_line')
+
+    def __init__(self):
+        self.attempts = 0
+        self.matches = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.worst_line = None
+
+    def __repr__(self):
+        return '<RuleStats attempts={} matches={} total={:.6f}>'.format(
+            self.attempts, self.matches, self.total)
+
+
+class Profiler:
+    """
+    Collects RuleStats by rule label.
+
+    Rules defined in the grammar repository are labelled with their
+    repository name (``bold``, ``list_item``, ...), nested rules with
+    their scope name. The end pattern of a rule gets ``(end)`` appended.
+    """
+    def __init__(self):
+        self.rules = {}
+
+    def record(self, label, line, seconds, matched):
+        stats = self.rules.get(label)
+        if stats is None:
+            stats = self.rules[label] = RuleStats()
+        stats.attempts += 1
+        if matched:
+            stats.matches += 1
+        stats.total += seconds
+        if seconds > stats.max:
+            stats.max = seconds
+            stats.worst_line = line
+
+    def sorted(self):
+        """
+        Returns ``(label, stats)`` pairs, the most expensive rule first.
+        """
+        return sorted(self.rules.items(), key=lambda item: -item[1].total)
+
+    def report(self, limit=None, line_width=60):
+        """
+        Returns a table of the rules sorted by total search time.
+        """
+        rows = self.sorted()[:limit]
+        total = sum(stats.total for stats in self.rules.values()) or 1.0
+        lines = [ '{:<32} {:>9} {:>9} {:>10} {:>6} {:>9}  {}'.format(
+            'rule', 'attempts', 'matches', 'total ms', '%', 'max ms',
+            'worst line') ]
+        for label, stats in rows:
+            worst = (stats.worst_line or '').rstrip('\n')
+            if len(worst) > line_width:
+                worst = worst[:line_width - 3] + '...'
+            lines.append('{:<32} {:>9} {:>9} {:>10.3f} {:>6.1f} {:>9.3f}  {!r}'.format(
+                label, stats.attempts, stats.matches, stats.total * 1000,
+                stats.total * 100 / total, stats.max * 1000, worst))
+        return '\n'.join(lines)
+
+
+def label(rule):
+    if rule.repository_name:
+        return rule.repository_name
+    if rule.name:
+        return rule.name[-1]
+    return '#{}'.format(rule.id)
+
+
+def _compile(pattern):
+    """
+    Compiles a LazyPattern before its first search, so that only the
+    search is measured.
+    """
+    if isinstance(pattern, LazyPattern):
+        pattern.compile()
+
+
+class ProfilingTokenizer(Tokenizer):
+    """
+    A Tokenizer that records per-rule statistics in ``profiler``.
+    """
+    def __init__(self, grammar, profiler=None):
+        super().__init__(grammar, fused=False)
+        self.profiler = profiler if profiler is not None else Profiler()
+        self._labels = {}
+
+    def _label(self, rule, is_end):
+        key = (rule.id, is_end)
+        name = self._labels.get(key)
+        if name is None:
+            name = label(rule) + (' (end)' if is_end else '')
+            self._labels[key] = name
+        return name
+
+    def _search_end(self, text, pos, stack):
+        _compile(stack.end)
+        started = _clock()
+        m = Tokenizer._search_end(text, pos, stack)
+        self.profiler.record(self._label(stack.rule, True), text,
+            _clock() - started, m is not None)
+        return m
+
+    def _search_rule(self, text, pos, rule, stack):
+        _compile(rule.match if rule.is_match() else rule.begin)
+        started = _clock()
+        m = Tokenizer._search_rule(text, pos, rule, stack)
+        self.profiler.record(self._label(rule, False), text,
+            _clock() - started, m is not None)
+        return m
+
+
+def main(argv=None):
+    import argparse
+    import os
+    from .grammar import Registry
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(
+        description='Profiles grammar rules on Markdown files.')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--grammar',
+        default=os.path.join(root, 'MarkdownLight.tmLanguage'))
+    parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    tokenizer = ProfilingTokenizer(Registry().load(args.grammar))
+    for path in args.files:
+        with open(path, encoding='utf-8') as f:
+            tokenizer.tokenize(f.read())
+    print(tokenizer.profiler.report(args.limit))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""
+Translation of Oniguruma regular expressions used in TextMate grammars
+into patterns understood by Python's re module.
+
+Only the constructs that actually differ between the two engines are
+rewritten:
+
+- ``\\x{HHHH}`` code point escapes become ``\\uHHHH`` / ``\\UHHHHHHHH``;
+- variable width look-behind alternations such as ``(?<=^|_|\\W)`` are
+  split into one fixed width look-behind per alternative.
+
+Everything else (possessive quantifiers, atomic groups, ``{,n}``
+quantifiers, inline flags) is supported by re since Python 3.11.
+"""
+
+import re
+from collections import OrderedDict
+
+try:
+    from re import _parser
+except ImportError:
+    import sre_parse as _parser
+
+_CODE_POINT = re.compile(r'\\x\{([0-9a-fA-F]+)\}')
+
+
+class RegexError(ValueError):
+    """Raised when a grammar pattern cannot be compiled."""
+
+
+def translate(pattern):
+    """
+    Returns Python re source equivalent to the Oniguruma pattern.
+    """
+    pattern = _replace_code_points(pattern)
+    return _split_lookbehinds(pattern)
+
+
+def compile(pattern):
+    """
+    Translates and compiles the Oniguruma pattern.
+    """
+    source = translate(pattern)
+    try:
+        return re.compile(source)
+    except re.error as e:
+        raise RegexError('Cannot compile /{}/: {}'.format(pattern, e)) from e
+
+
+def group_count(source):
+    """
+    Returns the number of capture groups of a Python re source without
+    compiling it.
+    """
+    try:
+        return _parser.parse(source).state.groups - 1
+    except re.error as e:
+        raise RegexError('Cannot parse /{}/: {}'.format(source, e)) from e
+
+
+class LazyPattern:
+    """
+    A translated pattern that is compiled when it is first used.
+
+    ``pattern`` and ``groups`` are known without compiling, which is
+    all a fused scanner needs from its members. Once compiled,
+    ``search``, ``match`` and ``finditer`` are the methods of the
+    compiled regex itself, so laziness costs nothing afterwards. A
+    pattern that does not compile raises RegexError on first use.
+    """
+    def __init__(self, original, source=None, groups=None):
+        self.original = original
+        self.pattern = source if source is not None else translate(original)
+        self.groups = groups if groups is not None else group_count(self.pattern)
+        self.compiled = None
+
+    def __repr__(self):
+        return '<LazyPattern /{}/{}>'.format(self.original,
+            '' if self.compiled is None else ' compiled')
+
+    def compile(self):
+        if self.compiled is None:
+            try:
+                self.compiled = re.compile(self.pattern)
+            except re.error as e:
+                raise RegexError('Cannot compile /{}/: {}'.format(
+                    self.original, e)) from e
+            self.search = self.compiled.search
+            self.match = self.compiled.match
+            self.finditer = self.compiled.finditer
+        return self.compiled
+
+    def search(self, *args):
+        return self.compile().search(*args)
+
+    def match(self, *args):
+        return self.compile().match(*args)
+
+    def finditer(self, *args):
+        return self.compile().finditer(*args)
+
+
+def escape_backreference(value):
+    """
+    Escapes a captured value so that it can be substituted for a
+    backreference in an end pattern.
+    """
+    return re.escape(value)
+
+
+def substitute_backreferences(pattern, match):
+    """
+    Replaces ``\\N`` backreferences of an end pattern with the text
+    captured by the begin match.
+    """
+    def replace(m):
+        index = int(m.group(2))
+        value = match.group(index) if index <= match.re.groups else None
+        return m.group(1) + escape_backreference(value or '')
+    return _BACKREFERENCE.sub(replace, pattern)
+
+
+def backreferences(pattern):
+    """
+    Returns the sorted group numbers referenced by the pattern.
+    """
+    return sorted(set(int(m.group(2)) for m in _BACKREFERENCE.finditer(pattern)))
+
+
+def renumber_backreferences(pattern, offset):
+    """
+    Adds ``offset`` to the group numbers of all backreferences.
+    """
+    def replace(m):
+        return '{}(?:\\{})'.format(m.group(1), int(m.group(2)) + offset)
+    return _BACKREFERENCE.sub(replace, pattern)
+
+
+class RegexCache:
+    """
+    Compiles every pattern once.
+
+    Static patterns are kept forever. End patterns with backreferences
+    are specialized per distinct captured text (``*`` vs ``__``,
+    a fence with or without indentation, ...) and kept in an LRU cache
+    of at most ``maxsize`` entries.
+
+    With ``lazy`` set static patterns are returned as LazyPattern and
+    only compiled when first searched. ``sources`` may hold translated
+    sources and group counts known in advance (see ``compiled``).
+    """
+    def __init__(self, maxsize=256, lazy=False):
+        self.maxsize = maxsize
+        self.lazy = lazy
+        self.static = {}
+        self.sources = {}
+        self.dynamic = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def compile(self, pattern):
+        regex = self.static.get(pattern)
+        if regex is None:
+            self.misses += 1
+            source, groups = self.sources.get(pattern, (None, None))
+            if self.lazy:
+                regex = LazyPattern(pattern, source, groups)
+            elif source is not None:
+                regex = LazyPattern(pattern, source, groups).compile()
+            else:
+                regex = compile(pattern)
+            self.static[pattern] = regex
+        else:
+            self.hits += 1
+        return regex
+
+    def end_pattern(self, pattern, groups, begin_match):
+        """
+        Returns the end pattern specialized for the begin match.
+        ``groups`` are the group numbers referenced by the pattern,
+        see backreferences().
+        """
+        if not groups:
+            return self.compile(pattern)
+        key = (pattern, tuple(
+            begin_match.group(i) if i <= begin_match.re.groups else None
+            for i in groups))
+        regex = self.dynamic.get(key)
+        if regex is not None:
+            self.hits += 1
+            self.dynamic.move_to_end(key)
+            return regex
+        self.misses += 1
+        regex = compile(substitute_backreferences(pattern, begin_match))
+        self.dynamic[key] = regex
+        if len(self.dynamic) > self.maxsize:
+            self.dynamic.popitem(last=False)
+            self.evictions += 1
+        return regex
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'static': len(self.static),
+            'dynamic': len(self.dynamic),
+        }
+
+
+# A backreference is a backslash followed by digits that is not itself
+# escaped by a preceding backslash.
+_BACKREFERENCE = re.compile(r'(?<!\\)((?:\\\\)*)\\(\d+)')
+
+
+def _replace_code_points(pattern):
+    def replace(m):
+        code = m.group(1)
+        if len(code) <= 4:
+            return '\\u' + code.rjust(4, '0')
+        return '\\U' + code.rjust(8, '0')
+    return _CODE_POINT.sub(replace, pattern)
+
+
+def _split_lookbehinds(pattern):
+    result = []
+    pos = 0
+    while True:
+        start = _find_lookbehind(pattern, pos)
+        if start < 0:
+            result.append(pattern[pos:])
+            return ''.join(result)
+        negative = pattern[start + 3] == '!'
+        end = _find_group_end(pattern, start)
+        body = pattern[start + 4:end]
+        alternatives = _split_alternatives(body)
+        result.append(pattern[pos:start])
+        if len(alternatives) == 1:
+            result.append(pattern[start:end + 1])
+        elif negative:
+            result.append(''.join('(?<!{})'.format(a) for a in alternatives))
+        else:
+            result.append('(?:{})'.format(
+                '|'.join('(?<={})'.format(a) for a in alternatives)))
+        pos = end + 1
+
+
+def _find_lookbehind(pattern, pos):
+    i = pos
+    in_class = False
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        if in_class:
+            if c == ']':
+                in_class = False
+        elif c == '[':
+            in_class = True
+        elif pattern.startswith('(?<=', i) or pattern.startswith('(?<!', i):
+            return i
+        i += 1
+    return -1
+
+
+def _find_group_end(pattern, start):
+    depth = 0
+    i = start
+    in_class = False
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        if in_class:
+            if c == ']':
+                in_class = False
+        elif c == '[':
+            in_class = True
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    raise RegexError('Unbalanced parenthesis in /{}/'.format(pattern))
+
+
+def _split_alternatives(body):
+    alternatives = []
+    depth = 0
+    begin = 0
+    i = 0
+    in_class = False
+    while i < len(body):
+        c = body[i]
+        if c == '\\':
+            i += 2
+            continue
+        if in_class:
+            if c == ']':
+                in_class = False
+        elif c == '[':
+            in_class = True
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            alternatives.append(body[begin:i])
+            begin = i + 1
+        i += 1
+    alternatives.append(body[begin:])
+    return alternatives
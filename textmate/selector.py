@@ -0,0 +1,157 @@
+"""
+TextMate scope selectors.
+
+A selector is a comma separated list of alternatives; an alternative is
+a path of space separated scope prefixes, optionally followed by
+exclusions introduced with ``-``:
+
+    markup.bold markup.italic, markup.italic markup.bold
+    markup.raw - markup.raw.inline
+
+A path matches a scope stack (outermost scope first) if its elements
+are prefixes, component by component, of scopes in the stack in the
+same order, not necessarily adjacent: ``markup.bold`` matches
+``markup.bold.markdown`` but not ``markup.boldface``.
+
+The score of a match ranks selectors by specificity: the element
+matched deepest in the stack counts most, then the number of its
+components, then the same for the preceding elements. Scores are
+tuples and compare with the usual operators; a selector that does not
+match scores None.
+"""
+
+import re
+
+_SPLIT_SCOPE = {}
+
+# A "-" starts an exclusion when it stands alone; scope names may
+# contain dashes (``meta.dummy.line-break``).
+_EXCLUSION = re.compile(r'(?:^|\s)-(?=\s|$)')
+
+
+def components(scope):
+    """
+    Returns the dot separated components of a scope name as a tuple,
+    memoized.
+    """
+    result = _SPLIT_SCOPE.get(scope)
+    if result is None:
+        result = _SPLIT_SCOPE[scope] = tuple(scope.split('.'))
+    return result
+
+
+class Path:
+    """
+    A sequence of scope prefixes that must match in order.
+    """
+    __slots__ = ('atoms',)
+
+    def __init__(self, text):
+        self.atoms = tuple(components(atom) for atom in text.split())
+
+    def __repr__(self):
+        return ' '.join('.'.join(atom) for atom in self.atoms)
+
+    def score(self, stack):
+        """
+        Returns the score of the path against a stack of scope
+        component tuples, or None.
+        """
+        atoms = self.atoms
+        if not atoms:
+            return None
+        result = []
+        position = len(stack) - 1
+        for atom in reversed(atoms):
+            size = len(atom)
+            while position >= 0 and stack[position][:size] != atom:
+                position -= 1
+            if position < 0:
+                return None
+            result.append((position, size))
+            position -= 1
+        return tuple(result)
+
+
+class Alternative:
+    """
+    A path with optional exclusions.
+    """
+    __slots__ = ('path', 'exclusions')
+
+    def __init__(self, text):
+        parts = _EXCLUSION.split(text)
+        self.path = Path(parts[0])
+        self.exclusions = [ Path(part) for part in parts[1:] if part.strip() ]
+
+    def __repr__(self):
+        return ' - '.join([ repr(self.path) ]
+            + [ repr(path) for path in self.exclusions ])
+
+    def score(self, stack):
+        result = self.path.score(stack)
+        if result is None:
+            return None
+        for path in self.exclusions:
+            if path.score(stack) is not None:
+                return None
+        return result
+
+
+class Selector:
+    """
+    A compiled scope selector.
+
+        >>> Selector('markup.heading markup.italic').score(
+        ...     ('text.html.markdown', 'markup.heading.1.markdown',
+        ...      'markup.italic.markdown'))
+        ((2, 2), (1, 2))
+    """
+    __slots__ = ('text', 'alternatives')
+
+    def __init__(self, text):
+        self.text = text
+        self.alternatives = [ Alternative(part) for part in text.split(',')
+            if part.strip() ]
+
+    def __repr__(self):
+        return '<Selector {!r}>'.format(self.text)
+
+    def last_atoms(self):
+        """
+        Returns the scope prefixes one of which must be in a stack for
+        the selector to match it.
+        """
+        return [ alternative.path.atoms[-1]
+            for alternative in self.alternatives if alternative.path.atoms ]
+
+    def score(self, scopes):
+        """
+        Returns the best score of the selector against a tuple of scope
+        names, or None if it does not match.
+        """
+        return self.score_components([ components(scope) for scope in scopes ])
+
+    def score_components(self, stack):
+        best = None
+        for alternative in self.alternatives:
+            result = alternative.score(stack)
+            if result is not None and (best is None or result > best):
+                best = result
+        return best
+
+    def matches(self, scopes):
+        return self.score(scopes) is not None
+
+
+_compiled = {}
+
+
+def compile(text):
+    """
+    Returns the Selector of a selector string, compiling it once.
+    """
+    selector = _compiled.get(text)
+    if selector is None:
+        selector = _compiled[text] = Selector(text)
+    return selector
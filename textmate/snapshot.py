@@ -0,0 +1,292 @@
+"""
+Golden scope snapshots.
+
+A snapshot locks down the scope stack of every character of a set of
+documents. Per line, the tokens are run-length encoded as ``(length,
+scopes)`` runs, adjacent tokens with the same scopes being merged, and
+stored in a versioned text format that stays readable in diffs:
+
+    scope-snapshot 1
+    scopes 3
+    text.html.markdown
+    markup.heading.1.markdown
+    punctuation.definition.heading.markdown
+    stacks 3
+    -1 0
+    0 1
+    1 2
+    document DEMO.md 5d41402abc4b2a76 2
+    1.2 18.1
+    20.0
+
+Every scope name and every stack is stored once per file: a stack is
+its parent stack and its innermost scope (``-1`` for none), a run is
+``length.stack``. A document line holds the runs of a line of text,
+``.`` standing for a line without runs. The header of a document has
+its name, the start of the SHA-1 of its text and its number of lines.
+
+Comparing a document with its snapshot is a list comparison of runs;
+only when it fails is the difference located:
+
+    >>> snapshot = Snapshot.read('tests/snapshots/demo.scopes')
+    >>> snapshot.compare('DEMO.md', text, snapshot_runs(tokenizer, text))
+    ['DEMO.md: line 12 column 4 "*A*": expected "..." got "..."']
+
+    python -m textmate.snapshot demo.scopes demo/DEMO.md
+    python -m textmate.snapshot demo.scopes demo/DEMO.md --update
+"""
+
+import hashlib
+import os
+import sys
+
+from .tokenizer import split_lines
+
+FORMAT_VERSION = 1
+HEADER = 'scope-snapshot'
+
+# Divergent lines reported by compare().
+MAX_LINES = 5
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def snapshot_runs(tokenizer, text):
+    """
+    Returns the runs of every line of a text: a list of tuples of
+    ``(length, scopes)``.
+    """
+    text_lines = split_lines(text)
+    lines = []
+    for line, (tokens, _) in zip(text_lines,
+            tokenizer.tokenize_lines(text_lines)):
+        runs = []
+        position = 0
+        for begin, end, scopes in tokens:
+            if begin > position:
+                runs.append((begin - position, ()))
+            if runs and runs[-1][1] == scopes:
+                runs[-1] = (runs[-1][0] + end - begin, scopes)
+            else:
+                runs.append((end - begin, scopes))
+            position = end
+        if position < len(line):
+            runs.append((len(line) - position, ()))
+        lines.append(tuple(runs))
+    return lines
+
+
+class Snapshot:
+    """
+    The runs of named documents.
+
+    ``documents`` maps names to ``(digest, lines)``, lines being the
+    result of snapshot_runs().
+    """
+    def __init__(self):
+        self.documents = {}
+
+    def __contains__(self, name):
+        return name in self.documents
+
+    def add(self, name, text, lines):
+        self.documents[name] = (digest(text), lines)
+
+    def compare(self, name, text, lines):
+        """
+        Returns a list of messages describing the differences between
+        the snapshot of a document and its actual runs, empty if they
+        are equal.
+        """
+        if name not in self.documents:
+            return [ 'no snapshot of {}'.format(name) ]
+        expected_digest, expected = self.documents[name]
+        if expected == lines:
+            return []
+        if expected_digest != digest(text):
+            return [ 'the text of {} changed since the snapshot'.format(name) ]
+        text_lines = split_lines(text)
+        messages = []
+        divergent = [ index for index, runs in enumerate(lines)
+            if index >= len(expected) or expected[index] != runs ]
+        for index in divergent[:MAX_LINES]:
+            column, expected_scopes, actual_scopes = _first_difference(
+                expected[index] if index < len(expected) else (),
+                lines[index])
+            messages.append('{}: line {} column {} "{}": expected "{}" got "{}"'.format(
+                name, index + 1, column + 1,
+                text_lines[index].rstrip('\n'),
+                ' '.join(expected_scopes), ' '.join(actual_scopes)))
+        if len(divergent) > MAX_LINES:
+            messages.append('{}: {} more divergent lines'.format(name,
+                len(divergent) - MAX_LINES))
+        return messages
+
+    # ------------------------------------------------------
+
+    def dumps(self):
+        scope_ids = {}
+        stack_ids = {}
+        stacks = []
+
+        def stack_id(scopes):
+            if not scopes:
+                return -1
+            number = stack_ids.get(scopes)
+            if number is None:
+                parent = stack_id(scopes[:-1])
+                scope = scope_ids.setdefault(scopes[-1], len(scope_ids))
+                number = stack_ids[scopes] = len(stacks)
+                stacks.append((parent, scope))
+            return number
+
+        documents = []
+        for name, (text_digest, lines) in self.documents.items():
+            documents.append('document {} {} {}'.format(name, text_digest,
+                len(lines)))
+            for runs in lines:
+                documents.append(' '.join('{}.{}'.format(length,
+                    stack_id(scopes)) for length, scopes in runs) or '.')
+        parts = [ '{} {}'.format(HEADER, FORMAT_VERSION),
+            'scopes {}'.format(len(scope_ids)) ]
+        parts.extend(scope_ids)
+        parts.append('stacks {}'.format(len(stacks)))
+        parts.extend('{} {}'.format(parent, scope) for parent, scope in stacks)
+        parts.extend(documents)
+        return '\n'.join(parts) + '\n'
+
+    @classmethod
+    def loads(cls, data):
+        lines = iter(data.splitlines())
+        try:
+            header = next(lines).split()
+            if header[:1] != [ HEADER ]:
+                raise SnapshotError('not a scope snapshot')
+            if header[1:] != [ str(FORMAT_VERSION) ]:
+                raise SnapshotError('unsupported snapshot version {}'.format(
+                    ' '.join(header[1:])))
+            scopes = [ next(lines) for _ in range(_count(next(lines), 'scopes')) ]
+            stacks = []
+            for _ in range(_count(next(lines), 'stacks')):
+                parent, scope = next(lines).split()
+                parent = int(parent)
+                stacks.append((stacks[parent] if parent >= 0 else ())
+                    + (scopes[int(scope)],))
+            snapshot = cls()
+            for header in lines:
+                kind, rest = header.split(' ', 1)
+                if kind != 'document':
+                    raise SnapshotError('expected a document: {}'.format(header))
+                name, text_digest, count = rest.rsplit(' ', 2)
+                runs = []
+                for _ in range(int(count)):
+                    line = next(lines)
+                    runs.append(tuple(_run(run, stacks)
+                        for run in line.split() if run != '.'))
+                snapshot.documents[name] = (text_digest, runs)
+        except (StopIteration, ValueError, IndexError) as e:
+            raise SnapshotError('truncated or corrupt snapshot') from e
+        return snapshot
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(self.dumps())
+
+    @classmethod
+    def read(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls.loads(f.read())
+
+
+def _count(line, kind):
+    name, count = line.split()
+    if name != kind:
+        raise SnapshotError('expected {}: {}'.format(kind, line))
+    return int(count)
+
+
+def _run(text, stacks):
+    length, stack = text.split('.')
+    stack = int(stack)
+    return (int(length), stacks[stack] if stack >= 0 else ())
+
+
+def _first_difference(expected, actual):
+    """
+    Returns the first column where two runs of a line differ and the
+    scopes of both there.
+    """
+    def scopes_at(runs, column):
+        for length, scopes in runs:
+            if column < length:
+                return scopes
+            column -= length
+        return ()
+
+    # Adjacent runs have different scopes, so when two runs with the
+    # same scopes differ in length, the scopes differ after the
+    # shorter one.
+    column = 0
+    for (length, scopes), (other_length, other_scopes) in zip(expected, actual):
+        if scopes != other_scopes:
+            break
+        if length != other_length:
+            column += min(length, other_length)
+            break
+        column += length
+    return column, scopes_at(expected, column), scopes_at(actual, column)
+
+
+def update(path, tokenizer, documents):
+    """
+    Writes the snapshot of ``(name, text)`` documents.
+    """
+    snapshot = Snapshot()
+    for name, text in documents:
+        snapshot.add(name, text, snapshot_runs(tokenizer, text))
+    snapshot.write(path)
+    return snapshot
+
+
+def main(argv=None):
+    import argparse
+    from .grammar import Registry
+    from .tokenizer import Tokenizer
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('snapshot', help='snapshot file')
+    parser.add_argument('files', nargs='+', help='documents')
+    parser.add_argument('--grammar', default=os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'MarkdownLight.tmLanguage'))
+    parser.add_argument('--update', action='store_true',
+        help='write the snapshot instead of comparing with it')
+    args = parser.parse_args(argv)
+
+    tokenizer = Tokenizer(Registry().load(args.grammar))
+    documents = []
+    for path in args.files:
+        with open(path, encoding='utf-8') as f:
+            documents.append((os.path.basename(path), f.read()))
+    if args.update:
+        update(args.snapshot, tokenizer, documents)
+        print('Wrote {} documents to {}'.format(len(documents), args.snapshot),
+            file=sys.stderr)
+        return 0
+    snapshot = Snapshot.read(args.snapshot)
+    failed = 0
+    for name, text in documents:
+        messages = snapshot.compare(name, text, snapshot_runs(tokenizer, text))
+        for message in messages:
+            print(message)
+        failed += bool(messages)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
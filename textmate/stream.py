@@ -0,0 +1,81 @@
+"""
+Streaming tokenization of arbitrarily large documents.
+
+Only the rule stack is carried from one line to the next, so memory
+stays flat regardless of the size of the input:
+
+    >>> with open('CHANGELOG.md', encoding='utf-8') as f:
+    ...     stream = tokenize_stream(tokenizer, f)
+    ...     for line_no, tokens in stream:
+    ...         for begin, end, stack_id in tokens:
+    ...             print(line_no, begin, end, stream.stacks.name(stack_id))
+
+Scope stacks are reported as small integer ids interned in a
+ScopeStacks table; the number of distinct stacks depends on the
+grammar, not on the document.
+"""
+
+
+class ScopeStacks:
+    """
+    Interns scope stacks (tuples of scope names) as integer ids.
+    """
+    def __init__(self):
+        self.ids = {}
+        self.stacks = []
+
+    def __len__(self):
+        return len(self.stacks)
+
+    def intern(self, scopes):
+        stack_id = self.ids.get(scopes)
+        if stack_id is None:
+            stack_id = self.ids[scopes] = len(self.stacks)
+            self.stacks.append(scopes)
+        return stack_id
+
+    def scopes(self, stack_id):
+        return self.stacks[stack_id]
+
+    def name(self, stack_id):
+        """
+        Returns the scope name as reported by ``View.scope_name()``.
+        """
+        return ' '.join(self.stacks[stack_id]) + ' '
+
+
+class TokenStream:
+    """
+    An iterator of the tokens of the lines of a document, see
+    tokenize_stream(). ``stacks`` is the ScopeStacks table the stack
+    ids refer to and ``state`` the tokenizer state after the last line
+    read.
+    """
+    def __init__(self, tokenizer, lines, stacks=None, state=None):
+        self.tokenizer = tokenizer
+        self.stacks = stacks if stacks is not None else ScopeStacks()
+        self.state = state if state is not None else tokenizer.initial_state()
+        self._lines = enumerate(lines)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line_no, line = next(self._lines)
+        tokens, self.state = self.tokenizer.tokenize_line(line, self.state)
+        intern = self.stacks.intern
+        return line_no, [ (begin, end, intern(scopes))
+            for begin, end, scopes in tokens ]
+
+
+def tokenize_stream(tokenizer, lines, stacks=None, state=None):
+    """
+    Tokenizes an iterable of lines (e.g. a text file) lazily.
+
+    Returns a TokenStream yielding ``(line_no, tokens)`` for each line,
+    ``line_no`` counting from 0 and ``tokens`` being a list of
+    ``(begin, end, stack_id)`` with positions relative to the line
+    start. The ids refer to ``stacks``, a new ScopeStacks table
+    available as the ``stacks`` attribute of the stream if not given.
+    """
+    return TokenStream(tokenizer, lines, stacks, state)
@@ -0,0 +1,359 @@
+"""
+A minimal stand-in for the ``sublime`` module of Sublime Text.
+
+It implements the part of the API used by tests/fixture.py on top of
+the headless tokenizer, so that syntax tests can run without Sublime:
+
+    import sys
+    from textmate import sublime
+    sublime.add_package('MarkdownLight', '/path/to/MarkdownLight')
+    sys.modules['sublime'] = sublime
+
+Syntax files are referred to by their resource paths
+(``Packages/<package>/<file>``). Packages are registered with
+``add_package()``; in addition every directory listed in the
+``TEXTMATE_PACKAGES_PATH`` environment variable is treated as a
+Sublime ``Packages`` directory, which makes grammars included by scope
+name (``text.html.basic``, ``source.python``, ...) available.
+"""
+
+import bisect
+import os
+import re
+
+from .grammar import Registry
+from .incremental import Document
+from .tokenizer import Tokenizer
+
+LITERAL = 1
+IGNORECASE = 2
+
+_packages = {}
+_registry = Registry()
+_windows = []
+
+
+def _packages_paths():
+    value = os.environ.get('TEXTMATE_PACKAGES_PATH', '')
+    return [path for path in value.split(os.pathsep) if path]
+
+
+for _path in _packages_paths():
+    _registry.add_search_path(_path)
+
+
+def add_package(name, path):
+    """
+    Makes a package directory available as ``Packages/<name>``.
+    """
+    path = os.path.abspath(path)
+    _packages[name] = path
+    _registry.add_search_path(path)
+
+
+def registry():
+    return _registry
+
+
+def resource_path(resource):
+    """
+    Maps a ``Packages/<package>/<file>`` resource path to a file.
+    """
+    parts = resource.replace('\\', '/').split('/')
+    if len(parts) < 3 or parts[0] != 'Packages':
+        raise ValueError('Not a resource path: {}'.format(resource))
+    package, rest = parts[1], parts[2:]
+    if package in _packages:
+        return os.path.join(_packages[package], *rest)
+    for packages_path in _packages_paths():
+        path = os.path.join(packages_path, package, *rest)
+        if os.path.exists(path):
+            return path
+    raise IOError('Cannot find resource {}'.format(resource))
+
+
+class Syntax:
+    def __init__(self, path, name, scope):
+        self.path = path
+        self.name = name
+        self.scope = scope
+        self.hidden = False
+
+
+def find_syntax_by_scope(scope):
+    """
+    Returns the list of syntaxes providing the base scope.
+    """
+    grammar = (_registry.grammar_for_scope(scope)
+        if _registry.has_scope(scope) else None)
+    if grammar is None:
+        return []
+    return [ Syntax(grammar.path, grammar.name, grammar.scope_name) ]
+
+
+class Region:
+    __slots__ = ['a', 'b', 'xpos']
+
+    def __init__(self, a, b=None, xpos=-1):
+        if b is None:
+            b = a
+        self.a = a
+        self.b = b
+        self.xpos = xpos
+
+    def __str__(self):
+        return "(" + str(self.a) + ", " + str(self.b) + ")"
+
+    def __repr__(self):
+        return "(" + str(self.a) + ", " + str(self.b) + ")"
+
+    def __len__(self):
+        return self.size()
+
+    def __eq__(self, rhs):
+        return isinstance(rhs, Region) and self.a == rhs.a and self.b == rhs.b
+
+    def __lt__(self, rhs):
+        lhs_begin = self.begin()
+        rhs_begin = rhs.begin()
+        if lhs_begin == rhs_begin:
+            return self.end() < rhs.end()
+        return lhs_begin < rhs_begin
+
+    def __hash__(self):
+        return hash((self.a, self.b))
+
+    def empty(self):
+        return self.a == self.b
+
+    def begin(self):
+        return self.a if self.a < self.b else self.b
+
+    def end(self):
+        return self.b if self.a < self.b else self.a
+
+    def size(self):
+        return abs(self.a - self.b)
+
+    def contains(self, x):
+        if isinstance(x, Region):
+            return self.contains(x.a) and self.contains(x.b)
+        return x >= self.begin() and x <= self.end()
+
+    def cover(self, rhs):
+        a = min(self.begin(), rhs.begin())
+        b = max(self.end(), rhs.end())
+        if self.a < self.b:
+            return Region(a, b)
+        return Region(b, a)
+
+    def intersection(self, rhs):
+        if self.end() <= rhs.begin():
+            return Region(0)
+        if self.begin() >= rhs.end():
+            return Region(0)
+        return Region(max(self.begin(), rhs.begin()), min(self.end(), rhs.end()))
+
+    def intersects(self, rhs):
+        lb = self.begin()
+        le = self.end()
+        rb = rhs.begin()
+        re = rhs.end()
+        return ((lb == rb and le == re) or
+            (rb >= lb and rb < le) or (lb >= rb and lb < re))
+
+
+class Settings:
+    def __init__(self):
+        self._values = {}
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def set(self, key, value):
+        self._values[key] = value
+
+    def has(self, key):
+        return key in self._values
+
+    def erase(self, key):
+        self._values.pop(key, None)
+
+
+class View:
+    def __init__(self, window):
+        self._window = window
+        self._settings = Settings()
+        self._text = ''
+        self._selection_all = False
+        self._scratch = False
+        self._syntax = None
+        self._tokenizer = None
+        self._document = None
+        self._tokens = None
+        self._token_begins = None
+        self._line_begins = None
+
+    def window(self):
+        return self._window
+
+    def settings(self):
+        return self._settings
+
+    def set_scratch(self, scratch):
+        self._scratch = scratch
+
+    def is_scratch(self):
+        return self._scratch
+
+    def set_syntax_file(self, syntax_file):
+        grammar = _registry.load(resource_path(syntax_file))
+        self._syntax = syntax_file
+        self._tokenizer = Tokenizer(grammar)
+        self._document = Document(self._tokenizer, self._text)
+        self._invalidate()
+
+    def syntax(self):
+        return self._syntax
+
+    def run_command(self, command, args=None):
+        if command == 'select_all':
+            self._selection_all = True
+        elif command == 'left_delete':
+            if self._selection_all:
+                self._replace(0, len(self._text), '')
+                self._selection_all = False
+            elif self._text:
+                self._replace(len(self._text) - 1, len(self._text), '')
+        elif command == 'insert':
+            end = len(self._text)
+            begin = 0 if self._selection_all else end
+            self._replace(begin, end, (args or {}).get('characters', ''))
+            self._selection_all = False
+        else:
+            raise ValueError('Unsupported command: {}'.format(command))
+
+    def size(self):
+        return len(self._text)
+
+    def substr(self, x):
+        if isinstance(x, Region):
+            return self._text[x.begin():x.end()]
+        return self._text[x:x + 1]
+
+    def find_all(self, pattern, flags=0):
+        if flags & LITERAL:
+            pattern = re.escape(pattern)
+        regex = re.compile(pattern,
+            re.MULTILINE | (re.IGNORECASE if flags & IGNORECASE else 0))
+        return [ Region(m.start(), m.end())
+            for m in regex.finditer(self._text) ]
+
+    def rowcol(self, point):
+        lines = self._lines()
+        row = bisect.bisect_right(lines, point) - 1
+        return (row, point - lines[row])
+
+    def text_point(self, row, col):
+        lines = self._lines()
+        return lines[min(row, len(lines) - 1)] + col
+
+    def scope_name(self, point):
+        tokens = self._tokenize()
+        index = bisect.bisect_right(self._token_begins, point) - 1
+        if index < 0 or point >= len(self._text):
+            scopes = self._base_scopes()
+        else:
+            scopes = tokens[index][2]
+        return ' '.join(scopes) + ' '
+
+    def extract_tokens_with_scopes(self, region):
+        """
+        Returns ``(Region, scope_name)`` pairs for the runs of characters
+        with identical scopes that intersect the region.
+        """
+        tokens = self._tokenize()
+        begin = region.begin()
+        end = region.end()
+        index = max(bisect.bisect_right(self._token_begins, begin) - 1, 0)
+        result = []
+        while index < len(tokens) and tokens[index][0] < end:
+            token_begin, token_end, scopes = tokens[index]
+            result.append((
+                Region(max(token_begin, begin), min(token_end, end)),
+                ' '.join(scopes) + ' '
+            ))
+            index += 1
+        return result
+
+    def _base_scopes(self):
+        if self._tokenizer is None:
+            return ('text.plain',)
+        return self._tokenizer.grammar.root.name
+
+    def _tokenize(self):
+        if self._tokens is None:
+            if self._document is None:
+                self._tokens = [ (0, len(self._text), ('text.plain',)) ] \
+                    if self._text else []
+            else:
+                self._tokens = self._document.tokens()
+            self._token_begins = [ token[0] for token in self._tokens ]
+        return self._tokens
+
+    def _lines(self):
+        if self._line_begins is None:
+            self._line_begins = [0] + [
+                m.end() for m in re.finditer('\n', self._text) ]
+        return self._line_begins
+
+    def _replace(self, begin, end, string):
+        self._text = self._text[:begin] + string + self._text[end:]
+        if self._document is not None:
+            self._document.replace(begin, end, string)
+        self._invalidate()
+
+    def _invalidate(self):
+        self._tokens = None
+        self._token_begins = None
+        self._line_begins = None
+
+
+class Window:
+    def __init__(self):
+        self._views = []
+        self._active = None
+
+    def new_file(self):
+        view = View(self)
+        self._views.append(view)
+        self._active = view
+        return view
+
+    def views(self):
+        return list(self._views)
+
+    def active_view(self):
+        return self._active
+
+    def focus_view(self, view):
+        if view in self._views:
+            self._active = view
+
+    def run_command(self, command, args=None):
+        if command == 'close_file':
+            if self._active is not None:
+                self._views.remove(self._active)
+                self._active = self._views[-1] if self._views else None
+        else:
+            raise ValueError('Unsupported command: {}'.format(command))
+
+
+def active_window():
+    if not _windows:
+        _windows.append(Window())
+    return _windows[0]
+
+
+def windows():
+    return [ active_window() ]
@@ -0,0 +1,206 @@
+"""
+TextMate color themes (.tmTheme).
+
+Every setting of a theme applies a foreground, background and font
+style to the scopes matched by its selector. The style of a token is
+resolved property by property: the setting with the highest scoring
+selector that defines the property wins, later settings winning ties;
+properties no setting defines come from the global settings.
+
+Selectors are compiled once and indexed by the first component of their
+innermost element, so only settings that can match a scope stack are
+scored. Resolved styles are memoized per scope stack: a document only
+has a few hundred distinct stacks, so after warm-up styling a token is
+one dictionary lookup.
+
+    >>> theme = Theme.load('MarkdownLight.tmTheme')
+    >>> theme.style(('text.html.markdown', 'markup.bold.markdown'))
+    <Style foreground='#373b41' background='#ffffff' font_style='bold'>
+    >>> runs = theme.style_runs(tokenizer.tokenize(text))
+"""
+
+import json
+import plistlib
+
+from . import selector
+
+_PROPERTIES = ('foreground', 'background', 'fontStyle')
+
+
+def load_theme_file(path):
+    """
+    Reads a theme definition and returns it as a dictionary.
+
+    Supports plist (.tmTheme), YAML (.YAML-tmTheme, requires PyYAML) and
+    JSON files.
+    """
+    lower = path.lower()
+    if lower.endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    if lower.endswith('.yaml-tmtheme') or lower.endswith('.yaml'):
+        try:
+            import yaml
+        except ImportError as e:
+            raise ImportError('PyYAML is required to load {}'.format(path)) from e
+        with open(path, encoding='utf-8') as f:
+            return yaml.safe_load(f)
+    with open(path, 'rb') as f:
+        return plistlib.load(f)
+
+
+class Style:
+    """
+    Resolved colors and font style of a scope stack. ``font_style`` is
+    a space separated, sorted list of ``bold``, ``italic`` and
+    ``underline`` (empty for none).
+    """
+    __slots__ = ('foreground', 'background', 'font_style')
+
+    def __init__(self, foreground=None, background=None, font_style=''):
+        self.foreground = foreground
+        self.background = background
+        self.font_style = font_style
+
+    def __repr__(self):
+        return '<Style foreground={!r} background={!r} font_style={!r}>'.format(
+            self.foreground, self.background, self.font_style)
+
+    def __eq__(self, other):
+        return (isinstance(other, Style)
+            and self.foreground == other.foreground
+            and self.background == other.background
+            and self.font_style == other.font_style)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.foreground, self.background, self.font_style))
+
+
+class ThemeRule:
+    """
+    A scoped setting of a theme.
+    """
+    __slots__ = ('index', 'name', 'selector', 'settings')
+
+    def __init__(self, index, name, scope, settings):
+        self.index = index
+        self.name = name
+        self.selector = selector.compile(scope)
+        self.settings = { key: settings[key] for key in _PROPERTIES
+            if key in settings }
+
+    def __repr__(self):
+        return '<ThemeRule #{} {!r}>'.format(self.index, self.selector.text)
+
+
+def _font_style(value):
+    return ' '.join(sorted(set((value or '').split())))
+
+
+class Theme:
+    """
+    A loaded theme that resolves the style of scope stacks.
+
+    ``hits`` and ``misses`` count style() calls answered from the memo
+    and resolved from the selectors; see ``stats()``.
+    """
+    def __init__(self, raw, path=None):
+        self.raw = raw
+        self.path = path
+        self.name = raw.get('name')
+        self.defaults = {}
+        self.rules = []
+        for entry in raw.get('settings', []):
+            settings = entry.get('settings') or {}
+            scope = entry.get('scope')
+            if scope is None:
+                if not self.rules and not self.defaults:
+                    self.defaults = settings
+                continue
+            self.rules.append(ThemeRule(len(self.rules), entry.get('name'),
+                scope, settings))
+        self.default_style = Style(self.defaults.get('foreground'),
+            self.defaults.get('background'),
+            _font_style(self.defaults.get('fontStyle')))
+        self._index = {}
+        for rule in self.rules:
+            if not rule.settings:
+                continue
+            for atom in rule.selector.last_atoms():
+                rules = self._index.setdefault(atom[0], [])
+                if rule not in rules:
+                    rules.append(rule)
+        self._styles = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return '<Theme {}>'.format(self.name)
+
+    @classmethod
+    def load(cls, path):
+        return cls(load_theme_file(path), path)
+
+    def style(self, scopes):
+        """
+        Returns the Style of a scope stack (a tuple of scope names,
+        outermost first).
+        """
+        style = self._styles.get(scopes)
+        if style is not None:
+            self.hits += 1
+            return style
+        self.misses += 1
+        style = self._styles[scopes] = self.resolve(scopes)
+        return style
+
+    def resolve(self, scopes):
+        """
+        Resolves the Style of a scope stack without the memo.
+        """
+        stack = [ selector.components(scope) for scope in scopes ]
+        candidates = {}
+        for components in stack:
+            for rule in self._index.get(components[0], ()):
+                candidates[rule.index] = rule
+        best = {}
+        for index in sorted(candidates):
+            rule = candidates[index]
+            score = rule.selector.score_components(stack)
+            if score is None:
+                continue
+            for key in rule.settings:
+                if key not in best or score >= best[key][0]:
+                    best[key] = (score, rule.settings[key])
+        values = { key: value for key, (_, value) in best.items() }
+        return Style(values.get('foreground', self.default_style.foreground),
+            values.get('background', self.default_style.background),
+            _font_style(values['fontStyle']) if 'fontStyle' in values
+                else self.default_style.font_style)
+
+    def style_runs(self, tokens):
+        """
+        Returns ``(begin, end, style)`` runs of ``(begin, end, scopes)``
+        tokens, adjacent tokens with the same style being merged.
+        """
+        runs = []
+        style_of = self.style
+        for begin, end, scopes in tokens:
+            style = style_of(scopes)
+            if runs and runs[-1][2] == style and runs[-1][1] == begin:
+                runs[-1] = (runs[-1][0], end, style)
+            else:
+                runs.append((begin, end, style))
+        return runs
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stacks': len(self._styles),
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,388 @@
+"""
+Line based TextMate tokenizer.
+
+The tokenizer follows the Sublime Text flavour of the TextMate rules:
+
+- the text is processed line by line, each line including its ``\\n``;
+- at every position the earliest match among the ``end`` pattern of the
+  innermost open rule and its ``patterns`` wins, ties are resolved in
+  favour of the ``end`` pattern and then by order of the patterns;
+- ``\\N`` backreferences in ``end`` patterns refer to the text captured
+  by ``begin``;
+- a rule opened by an empty ``begin`` match cannot be closed by an empty
+  ``end`` match at the very same position. Grammars rely on this to
+  write ``end`` patterns that look at the following lines only (see
+  ``maybe_setext_heading`` and ``list_item`` in MarkdownLight).
+
+Within a line the scanner skips text where none of the patterns can
+start a match (see ``dispatch``) and searches all patterns of a rule
+with a single regex (see ``fused``).
+"""
+
+import re
+
+from .dispatch import Dispatch, first_chars
+from .fused import FusedScanner
+
+_LINE = re.compile(r'[^\n]*\n|[^\n]+')
+
+
+def split_lines(text):
+    """
+    Splits a text into lines that keep their ``\\n``. Unlike
+    ``str.splitlines()`` only ``\\n`` ends a line, as in Sublime Text.
+    """
+    return _LINE.findall(text)
+
+
+class ScanMismatch(AssertionError):
+    """
+    Raised in cross-check mode when the fused scanner and the pattern by
+    pattern scan disagree.
+    """
+
+
+class StackFrame:
+    """
+    An open begin/end rule together with the scopes it applies.
+
+    Frames are immutable; the rule stack is a linked list of frames so
+    that a stack can be stored per line and compared cheaply.
+    """
+    __slots__ = ('parent', 'rule', 'end', 'end_source', 'scopes',
+        'content_scopes', 'enter_pos', 'depth')
+
+    def __init__(self, parent, rule, end, end_source, scopes, content_scopes,
+            enter_pos=-1):
+        self.parent = parent
+        self.rule = rule
+        self.end = end
+        self.end_source = end_source
+        self.scopes = scopes
+        self.content_scopes = content_scopes
+        self.enter_pos = enter_pos
+        self.depth = parent.depth + 1 if parent is not None else 0
+
+    def __eq__(self, other):
+        a, b = self, other
+        while a is not b:
+            if (a is None or b is None
+                    or a.rule is not b.rule
+                    or a.end_source != b.end_source
+                    or a.content_scopes != b.content_scopes
+                    or a.scopes != b.scopes):
+                return False
+            a, b = a.parent, b.parent
+        return True
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.rule.id, self.end_source, self.depth))
+
+    def __repr__(self):
+        frames = []
+        frame = self
+        while frame is not None:
+            frames.append(repr(frame.rule))
+            frame = frame.parent
+        return '<StackFrame {}>'.format(' > '.join(reversed(frames)))
+
+    def reset(self):
+        """
+        Returns the same stack without positions that only make sense
+        within the current line.
+        """
+        parent = self.parent.reset() if self.parent is not None else None
+        if self.enter_pos == -1 and parent is self.parent:
+            return self
+        return StackFrame(parent, self.rule, self.end, self.end_source,
+            self.scopes, self.content_scopes)
+
+
+class LineTokens:
+    """
+    Collects ``(begin, end, scopes)`` tokens of a line, merging adjacent
+    tokens with identical scopes.
+    """
+    __slots__ = ('tokens', 'last', 'limit', 'offset')
+
+    def __init__(self, limit, offset=0):
+        self.tokens = []
+        self.last = 0
+        self.limit = limit
+        self.offset = offset
+
+    def produce(self, scopes, end):
+        if end > self.limit:
+            end = self.limit
+        if end <= self.last:
+            return
+        tokens = self.tokens
+        if tokens and tokens[-1][2] == scopes:
+            tokens[-1] = (tokens[-1][0], end + self.offset, scopes)
+        else:
+            tokens.append((self.last + self.offset, end + self.offset, scopes))
+        self.last = end
+
+
+class Tokenizer:
+    """
+    Tokenizes text with a grammar.
+
+    >>> tokenizer = Tokenizer(registry.load('MarkdownLight.tmLanguage'))
+    >>> tokens, state = tokenizer.tokenize_line('*A*\\n', tokenizer.initial_state())
+
+    With ``fused`` set to False every pattern is searched separately.
+    ``cross_check`` runs both scans at every position and raises
+    ScanMismatch when they disagree.
+    """
+    def __init__(self, grammar, fused=True, cross_check=False):
+        self.grammar = grammar
+        self.fused = fused
+        self.cross_check = cross_check
+        self._dispatch = {}
+        self._end_first_chars = {}
+        self._scanners = {}
+
+    def initial_state(self):
+        scopes = self.grammar.root.name
+        return StackFrame(None, self.grammar.root, None, None, scopes, scopes)
+
+    def tokenize(self, text):
+        """
+        Tokenizes the whole text and returns a list of
+        ``(begin, end, scopes)`` tokens with absolute positions.
+        """
+        tokens = []
+        state = self.initial_state()
+        offset = 0
+        for line in split_lines(text):
+            line_tokens, state = self.tokenize_line(line, state, offset)
+            tokens.extend(line_tokens)
+            offset += len(line)
+        return tokens
+
+    def tokenize_lines(self, lines, state=None):
+        """
+        Yields ``(tokens, state)`` for each line, token positions being
+        relative to the line.
+        """
+        if state is None:
+            state = self.initial_state()
+        for line in lines:
+            tokens, state = self.tokenize_line(line, state)
+            yield tokens, state
+
+    def tokenize_line(self, line, state, offset=0):
+        """
+        Tokenizes a single line (with its trailing newline, if any).
+
+        Returns the tokens of the line and the rule stack at its end.
+        """
+        text = line if line.endswith('\n') else line + '\n'
+        tokens = LineTokens(len(line), offset)
+        stack = state
+        pos = 0
+        while True:
+            found = self._scan(text, pos, stack)
+            if found is None:
+                tokens.produce(stack.content_scopes, len(text))
+                break
+            rule, m, is_end = found
+            start, end = m.span()
+            if is_end:
+                tokens.produce(stack.content_scopes, start)
+                _produce_captures(tokens, stack.scopes, m,
+                    stack.rule.end_captures)
+                tokens.produce(stack.scopes, end)
+                stack = stack.parent
+            elif rule.is_match():
+                tokens.produce(stack.content_scopes, start)
+                scopes = stack.content_scopes + rule.name
+                _produce_captures(tokens, scopes, m, rule.captures)
+                tokens.produce(scopes, end)
+                if start == end:
+                    # An empty match rule would be found again at the
+                    # same position forever.
+                    tokens.produce(stack.content_scopes, len(text))
+                    break
+            else:
+                tokens.produce(stack.content_scopes, start)
+                scopes = stack.content_scopes + rule.name
+                _produce_captures(tokens, scopes, m, rule.begin_captures)
+                tokens.produce(scopes, end)
+                end_regex = rule.end_for(m)
+                stack = StackFrame(stack, rule, end_regex, end_regex.pattern,
+                    scopes, scopes + rule.content_name,
+                    start if start == end else -1)
+            pos = end
+        return tokens.tokens, stack.reset()
+
+    def _scan(self, text, pos, stack):
+        """
+        Finds the earliest match at or after ``pos`` among the end
+        pattern of the innermost rule and its patterns.
+        """
+        if pos > 0:
+            pos = self._dispatch_for(stack).next_candidate(text, pos)
+            if pos < 0:
+                return None
+        if not self.fused:
+            return self._scan_separately(text, pos, stack)
+        found = self._scan_fused(text, pos, stack)
+        if self.cross_check:
+            expected = self._scan_separately(text, pos, stack)
+            if _describe(found) != _describe(expected):
+                raise ScanMismatch('{!r} at {} in {!r}: fused {}, expected {}'.format(
+                    stack, pos, text, _describe(found), _describe(expected)))
+        return found
+
+    def _scan_fused(self, text, pos, stack):
+        found = self._scanner_for(stack).search(text, pos)
+        if found is None:
+            return None
+        _, rule, m, is_end = found
+        if m.start() == m.end() and (m.start() == stack.enter_pos if is_end
+                else rule.is_begin_end() and _reopens(stack, rule, m.start())):
+            # The pattern by pattern scan looks for another match of the
+            # pattern in this case.
+            return self._scan_separately(text, pos, stack)
+        return rule, m, is_end
+
+    def _scan_separately(self, text, pos, stack):
+        best = None
+        best_start = len(text) + 1
+        if stack.end is not None and not stack.rule.apply_end_pattern_last:
+            m = self._search_end(text, pos, stack)
+            if m is not None:
+                best = (stack.rule, m, True)
+                best_start = m.start()
+                if best_start == pos:
+                    return best
+        for rule in stack.rule.candidates():
+            m = self._search_rule(text, pos, rule, stack)
+            if m is not None and m.start() < best_start:
+                best = (rule, m, False)
+                best_start = m.start()
+                if best_start == pos:
+                    return best
+        if stack.end is not None and stack.rule.apply_end_pattern_last:
+            m = self._search_end(text, pos, stack)
+            if m is not None and m.start() < best_start:
+                best = (stack.rule, m, True)
+        return best
+
+    def _scanner_for(self, stack):
+        """
+        Returns the FusedScanner for the patterns tried inside the
+        innermost rule, including its end pattern.
+        """
+        key = (stack.rule.id, stack.end_source)
+        scanner = self._scanners.get(key)
+        if scanner is None:
+            patterns = [ (rule, rule.match if rule.is_match() else rule.begin,
+                False, rule.first_chars) for rule in stack.rule.candidates() ]
+            if stack.end is not None:
+                end = (stack.rule, stack.end, True,
+                    self._end_first_chars_for(stack))
+                if stack.rule.apply_end_pattern_last:
+                    patterns.append(end)
+                else:
+                    patterns.insert(0, end)
+            scanner = FusedScanner(patterns)
+            self._scanners[key] = scanner
+        return scanner
+
+    def _dispatch_for(self, stack):
+        """
+        Returns the Dispatch for the patterns tried inside the innermost
+        rule, including its end pattern.
+        """
+        key = (stack.rule.id, stack.end_source)
+        dispatch = self._dispatch.get(key)
+        if dispatch is None:
+            chars = [ rule.first_chars for rule in stack.rule.candidates() ]
+            if stack.end_source is not None:
+                chars.append(self._end_first_chars_for(stack))
+            dispatch = Dispatch(chars)
+            self._dispatch[key] = dispatch
+        return dispatch
+
+    def _end_first_chars_for(self, stack):
+        if not stack.rule.end_references:
+            return stack.rule.end_first_chars
+        first = self._end_first_chars.get(stack.end_source)
+        if first is None:
+            first = self._end_first_chars[stack.end_source] = first_chars(
+                stack.end_source)
+        return first
+
+    @staticmethod
+    def _search_end(text, pos, stack):
+        m = stack.end.search(text, pos)
+        if (m is not None and m.start() == m.end() == stack.enter_pos):
+            # Do not close a rule at the position where it was opened
+            # by an empty begin match.
+            if pos >= len(text):
+                return None
+            m = stack.end.search(text, m.start() + 1)
+        return m
+
+    @staticmethod
+    def _search_rule(text, pos, rule, stack):
+        required = rule.first_chars.required
+        if required and any(text.find(s, pos) < 0 for s in required):
+            return None
+        regex = rule.match if rule.is_match() else rule.begin
+        m = regex.search(text, pos)
+        while (m is not None and rule.is_begin_end()
+                and m.start() == m.end()
+                and _reopens(stack, rule, m.start())):
+            if m.start() >= len(text):
+                return None
+            m = regex.search(text, m.start() + 1)
+        return m
+
+
+def _reopens(stack, rule, pos):
+    """
+    Checks whether the rule was already opened by an empty match at the
+    same position, which would lead to an endless loop.
+    """
+    frame = stack
+    while frame is not None and frame.enter_pos == pos:
+        if frame.rule is rule:
+            return True
+        frame = frame.parent
+    return False
+
+
+def _describe(found):
+    if found is None:
+        return None
+    rule, m, is_end = found
+    return (rule, is_end, m.span(),
+        [ m.span(group) for group in range(1, m.re.groups + 1) ])
+
+
+def _produce_captures(tokens, scopes, m, captures):
+    if not captures:
+        return
+    open_captures = []
+    for group in captures.groups:
+        if group > m.re.groups:
+            break
+        start, end = m.span(group)
+        if start < 0 or start == end:
+            continue
+        while open_captures and open_captures[-1][1] <= start:
+            capture_scopes, capture_end = open_captures.pop()
+            tokens.produce(capture_scopes, capture_end)
+        outer = open_captures[-1][0] if open_captures else scopes
+        tokens.produce(outer, start)
+        open_captures.append((outer + captures.scopes[group], end))
+    while open_captures:
+        capture_scopes, capture_end = open_captures.pop()
+        tokens.produce(capture_scopes, capture_end)